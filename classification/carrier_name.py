@@ -0,0 +1,74 @@
+'''
+The carrierName normalization getCarrierName applies after the carrierName lookup.
+
+get_stat_from_throttled_tests.py and plot_wehe_tests.py name the carrier of a live test with it,
+prefix_index.py applies it to every registry organization when it builds the offline index,
+so the index and the whois path give the same carrierName for the same organization.
+'''
+
+
+def wifiCarrierNameOfOrg(org):
+    # Remove special characters in carrierName to merge test results together
+    return ''.join(e for e in org if e.isalnum()) + ' (WiFi)'
+
+
+# French server names are manually verified
+def getFrenchCarrierName(wifiCarrierName):
+    carrierName = wifiCarrierName
+    if 'proxad' in wifiCarrierName:
+        carrierName = 'Free (WiFi)'
+    elif 'SFR' in wifiCarrierName:
+        carrierName = 'SFR (WiFi)'
+    elif 'orange' in wifiCarrierName:
+        carrierName = 'Orange (WiFi)'
+    elif 'bouyguestelecom' in wifiCarrierName:
+        carrierName = 'BouyguesTelecom (WiFi)'
+    elif 'gaoland' in wifiCarrierName:
+        carrierName = 'Free (WiFi)'
+    elif 'ORANGEFRANCEHSIAB' in wifiCarrierName:
+        carrierName = 'Orange (WiFi)'
+    elif 'BouyguesTelecomSA' in wifiCarrierName:
+        carrierName = 'BouyguesTelecom (WiFi)'
+    elif 'OrangeSA' in wifiCarrierName:
+        carrierName = 'Orange (WiFi)'
+    elif 'FreeSAS' in wifiCarrierName:
+        carrierName = 'Free (WiFi)'
+    elif 'BOUYGTEL' in wifiCarrierName:
+        carrierName = 'BouyguesTelecom (WiFi)'
+
+    return carrierName
+
+
+def mergeCarrierName(carrierName, networkType):
+    # combine the tests with carrierName variance
+    if ' ' in carrierName:
+        networkPortion = carrierName.split(' ')[1]
+        # combine carriernames
+        if 'VZW' in carrierName:
+            carrierName = 'Verizon ' + networkPortion
+        elif 'VzW' in carrierName:
+            carrierName = 'Verizon ' + networkPortion
+        elif 'Verizon' in carrierName:
+            carrierName = 'Verizon ' + networkPortion
+        elif 'O2UK' in carrierName:
+            carrierName = 'O2 ' + networkPortion
+        elif 'ATT' in carrierName:
+            carrierName = 'ATT ' + networkPortion
+        elif 'TMobile' in carrierName:
+            carrierName = 'TMobile ' + networkPortion
+        elif 'IowaWireless' in carrierName:
+            carrierName = 'iWireless ' + networkPortion
+    elif networkType == 'WIFI':
+        carrierName = carrierName + ' (WiFi)'
+    else:
+        carrierName = carrierName + ' (cellular)'
+
+    return carrierName
+
+
+def normalizeCarrierName(carrierName, networkType, country):
+    # Special case for French ISPs, manually verified the transforming from whois results to provider names
+    if country == 'France' and networkType == 'WIFI':
+        carrierName = getFrenchCarrierName(carrierName)
+
+    return mergeCarrierName(carrierName, networkType)
@@ -0,0 +1,361 @@
+'''
+Resident classification service: the model is loaded once, requests are classified in micro-batches.
+
+Every throttling_implementation_classify.py run imports its libraries, loads the model and reads the
+stats before classifying anything. This process keeps them loaded and answers over local HTTP,
+on 127.0.0.1:--port (default 8350) or on the Unix socket --socket PATH:
+
+    POST /classify   {"stats": [[avg_client, avg_server, std_client, std_server, loss_original, loss_inverted], ...]}
+                     {"features": [[4 classification features], ...]}
+                     {"uniqueTestIDs": ["userID_historyCount", ...]}   (looked up in the test stat store)
+          returns    {"labels": [1, 2, 3 or "unknown", ...], "probabilities": [[...], ...],
+                      "missing": [uniqueTestIDs not in the store], "batch_size": rows in the batch, "latency_ms": ...}
+                     stats or features that are not finite (a zero average throughput) are a 400, a uniqueTestID
+                     whose stored stats are gets the label "invalid" and probabilities null
+    GET /status      the model, the number of requests and their mean and max latency
+
+The rows of requests that arrive within MAX_WAIT of each other (up to MAX_BATCH rows) are classified
+by one predict_proba, if that fails every request of the batch is classified on its own so only
+the request that caused it fails. The model file is reloaded when its mtime changes, the test stat store when it is
+written again, so a retrained model or new stats are picked up without a restart.
+
+python classification_service.py [model_file] <test_stat_store> <--port N> <--socket PATH> <--threshold T> <--verbose>
+model_file is trained_model.npz (see compiled_model.py) or a pickled trained_model.sav.
+'''
+
+import json
+import os
+import queue
+import signal
+import socketserver
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+
+import compiled_model
+import test_stat_store
+
+DEFAULT_PORT = 8350
+PROBABILITY_THRESHOLD = 0.6
+# a batch is classified when it has MAX_BATCH rows or MAX_WAIT seconds after its first request
+MAX_BATCH = 4096
+MAX_WAIT = 0.005
+
+
+def label_name(probabilities, threshold):
+    # as throttling_implementation_classify.py labels a test
+    if max(probabilities) < threshold:
+        return "unknown"
+    return probabilities.index(max(probabilities)) + 1
+
+
+class Batcher(object):
+    '''
+    Collects the rows of concurrent requests into one predict_proba, reloads the model when its file changes.
+    '''
+    def __init__(self, model_file, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        self.model_file = model_file
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.model = None
+        self.model_mtime = None
+        self.model_missing = False
+        self.queue = queue.Queue()
+        self.reload()
+        if self.model is None:
+            raise ValueError("can not load the model {}".format(model_file))
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.model_file).st_mtime_ns
+        except OSError:
+            # removed (a promoted model that is not an SVC has no .npz), the current model is used until
+            # the file is there again
+            if not self.model_missing and self.model is not None:
+                print("model file {} is missing, still classifying with the model loaded from it".format(
+                    self.model_file))
+            self.model_missing = True
+            return
+        self.model_missing = False
+        if mtime == self.model_mtime:
+            return
+        try:
+            model = compiled_model.load_model(self.model_file)
+        except Exception as e:
+            print("FAIL at loading model", self.model_file, e)
+            return
+        self.model = model
+        self.model_mtime = mtime
+        print("loaded model", self.model_file)
+
+    def classify(self, features):
+        # blocks until the batch with these rows is classified, returns (probabilities, rows in the batch)
+        request = {"features": features, "done": threading.Event()}
+        self.queue.put(request)
+        request["done"].wait()
+        if "error" in request:
+            raise request["error"]
+        return request["probabilities"], request["batch_size"]
+
+    def run(self):
+        while True:
+            requests = [self.queue.get()]
+            num_rows = len(requests[0]["features"])
+            deadline = time.time() + self.max_wait
+            while num_rows < self.max_batch:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                num_rows += len(request["features"])
+
+            self.reload()
+            try:
+                probabilities = self.model.predict_proba(np.concatenate([request["features"] for request in requests]))
+                offset = 0
+                for request in requests:
+                    request["probabilities"] = probabilities[offset:offset + len(request["features"])]
+                    request["batch_size"] = num_rows
+                    offset += len(request["features"])
+            except Exception as e:
+                if len(requests) == 1:
+                    requests[0]["error"] = e
+                else:
+                    # one request should not fail the others of its batch
+                    for request in requests:
+                        try:
+                            request["probabilities"] = self.model.predict_proba(request["features"])
+                            request["batch_size"] = len(request["features"])
+                        except Exception as request_error:
+                            request["error"] = request_error
+            for request in requests:
+                request["done"].set()
+
+
+class StatIndex(object):
+    '''
+    The stats of every uniqueTestID of a test stat store (or test_stat_per_carrier_replay.json),
+    read again when the store is written again.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.signature = None
+        self.rows = {}
+        self.stats = np.zeros((0, 6))
+        self.lock = threading.Lock()
+
+    def current_signature(self):
+        index_file = os.path.join(self.path, test_stat_store.INDEX_FILE) if os.path.isdir(self.path) else self.path
+        try:
+            return os.stat(index_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def refresh(self):
+        signature = self.current_signature()
+        if signature is None or signature == self.signature:
+            return
+        test_stat = test_stat_store.load(self.path)
+        unique_test_ids = []
+        stats = []
+        for ISP_replay in test_stat:
+            test_ids, test_stats = test_stat_store.load_stats(test_stat, ISP_replay)
+            unique_test_ids += test_ids
+            stats.append(test_stats)
+        self.stats = np.concatenate(stats) if stats else np.zeros((0, 6))
+        self.rows = {uniqueTestID: row for row, uniqueTestID in enumerate(unique_test_ids)}
+        self.signature = signature
+        print("loaded", len(self.rows), "test stats from", self.path)
+
+    def lookup(self, unique_test_ids):
+        # (stats of the uniqueTestIDs in the store, the uniqueTestIDs found, the ones missing)
+        with self.lock:
+            self.refresh()
+            found = [uniqueTestID for uniqueTestID in unique_test_ids if uniqueTestID in self.rows]
+            stats = self.stats[[self.rows[uniqueTestID] for uniqueTestID in found]].reshape(-1, 6)
+        missing = [uniqueTestID for uniqueTestID in unique_test_ids if uniqueTestID not in self.rows]
+        return stats, found, missing
+
+
+class ClassificationHandler(BaseHTTPRequestHandler):
+    '''
+    POST /classify and GET /status, the service state is on self.server.
+    '''
+    def send_json(self, status, content):
+        # NaN or Infinity would not be valid json
+        body = json.dumps(content, allow_nan=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/status":
+            self.send_json(404, {"error": "unknown path {}".format(self.path)})
+            return
+        self.send_json(200, self.server.status())
+
+    def do_POST(self):
+        start = time.time()
+        if self.path != "/classify":
+            self.send_json(404, {"error": "unknown path {}".format(self.path)})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            unique_test_ids = None
+            missing = []
+            if "uniqueTestIDs" in request:
+                if self.server.stat_index is None:
+                    raise ValueError("no test stat store, uniqueTestIDs can not be looked up")
+                stats, unique_test_ids, missing = self.server.stat_index.lookup(request["uniqueTestIDs"])
+                features = test_stat_store.stat_features(stats)
+            elif "stats" in request:
+                features = test_stat_store.stat_features(np.array(request["stats"], dtype=np.float64).reshape(-1, 6))
+            else:
+                features = np.array(request["features"], dtype=np.float64).reshape(-1, 4)
+            valid = test_stat_store.finite_rows(features)
+            if unique_test_ids is None and not valid.all():
+                raise ValueError("rows {} are not finite (a zero average throughput?)".format(
+                    np.flatnonzero(~valid).tolist()))
+        except Exception as e:
+            self.send_json(400, {"error": "bad request: {}".format(e)})
+            return
+
+        try:
+            if valid.any():
+                probabilities, batch_size = self.server.batcher.classify(features[valid])
+            else:
+                probabilities, batch_size = np.zeros((0, 0)), 0
+        except Exception as e:
+            self.send_json(500, {"error": "FAIL at classifying: {}".format(e)})
+            return
+
+        # the stored tests whose stats are not finite are not classified
+        rows = iter(probabilities.tolist())
+        probabilities = [next(rows) if row_valid else None for row_valid in valid.tolist()]
+        response = {"labels": [label_name(row, self.server.threshold) if row is not None else "invalid"
+                               for row in probabilities],
+                    "probabilities": probabilities, "missing": missing, "batch_size": batch_size}
+        if unique_test_ids is not None:
+            response["uniqueTestIDs"] = unique_test_ids
+        latency = time.time() - start
+        response["latency_ms"] = 1000 * latency
+        self.server.record(len(features), latency)
+        self.send_json(200, response)
+        if self.server.verbose:
+            print("{} tests, batch of {}, {:.2f} ms".format(len(features), batch_size, 1000 * latency))
+
+    def log_message(self, format, *args):
+        # the requests are reported by --verbose, with their latency
+        pass
+
+
+class ServiceState(object):
+    '''
+    What the handlers share: the batcher, the stat index, the threshold and the request statistics.
+    '''
+    def setup_service(self, batcher, stat_index, threshold, verbose):
+        self.batcher = batcher
+        self.stat_index = stat_index
+        self.threshold = threshold
+        self.verbose = verbose
+        self.stats_lock = threading.Lock()
+        self.num_requests = 0
+        self.num_tests = 0
+        self.total_latency = 0
+        self.max_latency = 0
+
+    def record(self, num_tests, latency):
+        with self.stats_lock:
+            self.num_requests += 1
+            self.num_tests += num_tests
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def status(self):
+        with self.stats_lock:
+            return {"model": self.batcher.model_file, "model_mtime_ns": self.batcher.model_mtime,
+                    "stat_store": self.stat_index.path if self.stat_index else None,
+                    "requests": self.num_requests, "tests": self.num_tests,
+                    "mean_latency_ms": 1000 * self.total_latency / self.num_requests if self.num_requests else 0,
+                    "max_latency_ms": 1000 * self.max_latency}
+
+
+class TCPService(ServiceState, ThreadingHTTPServer):
+    # many clients connect at once, the socketserver default backlog is 5
+    request_queue_size = 128
+
+
+class UnixService(ServiceState, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def main():
+    args = sys.argv[1:]
+    port = DEFAULT_PORT
+    socket_path = None
+    threshold = PROBABILITY_THRESHOLD
+    verbose = '--verbose' in args
+    if verbose:
+        args.remove('--verbose')
+    try:
+        if '--port' in args:
+            i = args.index('--port')
+            port = int(args[i + 1])
+            del args[i:i + 2]
+        if '--socket' in args:
+            i = args.index('--socket')
+            socket_path = args[i + 1]
+            del args[i:i + 2]
+        if '--threshold' in args:
+            i = args.index('--threshold')
+            threshold = float(args[i + 1])
+            del args[i:i + 2]
+        model_file = args[0]
+        stat_path = args[1] if len(args) > 1 else None
+    except:
+        print('\r\n Please provide the following inputs: [model_file] <test_stat_store> <--port N> <--socket PATH> <--threshold T> <--verbose>')
+        sys.exit()
+
+    batcher = Batcher(model_file)
+    stat_index = None
+    if stat_path:
+        stat_index = StatIndex(stat_path)
+        stat_index.refresh()
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixService(socket_path, ClassificationHandler)
+        print("serving on", socket_path)
+    else:
+        server = TCPService(("127.0.0.1", port), ClassificationHandler)
+        print("serving on 127.0.0.1:{}".format(port))
+    server.setup_service(batcher, stat_index, threshold, verbose)
+    # stopped by kill as well, the socket file is removed either way
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+'''
+The trained implementation-type classifier as plain arrays, evaluated with numpy only.
+
+trained_model.sav is a pickled scikit-learn SVC(probability=True), loading it imports sklearn and
+only works with a compatible sklearn version. export() writes what predict_proba needs to an .npz:
+    format_version            MODEL_FORMAT_VERSION
+    classes                   the labels, in the column order of predict_proba
+    support_vectors           n_SV x n_features, grouped by class
+    n_support                 number of support vectors of every class
+    dual_coef                 (n_classes - 1) x n_SV, the libsvm coefficients
+    intercept                 one per pair of classes (-rho)
+    gamma                     of the RBF kernel exp(-gamma * |x - sv|^2)
+    probA, probB              Platt scaling of every pair of classes, 1 / (1 + exp(A * f + B))
+CompiledSVC.predict_proba() computes what libsvm computes: the decision value of every pair of classes,
+its sigmoid, and the pairwise coupling of Wu, Lin and Weng (method 2, as svm_predict_probability),
+for all rows at once. The probabilities agree with the sklearn model to rounding (~1e-12).
+
+Run this file to convert a pickled model (needs the sklearn version it was saved with):
+    python compiled_model.py [trained_model.sav] [trained_model.npz]
+'''
+
+import pickle
+import sys
+
+import numpy as np
+
+# bump whenever the arrays or their meaning change
+MODEL_FORMAT_VERSION = 1
+
+# libsvm clips the pairwise probabilities to [MIN_PROB, 1 - MIN_PROB]
+MIN_PROB = 1e-7
+# rows whose kernel values are computed at once
+BATCH_SIZE = 2048
+
+
+def export(model, path):
+    # write a fitted SVC(kernel='rbf', probability=True) to path (.npz)
+    if getattr(model, "kernel", None) != "rbf":
+        raise ValueError("only RBF kernel SVMs can be exported, not {}".format(getattr(model, "kernel", model)))
+    probA = np.asarray(getattr(model, "probA_", []), dtype=np.float64)
+    probB = np.asarray(getattr(model, "probB_", []), dtype=np.float64)
+    num_classes = len(model.classes_)
+    if len(probA) != num_classes * (num_classes - 1) // 2:
+        raise ValueError("the model was not trained with probability=True, it has no Platt scaling")
+
+    with open(path, "wb") as f:
+        np.savez(f, format_version=np.array(MODEL_FORMAT_VERSION),
+                 classes=np.asarray(model.classes_),
+                 support_vectors=np.asarray(model.support_vectors_, dtype=np.float64),
+                 n_support=np.asarray(model.n_support_, dtype=np.int64),
+                 # the libsvm coefficients, sklearn flips the sign of dual_coef_/intercept_ for two classes
+                 dual_coef=np.asarray(model._dual_coef_, dtype=np.float64),
+                 intercept=np.asarray(model._intercept_, dtype=np.float64),
+                 gamma=np.array(model._gamma, dtype=np.float64),
+                 probA=probA, probB=probB)
+
+
+def sigmoid_predict(decision_values, A, B):
+    # 1 / (1 + exp(A * f + B)), in the form that does not overflow
+    fApB = decision_values * A + B
+    positive = fApB >= 0
+    exp = np.exp(-np.abs(fApB))
+    return np.where(positive, exp / (1.0 + exp), 1.0 / (1.0 + exp))
+
+
+def multiclass_probability(r):
+    # pairwise coupling of every row, r[:, i, j] is the probability of i against j (libsvm multiclass_probability)
+    num_rows, k = r.shape[:2]
+    Q = -r.transpose(0, 2, 1) * r
+    diagonal = (r.transpose(0, 2, 1) ** 2).sum(axis=2) - (np.diagonal(r, axis1=1, axis2=2) ** 2)
+    Q[:, np.arange(k), np.arange(k)] = diagonal
+
+    p = np.full((num_rows, k), 1.0 / k)
+    eps = 0.005 / k
+    active = np.arange(num_rows)
+    for iteration in range(max(100, k)):
+        Qa = Q[active]
+        pa = p[active]
+        Qp = np.einsum('nij,nj->ni', Qa, pa)
+        pQp = (pa * Qp).sum(axis=1)
+        # rows that converged keep their probabilities
+        converged = np.abs(Qp - pQp[:, None]).max(axis=1) < eps
+        active = active[~converged]
+        if not len(active):
+            break
+        Qa = Qa[~converged]
+        pa = pa[~converged]
+        Qp = Qp[~converged]
+        pQp = pQp[~converged]
+        for t in range(k):
+            diff = (-Qp[:, t] + pQp) / Qa[:, t, t]
+            pa[:, t] += diff
+            pQp = (pQp + diff * (diff * Qa[:, t, t] + 2 * Qp[:, t])) / (1 + diff) / (1 + diff)
+            Qp = (Qp + diff[:, None] * Qa[:, t, :]) / (1 + diff)[:, None]
+            pa /= (1 + diff)[:, None]
+        p[active] = pa
+    return p
+
+
+class CompiledSVC(object):
+    '''
+    predict_proba of an exported SVC, numpy only.
+    '''
+    def __init__(self, path):
+        with np.load(path) as npz:
+            format_version = int(npz["format_version"])
+            if format_version != MODEL_FORMAT_VERSION:
+                raise ValueError("{} is model format {}, expected {}".format(path, format_version,
+                                                                             MODEL_FORMAT_VERSION))
+            self.classes_ = npz["classes"]
+            self.support_vectors = npz["support_vectors"]
+            self.n_support = npz["n_support"]
+            self.dual_coef = npz["dual_coef"]
+            self.intercept = npz["intercept"]
+            self.gamma = float(npz["gamma"])
+            self.probA = npz["probA"]
+            self.probB = npz["probB"]
+
+        k = len(self.classes_)
+        start = np.concatenate([[0], np.cumsum(self.n_support)])
+        # the pairs of classes in libsvm order, and the coefficient of every support vector in every pair
+        self.pairs = [(i, j) for i in range(k) for j in range(i + 1, k)]
+        self.pair_coef = np.zeros((len(self.pairs), len(self.support_vectors)))
+        for p, (i, j) in enumerate(self.pairs):
+            self.pair_coef[p, start[i]:start[i + 1]] = self.dual_coef[j - 1, start[i]:start[i + 1]]
+            self.pair_coef[p, start[j]:start[j + 1]] = self.dual_coef[i, start[j]:start[j + 1]]
+
+    def decision_values(self, X):
+        # decision value of every pair of classes, rows x pairs
+        X = np.asarray(X, dtype=np.float64).reshape(-1, self.support_vectors.shape[1])
+        values = np.empty((len(X), len(self.pairs)))
+        sv_square = (self.support_vectors ** 2).sum(axis=1)
+        for begin in range(0, len(X), BATCH_SIZE):
+            batch = X[begin:begin + BATCH_SIZE]
+            # |x - sv|^2 = |x|^2 + |sv|^2 - 2 x.sv
+            distance = (batch ** 2).sum(axis=1)[:, None] + sv_square[None, :] - 2 * batch.dot(self.support_vectors.T)
+            kernel = np.exp(-self.gamma * np.maximum(distance, 0))
+            values[begin:begin + BATCH_SIZE] = kernel.dot(self.pair_coef.T) + self.intercept
+        return values
+
+    def predict_proba(self, X):
+        decision_values = self.decision_values(X)
+        k = len(self.classes_)
+        pairwise = np.clip(sigmoid_predict(decision_values, self.probA, self.probB), MIN_PROB, 1 - MIN_PROB)
+        # coupled for two classes too, as sklearn's libsvm does
+        r = np.zeros((len(decision_values), k, k))
+        for p, (i, j) in enumerate(self.pairs):
+            r[:, i, j] = pairwise[:, p]
+            r[:, j, i] = 1 - pairwise[:, p]
+        return multiclass_probability(r)
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+def load_model(path):
+    # an exported .npz model, or a pickled sklearn model for anything else
+    if path.endswith(".npz"):
+        return CompiledSVC(path)
+    return pickle.load(open(path, "rb"))
+
+
+def main():
+    try:
+        model_file = sys.argv[1]
+        npz_file = sys.argv[2]
+    except:
+        print('\r\n Please provide the following inputs: [trained_model.sav] [trained_model.npz]')
+        sys.exit()
+
+    export(pickle.load(open(model_file, "rb")), npz_file)
+    print("exported", model_file, "to", npz_file)
+
+
+if __name__ == "__main__":
+    main()
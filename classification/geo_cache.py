@@ -0,0 +1,205 @@
+'''
+Reverse geocoding of the test locations, batched and cached on disk, and the loadMobileStats
+shared by the classification scripts.
+
+loadMobileStats used to call reverse_geocode.search() with a single point for every test, a
+KD-tree query (and the list building around it) per test for coordinates that repeat a lot
+(the same user tests from the same place). Here
+    prefetch(mobileStats list)  geocodes every coordinate of a whole record directory in one search() call
+    geocode(coordinates)        answers from the cache and searches only the missing coordinates
+and the (lat, lon) -> (country, city, country_code) table is kept in a json file, so
+a rerun only geocodes the coordinates of new tests.
+
+The cache is keyed on the exact coordinates loadMobileStats geocodes (they are only rounded to
+0.1 degree after geocoding), so the results are the same as one search() per test.
+
+New coordinates are kept in memory and written in batches, every FLUSH_EVERY coordinates or FLUSH_INTERVAL
+seconds and when the process exits (a --workers process too), as whois_cache does. A write merges them into
+the file under an flock on GEO_CACHE_FILE.lock, so processes writing at the same time do not lose each other's.
+
+Environment variables:
+    GEO_CACHE_FILE  json file of the cache (default ~/.cache/throttling_geo_cache.json), empty to keep it in memory only
+'''
+
+import atexit
+import fcntl
+import json
+import multiprocessing.util
+import os
+import sys
+import tempfile
+import time
+import traceback
+
+import reverse_geocode
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "throttling_geo_cache.json")
+# new coordinates are written to the file in batches of FLUSH_EVERY, or after FLUSH_INTERVAL seconds
+FLUSH_EVERY = 64
+FLUSH_INTERVAL = 60
+
+
+def cache_file():
+    return os.environ.get("GEO_CACHE_FILE", DEFAULT_CACHE_FILE)
+
+
+def coordinate_key(lat, lon):
+    # repr round-trips the float, "42.3398,-71.0892"
+    return "{!r},{!r}".format(float(lat), float(lon))
+
+
+def load(path=None):
+    if path is None:
+        path = cache_file()
+    if path and os.path.exists(path):
+        try:
+            return json.load(open(path, 'r'))
+        except ValueError:
+            print("FAIL at loading geo cache", path)
+    return {}
+
+
+def save(table, path=None):
+    # merge table into the cache file, returns the merged table
+    if path is None:
+        path = cache_file()
+    if not path:
+        return table
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    # other processes may have geocoded other coordinates since we loaded, the read-merge-write is done under a lock
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        merged = load(path)
+        merged.update(table)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(merged, f)
+        os.replace(tmp_path, path)
+
+    return merged
+
+
+# the cache of this process, loaded on first use
+_table = None
+# coordinates geocoded since the last flush, the time of that flush and the process that registered the exit flush
+_pending = {}
+_last_flush = time.time()
+_exit_flush_pid = None
+
+
+def get_table():
+    global _table
+    if _table is None:
+        _table = load()
+    return _table
+
+
+def geocode(coordinates):
+    # [(country, city, country_code)] for [(lat, lon)], one reverse_geocode.search() for all the uncached ones
+    global _exit_flush_pid
+    table = get_table()
+    keys = [coordinate_key(lat, lon) for lat, lon in coordinates]
+
+    missing = {}
+    for key, (lat, lon) in zip(keys, coordinates):
+        if key not in table and key not in missing:
+            missing[key] = (float(lat), float(lon))
+
+    if missing:
+        for key, geoInfo in zip(missing, reverse_geocode.search(list(missing.values()))):
+            table[key] = _pending[key] = [geoInfo['country'], geoInfo['city'], geoInfo['country_code']]
+
+        if _exit_flush_pid != os.getpid():
+            # a forked worker does not run atexit, multiprocessing runs its finalizers when it exits
+            atexit.register(flush)
+            multiprocessing.util.Finalize(None, flush, exitpriority=10)
+            _exit_flush_pid = os.getpid()
+        if len(_pending) >= FLUSH_EVERY or time.time() - _last_flush >= FLUSH_INTERVAL:
+            flush()
+
+    return [tuple(table[key]) for key in keys]
+
+
+def flush():
+    global _last_flush
+    _last_flush = time.time()
+    if not cache_file():
+        _pending.clear()
+        return
+    if not _pending:
+        return
+    try:
+        merged = save(dict(_pending))
+        _pending.clear()
+        get_table().update(merged)
+    except OSError as e:
+        print("FAIL at saving geo cache", e)
+
+
+def coordinates_to_geocode(mobileStats):
+    # the (lat, lon) loadMobileStats would geocode for this test, None if it does not need geocoding
+    try:
+        lat = mobileStats['locationInfo']['latitude']
+        lon = mobileStats['locationInfo']['longitude']
+        if 'country' in mobileStats['locationInfo'] and 'countryCode' in mobileStats['locationInfo'] and lat:
+            return None
+        elif (lat == lon == '0.0') or (lat == lon == 0.0) or (lat == 'nil') or (lat == 'null'):
+            return None
+        elif lat:
+            return float(lat), float(lon)
+    except Exception:
+        # loadMobileStats reports it
+        return None
+    return None
+
+
+def prefetch(mobileStatsList):
+    # geocode the locations of all these tests at once, returns the number of distinct coordinates
+    coordinates = set()
+    for mobileStats in mobileStatsList:
+        if not mobileStats:
+            continue
+        point = coordinates_to_geocode(mobileStats)
+        if point:
+            coordinates.add(point)
+    if coordinates:
+        geocode(sorted(coordinates))
+    return len(coordinates)
+
+
+def loadMobileStats(mobileStats):
+    # use mobile stats to locate the geoInfo
+    try:
+        lat = mobileStats['locationInfo']['latitude']
+        lon = mobileStats['locationInfo']['longitude']
+        # later version of the replay server stores location info in replayInfo file
+        if 'country' in mobileStats['locationInfo'] and 'countryCode' in mobileStats['locationInfo'] and lat:
+            lat = float("{0:.1f}".format(float(lat)))
+            lon = float("{0:.1f}".format(float(lon)))
+            country = mobileStats['locationInfo']['country']
+            city = mobileStats['locationInfo']['city']
+            countryCode = mobileStats['locationInfo']['countryCode']
+        elif (lat == lon == '0.0') or (lat == lon == 0.0) or (lat == 'nil') or (lat == 'null'):
+            lat = lon = ''
+            country = ''
+            city = ''
+            countryCode = ''
+        elif lat:
+            country, city, countryCode = geocode([(float(lat), float(lon))])[0]
+            countryCode = countryCode.lower()
+            lat = float("{0:.1f}".format(float(lat)))
+            lon = float("{0:.1f}".format(float(lon)))
+        else:
+            lat = lon = country = countryCode = city = ''
+
+    except Exception as e:
+        traceback.print_exc(file=sys.stdout)
+        country = ''
+        city = ''
+        countryCode = ''
+        lat = lon = ''
+
+    return lat, lon, country, countryCode, city
@@ -10,18 +10,32 @@ Save all these stat as dictionaries separated by uniqueID separated by ISP_repla
 into test_stat_per_carrier_replay
 
 test_stat_per_carrier_replay[ISP_replay][uniqueID] = test_stat
+
+It is saved as test_stat_per_carrier_replay.json and as the columnar store test_stat_per_carrier_replay_store/
+(one .npz file per ISP_replay, see test_stat_store.py), the classification and plotting scripts take either.
+
+python get_stat_from_throttled_tests.py [data_directory] [result_directory] [plotting?] <--workers N> <--whois-concurrency N>
+With --workers N the tests are analyzed by N processes, the results (and the tests that get plotted,
+the first num_plots of every ISP_replay) are the same as in a serial run
+
+Before the analysis the clientIPs of all WiFi tests are resolved with up to --whois-concurrency
+(default 16) whois lookups in parallel (see whois_resolver.py), 0 leaves them to getCarrierName one by one
+
+Every analyzed test is appended to [result_directory]/test_stat_per_carrier_replay.checkpoint as soon
+as it is done, the tests that can not be used or fail as "skipped"/"failed". A rerun (after a crash,
+or nightly on a growing data_directory) only analyzes the tests that are not in it yet or whose
+replayInfo file changed. Delete the checkpoint to start over (or to retry the failed tests).
 '''
 
 import sys
 import subprocess
 import os
 import matplotlib
-import glob
 import numpy
 import json
+import multiprocessing
 import pickle
 import traceback
-import reverse_geocode
 import statistics
 
 import matplotlib.pyplot as plt
@@ -31,6 +45,17 @@ from scipy.stats import ks_2samp
 from threading import Timer
 from sklearn.metrics import r2_score
 
+import carrier_name
+import geo_cache
+import manifest
+import pcap_reader
+import prefix_index
+import record_store
+import test_stat_store
+import throughput
+import whois_cache
+import whois_resolver
+
 APPNAME_TO_PORT = {
     "Vimeo": "443",
     "Spotify": "80",
@@ -50,6 +75,10 @@ APPNAME_TO_PORT = {
     "AppleMusic": "80"
 }
 
+# every analyzed test is appended here (in the result directory) as one json line,
+# a rerun skips the tests already in it
+CHECKPOINT_FILE = "test_stat_per_carrier_replay.checkpoint"
+
 try:
     import seaborn as sns
 
@@ -167,210 +196,37 @@ def doXputsCDFplots(gputs_original, client_gputs_original, gputs_inverted,
     plt.close()
 
 
-def doTputsInterval(timeL, packetL, client_sampling_interval):
-    initS = packetL[0]
-
-    sequence = [(int(x) - int(initS)) for x in packetL]
-    timeL = [float(x) for x in timeL]
-
-    duration = timeL[-1]
-    xput_interval = client_sampling_interval
-
-    # print("duration, interval", duration, xput_interval)
-
-    untilT = xput_interval
-    lastT = 0
-    tputs = []
-    ts = []
-    for i in range(len(timeL)):
-        # Calculate bytes sent during this period
-        if timeL[i] >= untilT:
-            tputs.append((sequence[i] - sequence[lastT]) / xput_interval)
-            lastT = i
-            untilT += xput_interval
-            ts.append(timeL[i])
-
-    tputs = [x * 8 / 1000000.0 for x in tputs]
-
-    return tputs, ts
-
-
-def doTputs(timeL, packetL, num_buckets=None):
-    initS = packetL[0]
-
-    sequence = [(int(x) - int(initS)) for x in packetL]
-    timeL = [float(x) for x in timeL]
-
-    if not num_buckets:
-        # If number of bucket is not specified, use 100 buckets
-        num_buckets = 100
-    else:
-        num_buckets = num_buckets
-
-    duration = timeL[-1]
-    xput_interval = float(duration) / num_buckets
-
-    # print("duration, interval", duration, xput_interval)
-
-    untilT = xput_interval
-    lastT = 0
-    tputs = []
-    ts = []
-    for i in range(len(timeL)):
-        # Calculate bytes sent during this period
-        if timeL[i] >= untilT:
-            tputs.append((sequence[i] - sequence[lastT]) / xput_interval)
-            lastT = i
-            untilT += xput_interval
-            ts.append(timeL[i])
-
-    tputs = [x * 8 / 1000000.0 for x in tputs]
-
-    return tputs, ts
-
-
 # if there are more than 5 losses, skip the first 2 losses when getting the sequence number
 # there might be a buffer before losses
-def get_pcap_stat(pcapFile, server_port=None, skip_loss=2):
+def get_pcap_stat(pcapFile, server_port=None, skip_loss=2, engine=None):
     if server_port is None:
         print('Please provide server Port')
         sys.exit()
 
-    src_port = 'tcp.srcport'
-
-    cmd = ['tshark', '-r', pcapFile, '-T', 'fields', '-E', 'separator=/t', '-e', src_port, '-e',
-           'tcp.analysis.out_of_order',
-           '-e', 'tcp.analysis.retransmission',
-           '-e', 'tcp.seq', '-e', 'frame.time_relative', '-e', 'tcp.ack']
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, err = p.communicate()
+    packets = pcap_reader.load_packets(pcapFile, engine=engine)
 
-    # All Packets arrived on the server
-    arr_all_pList = []
-    arr_all_timeList = []
-
-    # Packets arrived on the server in order
-    arr_in_pList = []
-    arr_in_timeList = []
-    # Packets arrived on the server, re transmission
-    arr_ret_pList = []
-    arr_ret_timeList = []
-    # Packets arrived on the server, out-of-order transmission
-    arr_out_pList = []
-    arr_out_timeList = []
-
-    # All Packets sent from the server
-    sent_all_pList = []
-    sent_all_timeList = []
-
-    # Packets sent *from* server, in order
-    sent_in_pList = []
-    sent_in_timeList = []
-    # Packets sent *from* server, re transmission
-    sent_ret_pList = []
-    sent_ret_timeList = []
-    # Packets sent *from* server, out-of-order transmission
-    sent_out_pList = []
-    sent_out_timeList = []
-
-    arr_a_count = 0
-    arr_i_count = 0
-    arr_r_count = 0
-    arr_o_count = 0
-
-    sent_a_count = 0
-    sent_i_count = 0
-    sent_r_count = 0
-    sent_o_count = 0
-
-    for sl in output.splitlines():
-        # print(type(sl))
-        # sl = str(sl)
-        sl = sl.decode("utf-8")
-        l = sl.split('\t')
-        src_port = l[0]
-        # Get the info of this packet
-        try:
-            # Out of order
-            out = l[1]
-            # Retransmission
-            ret = l[2]
-            # Sequence number
-            seq = l[3]
-            # time relative to the beginning of the connection
-            time = l[4]
-            # the ack number of this packet
-            ack = l[5]
-        except:
-            continue
-        # For packets arrived on the server, record their ack numbers
-        # For packets sent from the server, record their sequence numbers
-
-        # For packets sent from the server, put in the sent_* lists
-        if src_port == server_port:
-            sent_all_pList.append(seq)
-            sent_all_timeList.append(time)
-            sent_a_count += 1
-            if ret:
-                sent_ret_pList.append(seq)
-                sent_ret_timeList.append(time)
-                sent_r_count += 1
-            elif out:
-                sent_out_pList.append(seq)
-                sent_out_timeList.append(time)
-                sent_o_count += 1
-            else:
-                sent_in_pList.append(seq)
-                sent_in_timeList.append(time)
-                sent_i_count += 1
-        # For packets arrived on the server, put in the arr_* lists
-        else:
-            arr_all_pList.append(ack)
-            arr_all_timeList.append(time)
-            arr_a_count += 1
-            if ret:
-                arr_ret_pList.append(ack)
-                arr_ret_timeList.append(time)
-                arr_r_count += 1
-            elif out:
-                arr_out_pList.append(ack)
-                arr_out_timeList.append(time)
-                arr_o_count += 1
-            else:
-                arr_in_pList.append(ack)
-                arr_in_timeList.append(time)
-                arr_i_count += 1
+    # One row per packet: time relative to the beginning of the capture, sequence number,
+    # ack number, whether it was sent from the server, retransmission and out of order flags.
+    # For packets sent from the server we use their sequence numbers (table.sent_* masks),
+    # for packets arrived on the server their ack numbers (table.arr_* masks)
+    table = pcap_reader.PacketTable.from_packets(packets, int(server_port))
 
     start_timestamp = 0
-    start_seq = 0
 
     # Whether to ignore first few dropped packets (e.g., delayed throttling period)
-    # if len(sent_ret_timeList) > 5:
-    #     start_timestamp = float(sent_ret_timeList[skip_loss])
-    #     start_seq = float(sent_ret_pList[skip_loss])
-    #     in_start_index = timestamp_after_start(sent_in_timeList, start_timestamp)
-    #     sent_in_pList = sent_in_pList[in_start_index:]
-    #     sent_in_timeList = sent_in_timeList[in_start_index:]
-    #
-    #     ret_start_index = timestamp_after_start(sent_ret_timeList, start_timestamp)
-    #     sent_ret_pList = sent_ret_pList[ret_start_index:]
-    #     sent_ret_timeList = sent_ret_timeList[ret_start_index:]
+    # sent_ret = table[table.sent_ret]
+    # if len(sent_ret) > 5:
+    #     start_timestamp = sent_ret.time[skip_loss]
+    #     table = table[timestamp_after_start(table.time, start_timestamp):]
+    #     table.time = table.time - start_timestamp
+    #     table.seq = table.seq - sent_ret.seq[skip_loss]
 
-    sent_in_pList = [float(x) - start_seq for x in sent_in_pList]
-    sent_ret_pList = [float(x) - start_seq for x in sent_ret_pList]
-    sent_in_timeList = [float(x) - start_timestamp for x in sent_in_timeList]
-    sent_ret_timeList = [float(x) - start_timestamp for x in sent_ret_timeList]
-
-    return sent_in_pList, sent_in_timeList, sent_ret_pList, sent_ret_timeList, sent_all_pList, sent_all_timeList, sent_i_count, sent_r_count, sent_a_count, start_timestamp
+    return table, start_timestamp
 
 
 def timestamp_after_start(timestamps, start_timestamp):
-    cnt = 0
-    for timestamp in timestamps:
-        if float(timestamp) > start_timestamp:
-            break
-        cnt += 1
-    return cnt
+    # timestamps are sorted, index of the first one after start_timestamp
+    return int(numpy.searchsorted(timestamps, start_timestamp, side='right'))
 
 
 # data directory should have subdirectories:
@@ -378,15 +234,13 @@ def timestamp_after_start(timestamps, start_timestamp):
 # 2. tcpdumpsResults
 def load_replay_files(data_directory, clientID, history_count, testID):
     clientXputs_dir = data_directory + "/clientXputs/"
-    tcpdumpsResults_dir = data_directory + "/tcpdumpsResults/"
-    regex_original_pcap = "*_{}_*_{}_{}*".format(clientID, history_count, testID)
 
-    original_pcap_file = glob.glob(tcpdumpsResults_dir + regex_original_pcap)
+    # the first *_clientID_*_historyCount_testID* pcap, from the manifest of the record directory
+    original_pcap_file = manifest.find_file(data_directory, "{}_{}".format(clientID, history_count),
+                                            "pcap_{}".format(testID))
 
     if not original_pcap_file:
         return None, [], []
-    else:
-        original_pcap_file = original_pcap_file[0]
 
     original_clientXputs_json = clientXputs_dir + "Xput_{}_{}_{}.json".format(clientID, history_count, testID)
 
@@ -405,23 +259,6 @@ def load_replay_files(data_directory, clientID, history_count, testID):
     return original_pcap_file, xputO, tsO
 
 
-def bytes_over_time_from_throughput(client_tputs, client_ts, start_timestamp=None):
-    received_bytes = []
-    received_ts = []
-
-    sampling_interval = client_ts[1] - client_ts[0]
-    current_bytes = 0
-
-    for i in range(len(client_tputs)):
-        if client_ts[i] < start_timestamp:
-            continue
-        current_bytes += client_tputs[i] * sampling_interval * 1E6 / 8
-        received_bytes.append(current_bytes)
-        received_ts.append(client_ts[i] - start_timestamp)
-
-    return received_ts, received_bytes
-
-
 # Load mobile Stats from mobileStat file (after separating the metadata connection)
 def loadMobileStatsFile(mobileStatsFile):
     try:
@@ -471,44 +308,6 @@ def get_r_squared_score(seqs, time_stamps, throttling_rate, plot_title='test'):
     plt.close()
 
 
-def loadMobileStats(mobileStats):
-    # use mobile stats to locate the geoInfo
-    try:
-        lat = mobileStats['locationInfo']['latitude']
-        lon = mobileStats['locationInfo']['longitude']
-        # later version of the replay server stores location info in replayInfo file
-        if 'country' in mobileStats['locationInfo'] and 'countryCode' in mobileStats['locationInfo'] and lat:
-            lat = float("{0:.1f}".format(float(lat)))
-            lon = float("{0:.1f}".format(float(lon)))
-            country = mobileStats['locationInfo']['country']
-            city = mobileStats['locationInfo']['city']
-            countryCode = mobileStats['locationInfo']['countryCode']
-        elif (lat == lon == '0.0') or (lat == lon == 0.0) or (lat == 'nil') or (lat == 'null'):
-            lat = lon = ''
-            country = ''
-            city = ''
-            countryCode = ''
-        elif lat:
-            coordinates = [(float(lat), float(lon))]
-            geoInfo = reverse_geocode.search(coordinates)[0]
-            country = geoInfo['country']
-            city = geoInfo['city']
-            countryCode = geoInfo['country_code'].lower()
-            lat = float("{0:.1f}".format(float(lat)))
-            lon = float("{0:.1f}".format(float(lon)))
-        else:
-            lat = lon = country = countryCode = city = ''
-
-    except Exception as e:
-        traceback.print_exc(file=sys.stdout)
-        country = ''
-        city = ''
-        countryCode = ''
-        lat = lon = ''
-
-    return lat, lon, country, countryCode, city
-
-
 def getCarrierNameByIP(clientIP):
     # get WiFi network carrierName
     try:
@@ -516,8 +315,7 @@ def getCarrierNameByIP(clientIP):
         if not org:
             carrierName = ' (WiFi)'
         else:
-            # Remove special characters in carrierName to merge test results together
-            carrierName = ''.join(e for e in org if e.isalnum()) + ' (WiFi)'
+            carrierName = carrier_name.wifiCarrierNameOfOrg(org)
     except Exception as e:
         carrierName = ' (WiFi)'
 
@@ -537,119 +335,42 @@ def timedRun(cmd, timeout_sec):
 
 
 def getRangeAndOrg(ip):
+    # answered from the ranges of earlier whois lookups when possible
+    cached = whois_cache.lookup(ip)
+    if cached is not None:
+        first, last, orgName = cached
+        if not orgName:
+            return None, None
+        return neta.IPRange(first, last), orgName
+
     out = timedRun(['whois', ip], 3)
-    try:
-        out = out.decode("utf-8")
-    except:
-        out = out
-
-    IPRange = None
-    orgName = None
-    netRange = None
-
-    # Get IP Range
-    if 'NetRange:' in out:
-        netRange = out.split('NetRange:')[1].split('\n')[0]
-        netRange = netRange.split()
-        IPRange = neta.IPRange(netRange[0], netRange[2])
-
-    # LACNIC/RIPE format
-    elif 'inetnum:' in out:
-        netRange = out.split('inetnum:')[1].split('\n')[0]
-        if '/' in netRange:
-            netRange = netRange.split()[0]
-            IPRange = neta.IPSet(neta.IPNetwork(netRange))
-        else:
-            netRange = netRange.split()
-            IPRange = neta.IPRange(netRange[0], netRange[2])
-
-    # Get Organization
-    if 'OrgName:' in out:
-        orgName = out.split('OrgName:')[1].split('\n')[0]
-    elif 'Organization:' in out:
-        orgName = out.split('Organization:')[1].split('\n')[0]
-    elif 'owner:' in out:
-        orgName = out.split('owner:')[1].split('\n')[0]
-    elif 'org-name:' in out:
-        orgName = out.split('org-name:')[1].split('\n')[0]
-    elif 'abuse-mailbox:' in out:
-        orgName = out.split('abuse-mailbox:')[1].split('@')[1].split('.')[0]
-    elif 'netname:' in out:
-        orgName = out.split('netname:')[1].split('\n')[0]
-
-    if orgName and netRange:
+    IPRange, orgName, first, last = whois_resolver.parse_whois(out)
+
+    whois_cache.add(ip, first, last, orgName)
+    if orgName:
         return IPRange, orgName
     else:
         return None, None
 
 
-# French server names are manually verified
-def getFrenchCarrierName(wifiCarrierName):
-    carrierName = wifiCarrierName
-    if 'proxad' in wifiCarrierName:
-        carrierName = 'Free (WiFi)'
-    elif 'SFR' in wifiCarrierName:
-        carrierName = 'SFR (WiFi)'
-    elif 'orange' in wifiCarrierName:
-        carrierName = 'Orange (WiFi)'
-    elif 'bouyguestelecom' in wifiCarrierName:
-        carrierName = 'BouyguesTelecom (WiFi)'
-    elif 'gaoland' in wifiCarrierName:
-        carrierName = 'Free (WiFi)'
-    elif 'ORANGEFRANCEHSIAB' in wifiCarrierName:
-        carrierName = 'Orange (WiFi)'
-    elif 'BouyguesTelecomSA' in wifiCarrierName:
-        carrierName = 'BouyguesTelecom (WiFi)'
-    elif 'OrangeSA' in wifiCarrierName:
-        carrierName = 'Orange (WiFi)'
-    elif 'FreeSAS' in wifiCarrierName:
-        carrierName = 'Free (WiFi)'
-    elif 'BOUYGTEL' in wifiCarrierName:
-        carrierName = 'BouyguesTelecom (WiFi)'
-
-    return carrierName
-
-
 def getCarrierName(mobileStats, clientIP):
     networkType = mobileStats['networkType']
-    lat, lon, country, countryCode, city = loadMobileStats(mobileStats)
+    lat, lon, country, countryCode, city = geo_cache.loadMobileStats(mobileStats)
 
     if "updatedCarrierName" in mobileStats:
         carrierName = mobileStats["updatedCarrierName"]
     elif networkType == 'WIFI':
+        # the offline registry index already has the French mapping and the merges below applied
+        indexedCarrierName = prefix_index.lookup(clientIP, country)
+        if indexedCarrierName:
+            return indexedCarrierName
         carrierName = getCarrierNameByIP(clientIP)
     else:
         carrierName = ''.join(e for e in mobileStats['carrierName'] if e.isalnum())
         carrierName = carrierName + ' (cellular)'
 
-    # Special case for French ISPs, manually verified the transforming from whois results to provider names
-    if country == 'France' and networkType == 'WIFI':
-        carrierName = getFrenchCarrierName(carrierName)
-
-    # combine the tests with carrierName variance
-    if ' ' in carrierName:
-        networkPortion = carrierName.split(' ')[1]
-        # combine carriernames
-        if 'VZW' in carrierName:
-            carrierName = 'Verizon ' + networkPortion
-        elif 'VzW' in carrierName:
-            carrierName = 'Verizon ' + networkPortion
-        elif 'Verizon' in carrierName:
-            carrierName = 'Verizon ' + networkPortion
-        elif 'O2UK' in carrierName:
-            carrierName = 'O2 ' + networkPortion
-        elif 'ATT' in carrierName:
-            carrierName = 'ATT ' + networkPortion
-        elif 'TMobile' in carrierName:
-            carrierName = 'TMobile ' + networkPortion
-        elif 'IowaWireless' in carrierName:
-            carrierName = 'iWireless ' + networkPortion
-    elif networkType == 'WIFI':
-        carrierName = carrierName + ' (WiFi)'
-    else:
-        carrierName = carrierName + ' (cellular)'
-
-    return carrierName
+    # the same normalization the offline registry index applies (see carrier_name.py)
+    return carrier_name.normalizeCarrierName(carrierName, networkType, country)
 
 
 def updateReplayName(replayName):
@@ -861,8 +582,8 @@ def analyze_test(replayInfo, mobileStats, client_dir, result_directory, plotting
 
     result_carrier_directory = "{}/{}_{}/".format(result_directory, carrierName, replayName)
 
-    if not os.path.isdir(result_carrier_directory):
-        os.mkdir(result_carrier_directory)
+    # several workers can get here at the same time for the same carrier
+    os.makedirs(result_carrier_directory, exist_ok=True)
 
     # get pcap_file and client side throughput samples
     original_pcap_file, client_tputs_original, client_ts_original = load_replay_files(
@@ -873,29 +594,31 @@ def analyze_test(replayInfo, mobileStats, client_dir, result_directory, plotting
     if not (original_pcap_file and inverted_pcap_file and client_ts_original and client_ts_inverted):
         return False
 
-    sent_in_pList_original, sent_in_timeList_original, sent_ret_pList_original, sent_ret_timeList_original, sent_all_pList_original, sent_all_timeList_original, sent_i_count_original, sent_r_count_original, sent_a_count_original, start_timestamp = get_pcap_stat(
-        original_pcap_file, server_port=server_port, skip_loss=2)
+    table_original, start_timestamp = get_pcap_stat(original_pcap_file, server_port=server_port, skip_loss=2)
+    table_inverted, start_timestamp = get_pcap_stat(inverted_pcap_file, server_port=server_port, skip_loss=2)
 
-    sent_in_pList_inverted, sent_in_timeList_inverted, sent_ret_pList_inverted, sent_ret_timeList_inverted, sent_all_pList_inverted, sent_all_timeList_inverted, sent_i_count_inverted, sent_r_count_inverted, sent_a_count_inverted, start_timestamp = get_pcap_stat(
-        inverted_pcap_file, server_port=server_port, skip_loss=2)
+    sent_in_original = table_original[table_original.sent_in]
+    sent_ret_original = table_original[table_original.sent_ret]
+    sent_in_inverted = table_inverted[table_inverted.sent_in]
+    sent_ret_inverted = table_inverted[table_inverted.sent_ret]
 
-    receive_timeList_original, receive_pList_original = bytes_over_time_from_throughput(client_tputs_original,
-                                                                                        client_ts_original,
-                                                                                        start_timestamp)
+    receive_timeList_original, receive_pList_original = throughput.bytes_over_time_from_throughput(client_tputs_original,
+                                                                                                   client_ts_original,
+                                                                                                   start_timestamp)
 
-    receive_timeList_inverted, receive_pList_inverted = bytes_over_time_from_throughput(client_tputs_inverted,
-                                                                                        client_ts_inverted,
-                                                                                        start_timestamp)
+    receive_timeList_inverted, receive_pList_inverted = throughput.bytes_over_time_from_throughput(client_tputs_inverted,
+                                                                                                   client_ts_inverted,
+                                                                                                   start_timestamp)
 
-    if not (sent_in_pList_original and sent_in_pList_inverted and receive_pList_original):
+    if not (len(sent_in_original) and len(sent_in_inverted) and receive_pList_original):
         return False
 
-    # server_tputs_original, server_ts_original = doTputs(sent_in_timeList_original, sent_in_pList_original,
-    #                                                     num_buckets=len(client_tputs_original))
+    # server_tputs_original, server_ts_original = throughput.doTputs(sent_in_original.time, sent_in_original.seq,
+    #                                                                num_buckets=len(client_tputs_original))
 
     client_sampling_interval = client_ts_original[1] - client_ts_original[0]
-    server_tputs_original, server_ts_original = doTputsInterval(sent_in_timeList_original, sent_in_pList_original,
-                                                                client_sampling_interval)
+    server_tputs_original, server_ts_original = throughput.doTputsInterval(sent_in_original.time, sent_in_original.seq,
+                                                                           client_sampling_interval)
 
     if (len(client_tputs_original) < 10) or (len(server_tputs_original) < 10):
         return False
@@ -905,8 +628,8 @@ def analyze_test(replayInfo, mobileStats, client_dir, result_directory, plotting
     stdev_client_tputs_original = round(statistics.stdev(client_tputs_original), 5)
     stdev_server_tputs_original = round(statistics.stdev(server_tputs_original), 5)
 
-    loss_rate_original = round(sent_r_count_original / sent_a_count_original, 5)
-    loss_rate_inverted = round(sent_r_count_inverted / sent_a_count_inverted, 5)
+    loss_rate_original = round(int(table_original.sent_ret.sum()) / int(table_original.sent_all.sum()), 5)
+    loss_rate_inverted = round(int(table_inverted.sent_ret.sum()) / int(table_inverted.sent_all.sum()), 5)
 
     plot_title = "{}--{}--{}--{}--{}--{}--{}--{}--{}".format(userID, historyCount, replayName, avg_client_tputs_original,
                                                       avg_server_tputs_original, stdev_client_tputs_original,
@@ -916,9 +639,9 @@ def analyze_test(replayInfo, mobileStats, client_dir, result_directory, plotting
     if plotting:
         plot_throughput_distribution(client_tputs_original, server_tputs_original, result_carrier_directory, plot_title=plot_title)
 
-        plot_seq_throughput_over_time(sent_in_timeList_original, sent_in_pList_original, sent_in_timeList_inverted, sent_in_pList_inverted,
+        plot_seq_throughput_over_time(sent_in_original.time, sent_in_original.seq, sent_in_inverted.time, sent_in_inverted.seq,
                        receive_timeList_original, receive_pList_original, receive_timeList_inverted, receive_pList_inverted,
-                       sent_ret_timeList_original, sent_ret_pList_original, sent_ret_timeList_inverted, sent_ret_pList_inverted,
+                       sent_ret_original.time, sent_ret_original.seq, sent_ret_inverted.time, sent_ret_inverted.seq,
                        result_carrier_directory, server_tputs_original, server_ts_original, client_tputs_original, client_ts_original, plot_title=plot_title)
 
     return [avg_client_tputs_original, avg_server_tputs_original, stdev_client_tputs_original, stdev_server_tputs_original, loss_rate_original, loss_rate_inverted]
@@ -961,83 +684,358 @@ def get_mobilestat(replayInfo, mobileStatsFile):
     return mobileStats
 
 
-def main():
+def get_test_record(client_dir, replayInfo):
+    # (replayInfo, mobileStats) of a test, from the record store when it has it (see record_store.py)
+    meta_info = replayInfo.split('.')[0].split('_')
+    if len(meta_info) == 4 and meta_info[3] in ['0', '1']:
+        record = record_store.get_record(client_dir, replayInfo)
+        if record is not None:
+            replayInfo, mobileStats = record
+            if not replayInfo:
+                return None, None
+            return replayInfo, mobileStats
+
+    replayInfo, mobileStatsFile = get_test_metadata(client_dir, replayInfo)
+    if not replayInfo:
+        return None, None
+    return replayInfo, get_mobilestat(replayInfo, mobileStatsFile)
+
 
+def list_tests(data_directory):
+    # every (client directory, replayInfo file), sorted so that the results do not depend on os.listdir order
+    record_manifest = manifest.get_manifest(data_directory)
+    tests = []
+    for client in record_manifest.userIDs():
+        client_dir = data_directory + '/' + client
+        for replayInfo in record_manifest.replay_infos(client):
+            tests.append((client_dir, replayInfo))
+    return tests
+
+
+def unique_test_id_of(replayInfo):
+    # replayInfo_userID_historyCount_testID.json, both replays of a test (testID 0 and 1) share the uniqueTestID
+    meta_info = replayInfo.split('.')[0].split('_')
+    if len(meta_info) != 4:
+        return None
+    return "{}_{}".format(meta_info[1], meta_info[2])
+
+
+def test_signature(client_dir, replayInfo):
+    # a test is analyzed again when its replayInfo file changes
     try:
-        data_directory = sys.argv[1]
-        result_directory = sys.argv[2]
-        plotting = int(sys.argv[3])
-    except:
-        print(
-            '\r\n Please provide the following four inputs: [data_directory] [result_directory] [plotting?]')
-        sys.exit()
+        st = os.stat(client_dir + '/replayInfo/' + replayInfo)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def load_checkpoint(checkpoint_file):
+    # uniqueTestID -> the last record written for it, and (client_dir, replayInfo) -> the record of
+    # a replayInfo file that was skipped or failed (both replays of a test share the uniqueTestID)
+    done = {}
+    if not os.path.exists(checkpoint_file):
+        return done
+    with open(checkpoint_file, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line of a run that was killed while writing it
+                continue
+            status = record.get("status", "done")
+            if status == "done":
+                done[record["unique_test_id"]] = record
+                continue
+            done[(record["client_dir"], record["replayInfo"])] = record
+            # the test was analyzed before, its replayInfo changed and can not be used any more
+            previous = done.get(record["unique_test_id"])
+            if previous and (previous["client_dir"], previous["replayInfo"]) == (record["client_dir"], record["replayInfo"]):
+                del done[record["unique_test_id"]]
+    return done
+
+
+def pending_tests(tests, done):
+    # tests whose uniqueTestID was never analyzed or whose replayInfo changed since,
+    # and that were not skipped or failed with their current replayInfo
+    pending = []
+    for client_dir, replayInfo in tests:
+        record = done.get(unique_test_id_of(replayInfo))
+        if record and test_signature(record["client_dir"], record["replayInfo"]) == record["signature"]:
+            continue
+        record = done.get((client_dir, replayInfo))
+        if record and test_signature(client_dir, replayInfo) == record["signature"]:
+            continue
+        pending.append((client_dir, replayInfo))
+    return pending
 
-    num_plots = 100
 
-    if not os.path.isdir(result_directory):
-        os.mkdir(result_directory)
+def write_checkpoint(checkpoint, client_dir, replayInfo, result, status="done"):
+    # status "done" with the result of analyze_one_test, "skipped" or "failed" without
+    if status == "done":
+        carrier_replay, unique_test_id, test_stat = result
+    else:
+        carrier_replay, unique_test_id, test_stat = None, unique_test_id_of(replayInfo), None
+    record = {"unique_test_id": unique_test_id, "client_dir": client_dir, "replayInfo": replayInfo,
+              "signature": test_signature(client_dir, replayInfo), "status": status,
+              "carrier_replay": carrier_replay, "test_stat": test_stat}
+    checkpoint.write(json.dumps(record) + "\n")
+    checkpoint.flush()
+    os.fsync(checkpoint.fileno())
 
+
+def stat_per_carrier_replay(tests, done):
+    # test_stat_per_carrier_replay in the order of the tests, whichever run analyzed them
     test_stat_per_carrier_replay = {}
+    for client_dir, replayInfo in tests:
+        record = done.get(unique_test_id_of(replayInfo))
+        if not record:
+            continue
+        if record["carrier_replay"] not in test_stat_per_carrier_replay:
+            test_stat_per_carrier_replay[record["carrier_replay"]] = {}
+        test_stat_per_carrier_replay[record["carrier_replay"]][record["unique_test_id"]] = record["test_stat"]
+    return test_stat_per_carrier_replay
 
-    # for every client that has throttling tests
-    for client in os.listdir(data_directory):
-        client_dir = data_directory + '/' + client
-        replayinfo_dir = client_dir + '/replayInfo/'
-        if not os.path.isdir(replayinfo_dir):
-            return
-        # For every throttling test in data_directory
-        for replayInfo in os.listdir(replayinfo_dir):
-            replayInfo, mobileStatsFile = get_test_metadata(client_dir, replayInfo)
 
+def read_test_infos(tests):
+    # (replayInfo, mobileStats) of the tests that have both
+    test_infos = []
+    for client_dir, replayInfo in tests:
+        try:
+            replayInfo, mobileStats = get_test_record(client_dir, replayInfo)
             if not replayInfo:
                 continue
+        except Exception:
+            # analyze_one_test reports the broken tests
+            continue
+        if mobileStats:
+            test_infos.append((replayInfo, mobileStats))
+    return test_infos
 
-            mobileStats = get_mobilestat(replayInfo, mobileStatsFile)
 
-            if not mobileStats:
+def wifi_client_ips(test_infos):
+    # the clientIPs getCarrierName will need whois for: WiFi tests without an updatedCarrierName
+    # and not covered by the offline registry index
+    ips = set()
+    for replayInfo, mobileStats in test_infos:
+        try:
+            if mobileStats['networkType'] != 'WIFI' or "updatedCarrierName" in mobileStats:
                 continue
+        except Exception:
+            continue
+        country = geo_cache.loadMobileStats(mobileStats)[2]
+        if not prefix_index.lookup(replayInfo[2], country):
+            ips.add(replayInfo[2])
+    return sorted(ips)
+
+
+def carrier_replay_of(replayInfo, mobileStats):
+    appName, replayName = updateReplayName(replayInfo[4])
+    carrierName = getCarrierName(mobileStats, replayInfo[2])
+    return "{}_{}".format(carrierName, replayName)
 
-            appName, replayName = updateReplayName(replayInfo[4])
-            userID = replayInfo[1]
-            clientIP = replayInfo[2]
-            historyCount = replayInfo[6]
-            unique_test_id = "{}_{}".format(userID, historyCount)
 
-            carrierName = getCarrierName(mobileStats, clientIP)
+def plot_candidates(tests, num_plots, test_stat_per_carrier_replay):
+    # whether each test is among the first num_plots of its carrier_replay, decided before any test is analyzed
+    plot_counts = {carrier_replay: len(test_stat_per_carrier_replay[carrier_replay])
+                   for carrier_replay in test_stat_per_carrier_replay}
+    candidates = []
+    for client_dir, replayInfo in tests:
+        try:
+            replayInfo, mobileStats = get_test_record(client_dir, replayInfo)
+            carrier_replay = carrier_replay_of(replayInfo, mobileStats) if replayInfo and mobileStats else None
+        except Exception:
+            # analyze_one_test reports the broken tests
+            carrier_replay = None
+        if carrier_replay is None or plot_counts.get(carrier_replay, 0) >= num_plots:
+            candidates.append(0)
+            continue
+        plot_counts[carrier_replay] = plot_counts.get(carrier_replay, 0) + 1
+        candidates.append(1)
+    return candidates
 
-            test_stat = analyze_test(replayInfo, mobileStats, client_dir, result_directory, plotting)
 
-            # avg_client_tputs_original, avg_server_tputs_original,
-            # stdev_client_tputs_original, stdev_server_tputs_original,
-            # loss_rate_original, loss_rate_inverted = test_stat
+def analyze_one_test(client_dir, replayInfo, result_directory, plotting=0, full_carrier_replays=()):
+    # returns carrier_replay, unique_test_id, test_stat + [ymd, hour, (lat, lon)] or None if the test can not be used
+    # no plots for the carrier_replays in full_carrier_replays
+    replayInfo, mobileStats = get_test_record(client_dir, replayInfo)
 
-            if not test_stat:
-                continue
+    if not replayInfo:
+        return None
+
+    if not mobileStats:
+        return None
+
+    userID = replayInfo[1]
+    historyCount = replayInfo[6]
+    unique_test_id = "{}_{}".format(userID, historyCount)
 
-            if mobileStats:
-                lat, lon, country, countryCode, city = loadMobileStats(mobileStats)
-                try:
-                    localTime = mobileStats['locationInfo']['localTime']
-                except:
-                    localTime = replayInfo[0]
+    carrier_replay = carrier_replay_of(replayInfo, mobileStats)
 
-                ymd = localTime.split(" ")[0]
-                hour = localTime.split(" ")[1].split("-")[0]
-            else:
-                ymd = hour = lat = lon = ""
+    if carrier_replay in full_carrier_replays:
+        plotting = 0
 
-            test_stat += [ymd, hour, (lat, lon)]
+    test_stat = analyze_test(replayInfo, mobileStats, client_dir, result_directory, plotting)
 
-            carrier_replay = "{}_{}".format(carrierName, replayName)
+    # avg_client_tputs_original, avg_server_tputs_original,
+    # stdev_client_tputs_original, stdev_server_tputs_original,
+    # loss_rate_original, loss_rate_inverted = test_stat
+
+    if not test_stat:
+        return None
+
+    if mobileStats:
+        lat, lon, country, countryCode, city = geo_cache.loadMobileStats(mobileStats)
+        try:
+            localTime = mobileStats['locationInfo']['localTime']
+        except:
+            localTime = replayInfo[0]
+
+        ymd = localTime.split(" ")[0]
+        hour = localTime.split(" ")[1].split("-")[0]
+    else:
+        ymd = hour = lat = lon = ""
+
+    test_stat += [ymd, hour, (lat, lon)]
+
+    return carrier_replay, unique_test_id, test_stat
+
+
+def analyze_one_test_task(task):
+    # entry point for the worker processes, one failing test should not stop the whole run
+    # returns ("done", result), ("skipped", None) for a test that can not be used or ("failed", None)
+    try:
+        result = analyze_one_test(*task)
+    except Exception:
+        print("FAIL at analyzing", task[0], task[1])
+        traceback.print_exc(file=sys.stdout)
+        return "failed", None
+    if not result:
+        return "skipped", None
+    return "done", result
+
+
+def analyze_tests_serial(tests, result_directory, plotting, num_plots, test_stat_per_carrier_replay, checkpoint):
+    # carrier_replays that already have num_plots tests
+    full_carrier_replays = set(carrier_replay for carrier_replay in test_stat_per_carrier_replay
+                               if len(test_stat_per_carrier_replay[carrier_replay].keys()) >= num_plots)
+
+    for client_dir, replayInfo in tests:
+        status, result = analyze_one_test_task((client_dir, replayInfo, result_directory, plotting,
+                                                full_carrier_replays))
+        write_checkpoint(checkpoint, client_dir, replayInfo, result, status)
+        if not result:
+            continue
+        carrier_replay, unique_test_id, test_stat = result
+
+        if carrier_replay not in test_stat_per_carrier_replay:
+            test_stat_per_carrier_replay[carrier_replay] = {}
+        test_stat_per_carrier_replay[carrier_replay][unique_test_id] = test_stat
+
+        if len(test_stat_per_carrier_replay[carrier_replay].keys()) >= num_plots:
+            full_carrier_replays.add(carrier_replay)
+
+
+def analyze_tests_parallel(tests, result_directory, plotting, num_plots, test_stat_per_carrier_replay, checkpoint,
+                           workers):
+    # the first num_plots tests of every carrier_replay are analyzed with plotting, so every test is analyzed once.
+    # A candidate that turns out unusable leaves its plot to the next usable test of the carrier_replay,
+    # as in a serial run, only those tests are analyzed a second time.
+    candidates = plot_candidates(tests, num_plots, test_stat_per_carrier_replay) if plotting else [0] * len(tests)
+    plot_tasks = []
+
+    with multiprocessing.Pool(workers) as pool:
+        # imap keeps the order of the tests, the merge is the same as in a serial run
+        tasks = [(client_dir, replayInfo, result_directory, plot)
+                 for (client_dir, replayInfo), plot in zip(tests, candidates)]
+        for task, (status, result) in zip(tasks, pool.imap(analyze_one_test_task, tasks)):
+            write_checkpoint(checkpoint, task[0], task[1], result, status)
+            if not result:
+                continue
+            carrier_replay, unique_test_id, test_stat = result
 
             if carrier_replay not in test_stat_per_carrier_replay:
                 test_stat_per_carrier_replay[carrier_replay] = {}
+            if plotting and not task[3] and len(test_stat_per_carrier_replay[carrier_replay].keys()) < num_plots:
+                plot_tasks.append(task[:3] + (1,))
             test_stat_per_carrier_replay[carrier_replay][unique_test_id] = test_stat
 
-            if len(test_stat_per_carrier_replay[carrier_replay].keys()) >= num_plots:
-                plotting = 0
+        for result in pool.imap_unordered(analyze_one_test_task, plot_tasks):
+            pass
+
+        # let the workers exit on their own (not terminated), they write their whois answers when they do
+        pool.close()
+        pool.join()
+
+
+def main():
+
+    args = sys.argv[1:]
+    workers = 1
+    if '--workers' in args:
+        i = args.index('--workers')
+        try:
+            workers = int(args[i + 1])
+        except:
+            print('\r\n --workers needs the number of worker processes')
+            sys.exit()
+        del args[i:i + 2]
+
+    whois_concurrency = whois_resolver.DEFAULT_CONCURRENCY
+    if '--whois-concurrency' in args:
+        i = args.index('--whois-concurrency')
+        try:
+            whois_concurrency = int(args[i + 1])
+        except:
+            print('\r\n --whois-concurrency needs the number of parallel whois lookups')
+            sys.exit()
+        del args[i:i + 2]
+
+    try:
+        data_directory = args[0]
+        result_directory = args[1]
+        plotting = int(args[2])
+    except:
+        print(
+            '\r\n Please provide the following inputs: [data_directory] [result_directory] [plotting?] <--workers N> <--whois-concurrency N>')
+        sys.exit()
+
+    num_plots = 100
+
+    if not os.path.isdir(result_directory):
+        os.mkdir(result_directory)
+
+    # for every throttling test of every client in data_directory
+    tests = list_tests(data_directory)
+    # their replayInfo and mobileStats, packed into one database
+    record_store.ingest(data_directory)
+
+    # results of the previous runs, only new or changed tests are analyzed
+    checkpoint_file = os.path.join(result_directory, CHECKPOINT_FILE)
+    done = load_checkpoint(checkpoint_file)
+    pending = pending_tests(tests, done)
+    print("{} tests, {} to analyze".format(len(tests), len(pending)))
+
+    # geocode the locations and whois the WiFi clientIPs of all the tests at once,
+    # getCarrierName and loadMobileStats then find them in the caches
+    test_infos = read_test_infos(pending)
+    geo_cache.prefetch(mobileStats for replayInfo, mobileStats in test_infos)
+    if whois_concurrency > 0:
+        ips = wifi_client_ips(test_infos)
+        runs = whois_resolver.resolve_ips(ips, concurrency=whois_concurrency)
+        print("{} WiFi clientIPs, {} whois lookups".format(len(ips), runs))
+
+    test_stat_per_carrier_replay = stat_per_carrier_replay(tests, done)
+    with open(checkpoint_file, 'a') as checkpoint:
+        if workers > 1:
+            analyze_tests_parallel(pending, result_directory, plotting, num_plots, test_stat_per_carrier_replay,
+                                   checkpoint, workers)
+        else:
+            analyze_tests_serial(pending, result_directory, plotting, num_plots, test_stat_per_carrier_replay,
+                                 checkpoint)
 
+    test_stat_per_carrier_replay = stat_per_carrier_replay(tests, load_checkpoint(checkpoint_file))
     json.dump(test_stat_per_carrier_replay, open("test_stat_per_carrier_replay.json", 'w'))
+    test_stat_store.write("test_stat_per_carrier_replay_store", test_stat_per_carrier_replay)
 
 
 if __name__ == "__main__":
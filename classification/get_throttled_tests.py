@@ -8,20 +8,38 @@ For each carrier,
     check the truePositiveTests files and find these true positive tests,
 
 For each throttled (true positive) test
-    find the test in wehe_record_dir
+    find the test in wehe_record_dir (its files are looked up in the manifest, see manifest.py)
     if it has all files needed
         copy them to the trace_analysis_dir directory
 
+The files are placed by --workers threads (default 8) with --mode
+    copy      (default) a copy that keeps the mtime
+    hardlink  a hard link, nearly free on the same filesystem (a copy across filesystems)
+    reflink   a copy-on-write clone where the filesystem supports it, a copy otherwise
+    symlink   a symbolic link to the file in wehe_record_dir
+files already in trace_analysis_dir with the same size and mtime (the same file for links) are skipped.
+
 '''
 
 import sys
 import os
 import json
-import glob
-import subprocess
+import fcntl
+import shutil
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import manifest
+
+COPY_MODES = ["copy", "hardlink", "reflink", "symlink"]
+DEFAULT_COPY_WORKERS = 8
+# ioctl of the Linux copy-on-write file clone
+FICLONE = 0x40049409
 
 
-def get_true_positive_tests(true_positive_dir, trace_analysis_dir, wehe_record_dir, threshold=100):
+def get_true_positive_tests(true_positive_dir, trace_analysis_dir, wehe_record_dir, record_manifest, threshold=100):
     true_positive_per_carrier = []
     for true_positive_file in os.listdir(true_positive_dir):
         cnt_true_positive_per_carrier_replay = 0
@@ -30,7 +48,7 @@ def get_true_positive_tests(true_positive_dir, trace_analysis_dir, wehe_record_d
         for true_positive_test in true_positive_per_replay:
             # check whether the necessary files exist
             original_pcap_file, inverted_pcap_file, regex_replayInfo_file, regex_xput_original_file, regex_xput_inverted_file, regex_mobileStat_file = get_test_files(
-                true_positive_test["uniqueTestID"], trace_analysis_dir, wehe_record_dir)
+                true_positive_test["uniqueTestID"], trace_analysis_dir, wehe_record_dir, record_manifest)
             if not (original_pcap_file and inverted_pcap_file and regex_replayInfo_file and regex_xput_original_file and regex_xput_inverted_file and regex_mobileStat_file):
                 continue
             true_positive_per_carrier.append(true_positive_test["uniqueTestID"])
@@ -41,39 +59,29 @@ def get_true_positive_tests(true_positive_dir, trace_analysis_dir, wehe_record_d
     return true_positive_per_carrier
 
 
-def get_tcpdump_file(tcpdumpsResults_dir, userID, historyCount):
-    regex_original_pcap = "*_{}_*_{}_{}*".format(userID, historyCount, 0)
-    regex_inverted_pcap = "*_{}_*_{}_{}*".format(userID, historyCount, 1)
-
-    original_pcap_file = glob.glob(tcpdumpsResults_dir + regex_original_pcap)
-    inverted_pcap_file = glob.glob(tcpdumpsResults_dir + regex_inverted_pcap)
+def get_tcpdump_file(record_manifest, positive_test_id):
+    original_pcap_file = record_manifest.file(positive_test_id, "pcap_0")
+    inverted_pcap_file = record_manifest.file(positive_test_id, "pcap_1")
 
     if not (original_pcap_file and inverted_pcap_file):
         return None, None
     else:
-        original_pcap_file = original_pcap_file[0]
-        inverted_pcap_file = inverted_pcap_file[0]
         return original_pcap_file, inverted_pcap_file
 
 
-def get_file_from_partial_name(file_partial_name):
-    file_name = glob.glob(file_partial_name)
-    if file_name:
-        return file_name[0]
+def json_file(record_manifest, positive_test_id, key):
+    # only the .json files are copied
+    file_name = record_manifest.file(positive_test_id, key)
+    if file_name and file_name.endswith(".json"):
+        return file_name
     else:
         return None
 
 
-def get_test_files(positive_test_id, trace_analysis_dir, wehe_record_dir):
+def get_test_files(positive_test_id, trace_analysis_dir, wehe_record_dir, record_manifest):
     userID = positive_test_id.split("_")[0]
-    historyCount = positive_test_id.split("_")[1]
-    user_dir = wehe_record_dir + "/" + userID + "/"
-    replayInfo_dir = user_dir + "/replayInfo/"
-    mobileStat_dir = user_dir + "/mobileStats/"
-    tcpdumpsResults_dir = user_dir + "/tcpdumpsResults/"
-    clientXputs_dir = user_dir + "/clientXputs/"
 
-    original_pcap_file, inverted_pcap_file = get_tcpdump_file(tcpdumpsResults_dir, userID, historyCount)
+    original_pcap_file, inverted_pcap_file = get_tcpdump_file(record_manifest, positive_test_id)
 
     user_trace_dir = trace_analysis_dir + "/" + userID
     user_trace_replay_dir = user_trace_dir + "/replayInfo/"
@@ -88,30 +96,78 @@ def get_test_files(positive_test_id, trace_analysis_dir, wehe_record_dir):
         os.mkdir(user_trace_tcpdump_dir)
         os.mkdir(user_trace_clientXputs_dir)
 
-    regex_replayInfo_file = "{}/replayInfo_{}_{}_0.json".format(replayInfo_dir, userID, historyCount)
-    regex_xput_original_file = "{}/Xput_{}_{}_0.json".format(clientXputs_dir, userID, historyCount)
-    regex_xput_inverted_file = "{}/Xput_{}_{}_1.json".format(clientXputs_dir, userID, historyCount)
-    regex_mobileStat_file = "{}/mobileStats_{}_{}_0.json".format(mobileStat_dir, userID, historyCount)
-
-    regex_replayInfo_file = get_file_from_partial_name(regex_replayInfo_file)
-    regex_xput_original_file = get_file_from_partial_name(regex_xput_original_file)
-    regex_xput_inverted_file = get_file_from_partial_name(regex_xput_inverted_file)
-    regex_mobileStat_file = get_file_from_partial_name(regex_mobileStat_file)
+    regex_replayInfo_file = json_file(record_manifest, positive_test_id, "replayInfo_0")
+    regex_xput_original_file = json_file(record_manifest, positive_test_id, "xput_0")
+    regex_xput_inverted_file = json_file(record_manifest, positive_test_id, "xput_1")
+    regex_mobileStat_file = json_file(record_manifest, positive_test_id, "mobileStats_0")
 
     return original_pcap_file, inverted_pcap_file, regex_replayInfo_file, regex_xput_original_file, regex_xput_inverted_file, regex_mobileStat_file
 
 
-def copy_test_files(true_positive_ids_per_carrier, trace_analysis_dir, wehe_record_dir):
+def same_file(src, dst, mode):
+    # dst is already what placing src would give
+    try:
+        if mode == "symlink":
+            return os.path.islink(dst) and os.readlink(dst) == os.path.abspath(src)
+        if mode == "hardlink" and os.path.samefile(src, dst):
+            return True
+        src_stat = os.stat(src)
+        dst_stat = os.stat(dst)
+    except OSError:
+        return False
+    # a copy, also what a hardlink falls back to across filesystems
+    return src_stat.st_size == dst_stat.st_size and src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+
+
+def reflink(src, tmp_path):
+    # copy-on-write clone (btrfs, xfs, ...), a plain copy where the filesystem can not clone
+    try:
+        with open(src, "rb") as fsrc, open(tmp_path, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, tmp_path)
+    except OSError:
+        shutil.copy2(src, tmp_path)
+
+
+def place_file(src, dst_dir, mode):
+    # copy/link src into dst_dir, returns (placed?, bytes), not placed when dst was already up to date
+    dst = os.path.join(dst_dir, os.path.basename(src))
+    if same_file(src, dst, mode):
+        return False, 0
+
+    size = os.path.getsize(src)
+    # build the new file next to dst and move it over, so an interrupted run never leaves a partial file
+    tmp_path = "{}.{}.tmp".format(dst, threading.get_ident())
+    try:
+        if mode == "hardlink":
+            try:
+                os.link(src, tmp_path)
+            except OSError:
+                # not on the same filesystem
+                shutil.copy2(src, tmp_path)
+        elif mode == "symlink":
+            os.symlink(os.path.abspath(src), tmp_path)
+        elif mode == "reflink":
+            reflink(src, tmp_path)
+        else:
+            shutil.copy2(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except Exception:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return True, size
+
+
+def copy_test_files(true_positive_ids_per_carrier, trace_analysis_dir, wehe_record_dir, record_manifest,
+                    mode="copy", workers=DEFAULT_COPY_WORKERS):
+    # (file, destination directory) of every test, placed by a pool of threads
+    placements = []
     for positive_test_id in true_positive_ids_per_carrier:
         userID = positive_test_id.split("_")[0]
-        historyCount = positive_test_id.split("_")[1]
-        user_dir = wehe_record_dir + "/" + userID + "/"
-        replayInfo_dir = user_dir + "/replayInfo/"
-        mobileStat_dir = user_dir + "/mobileStats/"
-        tcpdumpsResults_dir = user_dir + "/tcpdumpsResults/"
-        clientXputs_dir = user_dir + "/clientXputs/"
 
-        original_pcap_file, inverted_pcap_file = get_tcpdump_file(tcpdumpsResults_dir, userID, historyCount)
+        original_pcap_file, inverted_pcap_file = get_tcpdump_file(record_manifest, positive_test_id)
 
         if not original_pcap_file:
             continue
@@ -129,38 +185,72 @@ def copy_test_files(true_positive_ids_per_carrier, trace_analysis_dir, wehe_reco
             os.mkdir(user_trace_tcpdump_dir)
             os.mkdir(user_trace_clientXputs_dir)
 
-        regex_replayInfo_file = "{}/replayInfo_{}_{}_0.json".format(replayInfo_dir, userID, historyCount)
-        regex_xput_original_file = "{}/Xput_{}_{}_0.json".format(clientXputs_dir, userID, historyCount)
-        regex_xput_inverted_file = "{}/Xput_{}_{}_1.json".format(clientXputs_dir, userID, historyCount)
-        regex_mobileStat_file = "{}/mobileStats_{}_{}_0.json".format(mobileStat_dir, userID, historyCount)
-
-        cmd_cp_replayInfo = ["cp", regex_replayInfo_file, user_trace_replay_dir]
-        cmd_cp_mobileStat = ["cp", regex_mobileStat_file, user_trace_mobileStat_dir]
-        cmd_cp_xput = ["cp", regex_xput_original_file, regex_xput_inverted_file, user_trace_clientXputs_dir]
-        cmd_cp_tcpdump = ["cp", original_pcap_file, inverted_pcap_file, user_trace_tcpdump_dir]
-
-        proc = subprocess.run(cmd_cp_replayInfo)
-        proc = subprocess.run(cmd_cp_xput)
-        proc = subprocess.run(cmd_cp_tcpdump)
-
-        if os.path.isfile(regex_mobileStat_file):
-            proc = subprocess.run(cmd_cp_mobileStat)
+        regex_replayInfo_file = json_file(record_manifest, positive_test_id, "replayInfo_0")
+        regex_xput_original_file = json_file(record_manifest, positive_test_id, "xput_0")
+        regex_xput_inverted_file = json_file(record_manifest, positive_test_id, "xput_1")
+        regex_mobileStat_file = json_file(record_manifest, positive_test_id, "mobileStats_0")
+
+        placements.append((regex_replayInfo_file, user_trace_replay_dir))
+        placements.append((regex_xput_original_file, user_trace_clientXputs_dir))
+        placements.append((regex_xput_inverted_file, user_trace_clientXputs_dir))
+        placements.append((original_pcap_file, user_trace_tcpdump_dir))
+        placements.append((inverted_pcap_file, user_trace_tcpdump_dir))
+
+        if regex_mobileStat_file:
+            placements.append((regex_mobileStat_file, user_trace_mobileStat_dir))
+
+    def place(placement):
+        src, dst_dir = placement
+        try:
+            return place_file(src, dst_dir, mode)
+        except Exception as e:
+            print("FAIL at placing", src, "in", dst_dir, e)
+            return None
+
+    start = time.time()
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        placed = list(pool.map(place, [placement for placement in placements if placement[0]]))
+    elapsed = time.time() - start
+
+    num_bytes = sum(result[1] for result in placed if result)
+    num_placed = sum(1 for result in placed if result and result[0])
+    num_skipped = sum(1 for result in placed if result and not result[0])
+    num_failed = sum(1 for result in placed if result is None)
+    print("{} files ({}): {} placed, {} up to date, {} failed, {:.1f} MB in {:.1f}s ({:.1f} MB/s)".format(
+        len(placed), mode, num_placed, num_skipped, num_failed, num_bytes / 1E6, elapsed,
+        num_bytes / 1E6 / elapsed if elapsed else 0))
 
 
 def main():
+    args = sys.argv[1:]
+    mode = "copy"
+    workers = DEFAULT_COPY_WORKERS
     try:
-        analysis_result_dir = sys.argv[1]
-        wehe_record_dir = sys.argv[2]
-        trace_analysis_dir = sys.argv[3]
-        threshold = int(sys.argv[4])
+        if '--mode' in args:
+            i = args.index('--mode')
+            mode = args[i + 1]
+            del args[i:i + 2]
+            if mode not in COPY_MODES:
+                raise ValueError
+        if '--workers' in args:
+            i = args.index('--workers')
+            workers = int(args[i + 1])
+            del args[i:i + 2]
+        analysis_result_dir = args[0]
+        wehe_record_dir = args[1]
+        trace_analysis_dir = args[2]
+        threshold = int(args[3])
     except:
         print(
-            '\r\n Please provide the following four inputs: [analysis_result_dir] [wehe_record_dir] [trace_analysis_dir] [threshold_per_carrier_replay]')
+            '\r\n Please provide the following four inputs: [analysis_result_dir] [wehe_record_dir] [trace_analysis_dir] [threshold_per_carrier_replay] <--mode copy|hardlink|reflink|symlink> <--workers N>')
         sys.exit()
 
     if not os.path.isdir(trace_analysis_dir):
         os.mkdir(trace_analysis_dir)
 
+    # the files of every test in wehe_record_dir, listed once
+    record_manifest = manifest.load(wehe_record_dir)
+
     all_true_positive_ids = []
 
     for carrier in os.listdir(analysis_result_dir):
@@ -172,9 +262,9 @@ def main():
             continue
 
         all_true_positive_ids += get_true_positive_tests(true_positive_dir, trace_analysis_dir, wehe_record_dir,
-                                                         threshold)
+                                                         record_manifest, threshold)
 
-    copy_test_files(all_true_positive_ids, trace_analysis_dir, wehe_record_dir)
+    copy_test_files(all_true_positive_ids, trace_analysis_dir, wehe_record_dir, record_manifest, mode, workers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,219 @@
+'''
+Manifest of a Wehe record directory: which files every test has, from one walk of the directory.
+
+The scripts used to find the files of a test with wildcard globs, a listing of the user's
+tcpdumpsResults/ (or clientXputs/, ...) for every file of every test. Here every user directory
+    wehe_record_dir/userID/{tcpdumpsResults,replayInfo,clientXputs,mobileStats}/
+is listed once with os.scandir (the users in parallel threads), and every file name is parsed into
+    uniqueTestID (userID_historyCount) -> {pcap_0, pcap_1, replayInfo_0, replayInfo_1,
+                                            xput_0, xput_1, mobileStats_0, mobileStats_1}
+so a lookup is a dictionary access. The pcap matching is the one of the globs it replaces:
+*_userID_*_historyCount_testID*, the first match in directory order wins.
+
+The manifest is saved to MANIFEST_DIR (default ~/.cache/throttling_manifests, empty to keep it in
+memory only) with the mtime of every user directory, a later run lists again only the users
+whose directories changed (new tests), so a growing record directory is cheap to refresh.
+'''
+
+import hashlib
+import json
+import os
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+# bump whenever the parsing changes
+MANIFEST_VERSION = 1
+
+DEFAULT_MANIFEST_DIR = os.path.join(os.path.expanduser("~"), ".cache", "throttling_manifests")
+DEFAULT_WORKERS = 8
+
+SUBDIRS = ["tcpdumpsResults", "replayInfo", "clientXputs", "mobileStats"]
+# file name prefix -> manifest key, replayInfo_userID_historyCount_testID.json and alike
+PREFIX_KEYS = {"replayInfo": "replayInfo", "Xput": "xput", "mobileStats": "mobileStats"}
+
+
+def manifest_dir():
+    return os.environ.get("MANIFEST_DIR", DEFAULT_MANIFEST_DIR)
+
+
+def manifest_path(wehe_record_dir):
+    directory = manifest_dir()
+    if not directory:
+        return None
+    key = hashlib.sha1(os.path.abspath(wehe_record_dir).encode("utf-8")).hexdigest()
+    return os.path.join(directory, key + ".json")
+
+
+def user_signature(user_dir):
+    # mtimes of the user directory and its subdirectories, they change when a file is added or removed
+    signature = []
+    for subdir in [""] + SUBDIRS:
+        try:
+            signature.append(os.stat(os.path.join(user_dir, subdir)).st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return signature
+
+
+def pcap_tests(name, userID):
+    # every (historyCount, testID) whose glob *_userID_*_historyCount_testID* matches name
+    tokens = name.split('_')
+    for i in range(1, len(tokens)):
+        if tokens[i] != userID:
+            continue
+        for j in range(i + 2, len(tokens) - 1):
+            if tokens[j].isdigit() and tokens[j + 1][:1].isdigit():
+                yield tokens[j], tokens[j + 1][0]
+
+
+def record_tests(name, subdir):
+    # (key, userID, historyCount, testID) of replayInfo_/Xput_/mobileStats_ files, None for anything else
+    meta_info = name.split('.')[0].split('_')
+    if len(meta_info) != 4:
+        return None
+    # get_test_metadata takes any name in replayInfo/ with the four parts
+    if subdir == "replayInfo":
+        return "replayInfo", meta_info[1], meta_info[2], meta_info[3]
+    if meta_info[0] not in PREFIX_KEYS:
+        return None
+    return PREFIX_KEYS[meta_info[0]], meta_info[1], meta_info[2], meta_info[3]
+
+
+def scan_user(wehe_record_dir, userID):
+    # {uniqueTestID: {key: path relative to wehe_record_dir}} of one user
+    tests = {}
+    for subdir in SUBDIRS:
+        try:
+            entries = list(os.scandir(os.path.join(wehe_record_dir, userID, subdir)))
+        except OSError:
+            continue
+        for entry in entries:
+            # glob skips hidden files
+            if entry.name.startswith('.'):
+                continue
+            path = userID + "/" + subdir + "/" + entry.name
+            if subdir == "tcpdumpsResults":
+                for historyCount, testID in pcap_tests(entry.name, userID):
+                    tests.setdefault("{}_{}".format(userID, historyCount), {}).setdefault("pcap_" + testID, path)
+                continue
+            parsed = record_tests(entry.name, subdir)
+            if not parsed:
+                continue
+            key, fileUserID, historyCount, testID = parsed
+            files = tests.setdefault("{}_{}".format(fileUserID, historyCount), {})
+            file_key = "{}_{}".format(key, testID)
+            # the .json client throughputs are read before the .pickle ones
+            if file_key not in files or (key == "xput" and entry.name.endswith(".json")):
+                files[file_key] = path
+    return tests
+
+
+class Manifest(object):
+    '''
+    Files of every test of a record directory, refreshed user by user.
+    '''
+    def __init__(self, wehe_record_dir, users=None):
+        self.wehe_record_dir = wehe_record_dir
+        # userID -> {"signature": [...], "tests": {uniqueTestID: {key: relative path}}}
+        self.users = users or {}
+        self.tests = {}
+        self.index()
+
+    def index(self):
+        self.tests = {}
+        for userID in sorted(self.users):
+            self.tests.update(self.users[userID]["tests"])
+
+    def refresh(self, workers=DEFAULT_WORKERS):
+        # list again the users that are new or whose directories changed, returns how many
+        try:
+            userIDs = sorted(entry.name for entry in os.scandir(self.wehe_record_dir) if entry.is_dir())
+        except OSError:
+            userIDs = []
+
+        with ThreadPoolExecutor(max(1, workers)) as pool:
+            signatures = dict(zip(userIDs, pool.map(
+                lambda userID: user_signature(os.path.join(self.wehe_record_dir, userID)), userIDs)))
+            changed = [userID for userID in userIDs
+                       if userID not in self.users or self.users[userID]["signature"] != signatures[userID]]
+            scanned = pool.map(lambda userID: scan_user(self.wehe_record_dir, userID), changed)
+            for userID, tests in zip(changed, scanned):
+                self.users[userID] = {"signature": signatures[userID], "tests": tests}
+
+        removed = [userID for userID in self.users if userID not in signatures]
+        for userID in removed:
+            del self.users[userID]
+
+        if changed or removed:
+            self.index()
+        return len(changed) + len(removed)
+
+    def get(self, uniqueTestID):
+        return self.tests.get(uniqueTestID, {})
+
+    def file(self, uniqueTestID, key):
+        # full path of one file of a test, None if the test does not have it
+        path = self.get(uniqueTestID).get(key)
+        if path is None:
+            return None
+        return self.wehe_record_dir + "/" + path
+
+    def replay_infos(self, userID):
+        # replayInfo file names of a user, as os.listdir(userID/replayInfo/) would list them (sorted)
+        names = []
+        for uniqueTestID, files in self.users.get(userID, {}).get("tests", {}).items():
+            for key, path in files.items():
+                if key.startswith("replayInfo_"):
+                    names.append(path.split("/")[-1])
+        return sorted(names)
+
+    def userIDs(self):
+        return sorted(self.users)
+
+
+def load(wehe_record_dir, workers=DEFAULT_WORKERS):
+    # the manifest of wehe_record_dir, brought up to date and saved
+    path = manifest_path(wehe_record_dir)
+    users = None
+    if path and os.path.exists(path):
+        try:
+            saved = json.load(open(path, 'r'))
+            if saved.get("version") == MANIFEST_VERSION:
+                users = saved["users"]
+        except ValueError:
+            print("FAIL at loading manifest", path)
+
+    manifest = Manifest(wehe_record_dir, users)
+    if manifest.refresh(workers) and path:
+        try:
+            save(manifest, path)
+        except OSError as e:
+            print("FAIL at saving manifest", e)
+    return manifest
+
+
+def save(manifest, path):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "users": manifest.users}, f)
+    os.replace(tmp_path, path)
+
+
+# the manifests of this process, loaded on first use
+_manifests = {}
+
+
+def get_manifest(wehe_record_dir):
+    key = os.path.abspath(wehe_record_dir)
+    if key not in _manifests:
+        _manifests[key] = load(wehe_record_dir)
+    return _manifests[key]
+
+
+def find_file(user_dir, uniqueTestID, key):
+    # the file of a test in user_dir (wehe_record_dir/userID), None if there is none
+    wehe_record_dir = os.path.dirname(os.path.normpath(user_dir))
+    return get_manifest(wehe_record_dir).file(uniqueTestID, key)
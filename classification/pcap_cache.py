@@ -0,0 +1,156 @@
+'''
+On-disk cache of the packet columns pcap_reader extracts from a capture.
+
+Every entry is a compressed .npz file in the cache directory, named after a hash of
+    absolute path + file size + mtime + engine + EXTRACTOR_VERSION
+so a pcap that is replaced or touched, or a change in what the extractor returns
+(bump EXTRACTOR_VERSION), simply misses the cache.
+
+The cache directory is bounded in size: every process keeps a running total of the directory,
+taken by one scan at its first write and advanced by every write, and when the total goes over the
+limit the least recently used entries (a hit refreshes the entry's mtime) are removed until it is
+below EVICT_TO of the limit, so a full cache is not scanned again at the next write. Other processes write to the same directory, so it is scanned again every RESCAN_WRITES writes.
+An eviction scan also removes the .tmp files of writes interrupted more than STALE_TMP_AGE ago.
+
+Environment variables:
+    PCAP_CACHE_DIR        cache directory (default ~/.cache/throttling_pcap_cache), empty to disable
+    PCAP_CACHE_MAX_BYTES  size limit of the cache directory (default 10GB)
+'''
+
+import hashlib
+import os
+import tempfile
+import time
+
+import numpy
+
+# bump whenever the columns returned by pcap_reader change
+EXTRACTOR_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "throttling_pcap_cache")
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+# writes after which the directory is scanned again, even below the limit
+RESCAN_WRITES = 256
+# fraction of the limit an eviction brings the directory down to
+EVICT_TO = 0.9
+# seconds after which a .tmp file is a leftover of an interrupted write, not one in progress
+STALE_TMP_AGE = 3600
+
+# directory -> [running size total, writes since the last scan], per process
+directory_sizes = {}
+
+
+def cache_dir():
+    return os.environ.get("PCAP_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+
+def max_bytes():
+    return int(os.environ.get("PCAP_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+
+
+def cache_key(pcapFile, engine):
+    st = os.stat(pcapFile)
+    identity = "{}|{}|{}|{}|{}".format(os.path.abspath(pcapFile), st.st_size, st.st_mtime_ns, engine, EXTRACTOR_VERSION)
+    return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+
+def cache_path(pcapFile, engine, directory=None):
+    if directory is None:
+        directory = cache_dir()
+    if not directory:
+        return None
+    return os.path.join(directory, cache_key(pcapFile, engine) + ".npz")
+
+
+def load(pcapFile, engine, directory=None):
+    path = cache_path(pcapFile, engine, directory)
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with numpy.load(path) as npz:
+            packets = {column: npz[column] for column in npz.files}
+    except Exception:
+        # truncated or otherwise unreadable entry, parse the pcap again
+        return None
+    # mark as recently used for the eviction
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+    return packets
+
+
+def store(pcapFile, engine, packets, directory=None, limit=None):
+    path = cache_path(pcapFile, engine, directory)
+    if not path:
+        return
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    try:
+        replaced = os.stat(path).st_size
+    except OSError:
+        replaced = 0
+
+    # write to a temporary file first so concurrent readers never see a partial entry
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            numpy.savez_compressed(f, **packets)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if limit is None:
+        limit = max_bytes()
+    size = directory_sizes.get(directory)
+    if size is not None and size[1] < RESCAN_WRITES:
+        size[0] += os.stat(path).st_size - replaced
+        size[1] += 1
+        if size[0] <= limit:
+            return
+    directory_sizes[directory] = [evict(directory, limit, int(limit * EVICT_TO)), 0]
+
+
+def evict(directory, limit, target=None):
+    # when the directory is over limit, remove the least recently used entries until it is at target (default limit)
+    if target is None:
+        target = limit
+    entries = []
+    total = 0
+    now = time.time()
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".tmp"):
+            try:
+                if now - entry.stat().st_mtime > STALE_TMP_AGE:
+                    os.remove(entry.path)
+                    continue
+                total += entry.stat().st_size
+            except OSError:
+                pass
+            continue
+        if not entry.name.endswith(".npz"):
+            continue
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, entry.path))
+        total += st.st_size
+
+    if total <= limit:
+        return total
+    # least recently used first
+    entries.sort()
+    for mtime, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+    return total
@@ -0,0 +1,730 @@
+'''
+Read the per-packet TCP fields of a replay tcpdump without forking tshark.
+
+The analysis scripts only ever ask tshark for a handful of header fields:
+
+    tcp.srcport, tcp.dstport, tcp.seq, tcp.ack, frame.time_relative, frame.len, tcp.len
+
+This module parses libpcap (usec and nsec) and pcapng captures directly,
+including gzip compressed ones, and decodes Ethernet (with VLAN tags),
+Linux cooked (v1 and v2), BSD loopback and raw IP link layers carrying IPv4/IPv6 + TCP.
+Header decoding is done on NumPy arrays, a chunk of packets at a time.
+
+Sequence and ack numbers are relative to the base sequence number of each direction
+of every TCP connection, the same way tshark prints them by default.
+
+tcp.analysis.retransmission and tcp.analysis.out_of_order are computed by tcp_analysis
+from the decoded columns, following tshark's rules.
+
+Every packet in the capture gets one row (as with tshark -T fields), non-TCP packets
+have src_port == dst_port == -1.
+
+tshark stays the default engine until tcp_analysis.py shows that the native flags agree with it
+on the reference captures, the native reader is opted into with PCAP_ENGINE=native or
+    load_packets(pcapFile, engine="native")
+    load_packets(pcapFile, engine="tshark")
+both return the same dictionary of columns, which load_packets keeps in pcap_cache
+so the next run on an unchanged pcap does not parse it again.
+'''
+
+import gzip
+import mmap
+import os
+import struct
+import subprocess
+
+import numpy
+
+import pcap_cache
+import tcp_analysis
+
+ENGINES = ["native", "tshark"]
+DEFAULT_ENGINE = "tshark"
+
+# link layer types we know how to strip
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+# DLT_RAW is 12 or 14 depending on the platform that wrote the capture
+LINKTYPES_RAW_IP = [LINKTYPE_RAW, 12, 14, LINKTYPE_IPV4, LINKTYPE_IPV6]
+
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+# bytes of every packet we look at, enough for VLAN/cooked headers + IPv4 options + TCP ports/seq/ack/flags
+HEADER_WINDOW = 128
+# number of packets decoded at once, bounds the size of the header matrix
+DECODE_CHUNK = 1 << 18
+
+TH_FIN = 0x01
+TH_SYN = 0x02
+TH_RST = 0x04
+TH_ACK = 0x10
+
+TSHARK_FIELDS = ['tcp.srcport', 'tcp.dstport', 'tcp.seq', 'tcp.ack', 'frame.time_relative', 'frame.len',
+                 'tcp.len', 'tcp.flags', 'tcp.window_size_value', 'tcp.stream', 'tcp.analysis.retransmission',
+                 'tcp.analysis.out_of_order']
+# dtypes of the columns filled from the tshark fields above
+TSHARK_COLUMNS = {"src_port": numpy.int32, "dst_port": numpy.int32, "seq": numpy.uint64, "ack": numpy.uint64,
+                  "time": numpy.float64, "frame_len": numpy.uint32, "tcp_len": numpy.uint32,
+                  "tcp_flags": numpy.uint16, "tcp_window": numpy.uint16, "stream": numpy.int32,
+                  "retransmission": numpy.uint8, "out_of_order": numpy.uint8}
+# bytes of tshark output parsed at once
+TSHARK_READ_SIZE = 1 << 22
+
+
+def open_capture(pcapFile):
+    # mmap plain captures, decompress gzip'ed ones in memory
+    with open(pcapFile, 'rb') as f:
+        magic = f.read(2)
+        if magic == b'\x1f\x8b':
+            f.seek(0)
+            return gzip.GzipFile(fileobj=f).read()
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def scan_pcap(buf):
+    # Walk the record headers of a libpcap file
+    # returns per packet: data offset, captured length, original length, seconds, nanoseconds, linktype
+    magic = struct.unpack_from('<I', buf, 0)[0]
+    if magic in [PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC]:
+        endian = '<'
+    else:
+        endian = '>'
+        magic = struct.unpack_from('>I', buf, 0)[0]
+    nsec_per_unit = 1 if magic == PCAP_MAGIC_NSEC else 1000
+
+    linktype = struct.unpack_from(endian + 'I', buf, 20)[0] & 0x0FFFFFFF
+    record_header = struct.Struct(endian + 'IIII')
+
+    offsets = []
+    caplens = []
+    origlens = []
+    secs = []
+    fracs = []
+
+    pos = 24
+    size = len(buf)
+    while pos + 16 <= size:
+        ts_sec, ts_frac, caplen, origlen = record_header.unpack_from(buf, pos)
+        pos += 16
+        if pos + caplen > size:
+            # truncated last record
+            caplen = size - pos
+        offsets.append(pos)
+        caplens.append(caplen)
+        origlens.append(origlen)
+        secs.append(ts_sec)
+        fracs.append(ts_frac)
+        pos += caplen
+
+    nsecs = numpy.array(fracs, dtype=numpy.int64) * nsec_per_unit
+    linktypes = numpy.full(len(offsets), linktype, dtype=numpy.int32)
+
+    return (numpy.array(offsets, dtype=numpy.int64), numpy.array(caplens, dtype=numpy.int64),
+            numpy.array(origlens, dtype=numpy.int64), numpy.array(secs, dtype=numpy.int64), nsecs, linktypes)
+
+
+def pcapng_ticks_per_second(if_tsresol):
+    # if_tsresol: MSB clear -> 10^-value, MSB set -> 2^-value
+    if if_tsresol & 0x80:
+        return 2 ** (if_tsresol & 0x7F)
+    return 10 ** if_tsresol
+
+
+def parse_pcapng_idb(buf, pos, block_len, endian):
+    linktype = struct.unpack_from(endian + 'H', buf, pos + 8)[0]
+    ticks_per_second = 10 ** 6
+    # options start after linktype, reserved and snaplen
+    opt = pos + 16
+    end = pos + block_len - 4
+    while opt + 4 <= end:
+        code, length = struct.unpack_from(endian + 'HH', buf, opt)
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            ticks_per_second = pcapng_ticks_per_second(buf[opt + 4])
+        opt += 4 + ((length + 3) & ~3)
+
+    return linktype, ticks_per_second
+
+
+def scan_pcapng(buf):
+    # Walk the blocks of a pcapng file, only packet blocks are kept
+    offsets = []
+    caplens = []
+    origlens = []
+    secs = []
+    nsecs = []
+    linktypes = []
+
+    interfaces = []
+    endian = '<'
+    last_sec = last_nsec = 0
+
+    pos = 0
+    size = len(buf)
+    while pos + 12 <= size:
+        block_type = struct.unpack_from(endian + 'I', buf, pos)[0]
+        if block_type == PCAPNG_SHB:
+            # a new section, possibly with another byte order
+            byte_order = struct.unpack_from('<I', buf, pos + 8)[0]
+            endian = '<' if byte_order == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            interfaces = []
+        block_len = struct.unpack_from(endian + 'I', buf, pos + 4)[0]
+        if block_len < 12 or pos + block_len > size:
+            break
+
+        if block_type == 1:
+            # Interface Description Block
+            interfaces.append(parse_pcapng_idb(buf, pos, block_len, endian))
+        elif block_type in [6, 2]:
+            # Enhanced Packet Block / obsolete Packet Block
+            if block_type == 6:
+                interface_id, ts_high, ts_low, caplen, origlen = struct.unpack_from(endian + 'IIIII', buf, pos + 8)
+            else:
+                interface_id, drops, ts_high, ts_low, caplen, origlen = struct.unpack_from(endian + 'HHIIII', buf, pos + 8)
+            linktype, ticks_per_second = interfaces[interface_id]
+            ticks = (ts_high << 32) | ts_low
+            last_sec = ticks // ticks_per_second
+            last_nsec = (ticks % ticks_per_second) * 1000000000 // ticks_per_second
+            offsets.append(pos + 28)
+            caplens.append(min(caplen, block_len - 32))
+            origlens.append(origlen)
+            secs.append(last_sec)
+            nsecs.append(last_nsec)
+            linktypes.append(linktype)
+        elif block_type == 3:
+            # Simple Packet Block, no timestamp, always the first interface
+            origlen = struct.unpack_from(endian + 'I', buf, pos + 8)[0]
+            offsets.append(pos + 12)
+            caplens.append(min(origlen, block_len - 16))
+            origlens.append(origlen)
+            secs.append(last_sec)
+            nsecs.append(last_nsec)
+            linktypes.append(interfaces[0][0])
+
+        pos += block_len
+
+    return (numpy.array(offsets, dtype=numpy.int64), numpy.array(caplens, dtype=numpy.int64),
+            numpy.array(origlens, dtype=numpy.int64), numpy.array(secs, dtype=numpy.int64),
+            numpy.array(nsecs, dtype=numpy.int64), numpy.array(linktypes, dtype=numpy.int32))
+
+
+def be16(hdr, rows, col):
+    return (hdr[rows, col].astype(numpy.int64) << 8) | hdr[rows, col + 1]
+
+
+def be32(hdr, rows, col):
+    return (be16(hdr, rows, col) << 16) | be16(hdr, rows, col + 2)
+
+
+def decode_headers(hdr, caplens, linktypes):
+    # hdr is a (n, HEADER_WINDOW) uint8 matrix with the first bytes of every packet
+    n = hdr.shape[0]
+    rows = numpy.arange(n)
+    window = hdr.shape[1]
+
+    # 1. link layer: find the offset of the IP header
+    l3 = numpy.zeros(n, dtype=numpy.int64)
+    # ethertype/protocol, -1 when the link layer does not tell us
+    ethertype = numpy.full(n, -1, dtype=numpy.int64)
+
+    is_eth = linktypes == LINKTYPE_ETHERNET
+    if is_eth.any():
+        eth_type = be16(hdr, rows, 12)
+        l3_eth = numpy.full(n, 14, dtype=numpy.int64)
+        # up to two 802.1Q/802.1ad tags
+        for _ in range(2):
+            tagged = is_eth & ((eth_type == 0x8100) | (eth_type == 0x88A8))
+            eth_type = numpy.where(tagged, be16(hdr, rows, numpy.minimum(l3_eth + 2, window - 2)), eth_type)
+            l3_eth = numpy.where(tagged, l3_eth + 4, l3_eth)
+        l3 = numpy.where(is_eth, l3_eth, l3)
+        ethertype = numpy.where(is_eth, eth_type, ethertype)
+
+    is_sll = linktypes == LINKTYPE_LINUX_SLL
+    l3 = numpy.where(is_sll, 16, l3)
+    ethertype = numpy.where(is_sll, be16(hdr, rows, 14), ethertype)
+
+    is_sll2 = linktypes == LINKTYPE_LINUX_SLL2
+    l3 = numpy.where(is_sll2, 20, l3)
+    ethertype = numpy.where(is_sll2, be16(hdr, rows, 0), ethertype)
+
+    is_null = (linktypes == LINKTYPE_NULL) | (linktypes == LINKTYPE_LOOP)
+    l3 = numpy.where(is_null, 4, l3)
+
+    known_link = is_eth | is_sll | is_sll2 | is_null | numpy.isin(linktypes, LINKTYPES_RAW_IP)
+
+    l3 = numpy.minimum(l3, window - 40)
+    version = hdr[rows, l3] >> 4
+    is_v4 = known_link & (version == 4) & ((ethertype == -1) | (ethertype == 0x0800))
+    is_v6 = known_link & (version == 6) & ((ethertype == -1) | (ethertype == 0x86DD))
+
+    # 2. network layer
+    ihl = (hdr[rows, l3] & 0x0F).astype(numpy.int64) * 4
+    v4_total_len = be16(hdr, rows, l3 + 2)
+    v4_frag_offset = be16(hdr, rows, l3 + 6) & 0x1FFF
+    v4_proto = hdr[rows, l3 + 9]
+    v6_payload_len = be16(hdr, rows, l3 + 4)
+    v6_next_header = hdr[rows, l3 + 6]
+
+    is_tcp = (is_v4 & (v4_proto == 6) & (v4_frag_offset == 0) & (ihl >= 20)) | (is_v6 & (v6_next_header == 6))
+    l4 = numpy.where(is_v6, l3 + 40, l3 + ihl)
+    # the TCP fields we need end with the window, at byte 16 of the TCP header
+    is_tcp &= (l4 + 16 <= caplens) & (l4 + 16 <= window)
+    l4 = numpy.where(is_tcp, l4, 0)
+
+    ip_payload_len = numpy.where(is_v6, v6_payload_len, v4_total_len - ihl)
+
+    # addresses, IPv4 ones are zero padded to 16 bytes
+    addr_cols = numpy.arange(16)
+    addr_len = numpy.where(is_v6, 16, 4)
+    src_start = numpy.where(is_v6, l3 + 8, l3 + 12)
+    dst_start = numpy.where(is_v6, l3 + 24, l3 + 16)
+    addr_mask = (addr_cols[None, :] < addr_len[:, None]) & is_tcp[:, None]
+    src_addr = numpy.where(addr_mask, hdr[rows[:, None], numpy.minimum(src_start[:, None] + addr_cols, window - 1)], 0)
+    dst_addr = numpy.where(addr_mask, hdr[rows[:, None], numpy.minimum(dst_start[:, None] + addr_cols, window - 1)], 0)
+
+    # 3. transport layer
+    src_port = numpy.where(is_tcp, be16(hdr, rows, l4), -1)
+    dst_port = numpy.where(is_tcp, be16(hdr, rows, l4 + 2), -1)
+    seq = numpy.where(is_tcp, be32(hdr, rows, l4 + 4), 0)
+    ack = numpy.where(is_tcp, be32(hdr, rows, l4 + 8), 0)
+    tcp_header_len = (hdr[rows, l4 + 12] >> 4).astype(numpy.int64) * 4
+    tcp_flags = numpy.where(is_tcp, ((hdr[rows, l4 + 12].astype(numpy.int64) & 0x01) << 8) | hdr[rows, l4 + 13], 0)
+    tcp_window = numpy.where(is_tcp, be16(hdr, rows, l4 + 14), 0)
+    tcp_len = numpy.where(is_tcp, numpy.maximum(ip_payload_len - tcp_header_len, 0), 0)
+
+    return {
+        "is_tcp": is_tcp,
+        "src_addr": src_addr.astype(numpy.uint8),
+        "dst_addr": dst_addr.astype(numpy.uint8),
+        "src_port": src_port,
+        "dst_port": dst_port,
+        "seq": seq,
+        "ack": ack,
+        "tcp_flags": tcp_flags,
+        "tcp_window": tcp_window,
+        "tcp_len": tcp_len,
+        "tso": is_tcp & is_v4 & (v4_total_len == 0),
+        "l4": l4,
+        "tcp_header_len": tcp_header_len,
+    }
+
+
+def read_header_window(data, offsets, caplens):
+    # gather the first HEADER_WINDOW bytes of every packet into a matrix
+    cols = numpy.arange(HEADER_WINDOW)
+    index = offsets[:, None] + cols
+    valid = cols[None, :] < caplens[:, None]
+    index = numpy.where(valid, index, 0)
+    return numpy.where(valid, data[index], 0).astype(numpy.uint8)
+
+
+def assign_streams(src_addr, dst_addr, src_port, dst_port, is_tcp):
+    # Number TCP connections in order of their first packet, like tcp.stream
+    # and tell the two directions of every connection apart
+    n = len(src_port)
+    stream = numpy.full(n, -1, dtype=numpy.int64)
+    direction = numpy.zeros(n, dtype=numpy.int64)
+    tcp_index = numpy.flatnonzero(is_tcp)
+    if not len(tcp_index):
+        return stream, direction
+
+    src = numpy.concatenate([src_addr[tcp_index], src_port[tcp_index, None].view(numpy.uint8)[:, :2]], axis=1)
+    dst = numpy.concatenate([dst_addr[tcp_index], dst_port[tcp_index, None].view(numpy.uint8)[:, :2]], axis=1)
+
+    # order the two endpoints of a packet (bytewise) so that both directions map to the same key
+    rows = numpy.arange(len(tcp_index))
+    first_diff = numpy.argmax(src != dst, axis=1)
+    src_is_lower = src[rows, first_diff] < dst[rows, first_diff]
+
+    low = numpy.where(src_is_lower[:, None], src, dst)
+    high = numpy.where(src_is_lower[:, None], dst, src)
+    key = numpy.ascontiguousarray(numpy.concatenate([low, high], axis=1))
+    key = key.view(numpy.dtype((numpy.void, key.shape[1]))).ravel()
+
+    unique_keys, first_index, inverse = numpy.unique(key, return_index=True, return_inverse=True)
+    # renumber streams by first appearance
+    order = numpy.argsort(first_index, kind='stable')
+    renumber = numpy.empty(len(order), dtype=numpy.int64)
+    renumber[order] = numpy.arange(len(order))
+    stream[tcp_index] = renumber[inverse.ravel()]
+
+    # direction 0 is the side that sent the first packet of the connection
+    first_src_is_lower = src_is_lower[first_index]
+    direction[tcp_index] = (src_is_lower != first_src_is_lower[inverse.ravel()]).astype(numpy.int64)
+
+    return stream, direction
+
+
+def first_index_per_group(groups, candidates):
+    # index of the first candidate packet in each group, -1 if there is none
+    first = numpy.full(groups.max() + 1 if len(groups) else 0, -1, dtype=numpy.int64)
+    index = numpy.flatnonzero(candidates)
+    if len(index):
+        group_of, at = numpy.unique(groups[index], return_index=True)
+        first[group_of] = index[at]
+    return first
+
+
+def relative_seq_ack(seq, ack, tcp_flags, stream, direction, is_tcp):
+    # Base sequence numbers follow tshark:
+    # the SYN's sequence number, or (seq - 1) of the first packet seen in that direction,
+    # or (ack - 1) of the first ACK seen from the other side if that comes earlier
+    n = len(seq)
+    rel_seq = numpy.zeros(n, dtype=numpy.uint64)
+    rel_ack = numpy.zeros(n, dtype=numpy.uint64)
+    if not is_tcp.any():
+        return rel_seq, rel_ack
+
+    group = numpy.where(is_tcp, stream * 2 + direction, 0)
+    reverse_group = numpy.where(is_tcp, stream * 2 + (1 - direction), 0)
+    num_groups = 2 * (stream.max() + 1)
+
+    is_syn = (tcp_flags & TH_SYN) != 0
+    has_ack = is_tcp & ((tcp_flags & TH_ACK) != 0)
+
+    first_seen = first_index_per_group(group, is_tcp)
+    first_seen = numpy.pad(first_seen, (0, num_groups - len(first_seen)), constant_values=-1)
+    base_from_seq = numpy.where(is_syn, seq, seq - 1)
+
+    # first ACK sent by the *other* direction of each group
+    first_acked = first_index_per_group(reverse_group, has_ack)
+    first_acked = numpy.pad(first_acked, (0, num_groups - len(first_acked)), constant_values=-1)
+
+    big = n + 1
+    seen_at = numpy.where(first_seen >= 0, first_seen, big)
+    acked_at = numpy.where(first_acked >= 0, first_acked, big)
+    base = numpy.where(seen_at <= acked_at,
+                       base_from_seq[numpy.minimum(seen_at, n - 1)],
+                       ack[numpy.minimum(acked_at, n - 1)] - 1)
+
+    rel_seq = numpy.where(is_tcp, (seq - base[group]) % (1 << 32), 0).astype(numpy.uint64)
+    rel_ack = numpy.where(has_ack, (ack - base[reverse_group]) % (1 << 32), 0).astype(numpy.uint64)
+
+    return rel_seq, rel_ack
+
+
+def read_pcap_native(pcapFile):
+    buf = open_capture(pcapFile)
+
+    if len(buf) < 4:
+        return empty_columns()
+    if struct.unpack_from('<I', buf, 0)[0] == PCAPNG_SHB:
+        offsets, caplens, origlens, secs, nsecs, linktypes = scan_pcapng(buf)
+    else:
+        offsets, caplens, origlens, secs, nsecs, linktypes = scan_pcap(buf)
+
+    n = len(offsets)
+    if not n:
+        return empty_columns()
+
+    data = numpy.frombuffer(buf, dtype=numpy.uint8)
+
+    chunks = []
+    for start in range(0, n, DECODE_CHUNK):
+        end = min(start + DECODE_CHUNK, n)
+        hdr = read_header_window(data, offsets[start:end], caplens[start:end])
+        chunks.append(decode_headers(hdr, caplens[start:end], linktypes[start:end]))
+    # drop the reference to the mapped file before it gets closed
+    del data
+    decoded = {key: numpy.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+
+    # segmentation offload: IPv4 total length is 0, use the length on the wire
+    tso = decoded["tso"]
+    decoded["tcp_len"] = numpy.where(tso, numpy.maximum(origlens - decoded["l4"] - decoded["tcp_header_len"], 0),
+                                     decoded["tcp_len"])
+
+    is_tcp = decoded["is_tcp"]
+    stream, direction = assign_streams(decoded["src_addr"], decoded["dst_addr"], decoded["src_port"],
+                                       decoded["dst_port"], is_tcp)
+    seq, ack = relative_seq_ack(decoded["seq"], decoded["ack"], decoded["tcp_flags"], stream, direction, is_tcp)
+
+    if isinstance(buf, mmap.mmap):
+        buf.close()
+
+    # frame.time_relative, kept exact by subtracting the integer parts first
+    time = (secs - secs[0]).astype(numpy.float64) + (nsecs - nsecs[0]).astype(numpy.float64) * 1e-9
+
+    packets = {
+        "src_port": decoded["src_port"].astype(numpy.int32),
+        "dst_port": decoded["dst_port"].astype(numpy.int32),
+        "seq": seq,
+        "ack": ack,
+        "time": time,
+        "frame_len": origlens.astype(numpy.uint32),
+        "tcp_len": decoded["tcp_len"].astype(numpy.uint32),
+        "tcp_flags": decoded["tcp_flags"].astype(numpy.uint16),
+        "tcp_window": decoded["tcp_window"].astype(numpy.uint16),
+        "stream": stream.astype(numpy.int32),
+        "direction": direction.astype(numpy.uint8),
+    }
+    packets.update(tcp_analysis.analyze_sequence_numbers(packets))
+
+    return packets
+
+
+def empty_columns():
+    return {
+        "src_port": numpy.zeros(0, dtype=numpy.int32),
+        "dst_port": numpy.zeros(0, dtype=numpy.int32),
+        "seq": numpy.zeros(0, dtype=numpy.uint64),
+        "ack": numpy.zeros(0, dtype=numpy.uint64),
+        "time": numpy.zeros(0, dtype=numpy.float64),
+        "frame_len": numpy.zeros(0, dtype=numpy.uint32),
+        "tcp_len": numpy.zeros(0, dtype=numpy.uint32),
+        "tcp_flags": numpy.zeros(0, dtype=numpy.uint16),
+        "tcp_window": numpy.zeros(0, dtype=numpy.uint16),
+        "stream": numpy.zeros(0, dtype=numpy.int32),
+        "direction": numpy.zeros(0, dtype=numpy.uint8),
+        "retransmission": numpy.zeros(0, dtype=numpy.uint8),
+        "out_of_order": numpy.zeros(0, dtype=numpy.uint8),
+    }
+
+
+def tshark_value(value, default=0, base=10):
+    # tshark prints nothing for absent fields and "a,b" for repeated ones
+    if not value:
+        return default
+    return int(value.split(',')[0], base)
+
+
+def tshark_line_chunks(cmd, read_size=TSHARK_READ_SIZE):
+    # read tshark's stdout a block at a time instead of buffering it all with communicate(),
+    # only complete lines are handed out, the partial last line is kept for the next block
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    rest = b''
+    try:
+        while True:
+            data = p.stdout.read(read_size)
+            if not data:
+                break
+            data = rest + data
+            cut = data.rfind(b'\n') + 1
+            rest = data[cut:]
+            if cut:
+                yield data[:cut].decode("utf-8").splitlines()
+        if rest:
+            yield [rest.decode("utf-8")]
+    finally:
+        # closing the pipe makes tshark exit if we stopped reading early
+        p.stdout.close()
+        p.wait()
+
+
+def tshark_lines(cmd):
+    for lines in tshark_line_chunks(cmd):
+        for line in lines:
+            yield line
+
+
+class GrowableColumns(object):
+    '''
+    Preallocated NumPy columns that double in place when full,
+    so rows can be appended a block at a time without keeping Python lists around.
+    '''
+    def __init__(self, dtypes, capacity=1 << 16):
+        self.size = 0
+        self.columns = {name: numpy.empty(capacity, dtype=dtype) for name, dtype in dtypes.items()}
+
+    def extend(self, block):
+        n = len(next(iter(block.values())))
+        capacity = len(next(iter(self.columns.values())))
+        if self.size + n > capacity:
+            capacity = max(2 * capacity, self.size + n)
+            for column in self.columns.values():
+                column.resize(capacity, refcheck=False)
+        for name, values in block.items():
+            self.columns[name][self.size:self.size + n] = values
+        self.size += n
+
+    def finish(self):
+        for column in self.columns.values():
+            column.resize(self.size, refcheck=False)
+        return self.columns
+
+
+def read_pcap_tshark(pcapFile):
+    cmd = ['tshark', '-r', pcapFile, '-T', 'fields', '-E', 'separator=/t']
+    for field in TSHARK_FIELDS:
+        cmd += ['-e', field]
+
+    columns = GrowableColumns(TSHARK_COLUMNS)
+
+    for lines in tshark_line_chunks(cmd):
+        src_port = []
+        dst_port = []
+        seq = []
+        ack = []
+        time = []
+        frame_len = []
+        tcp_len = []
+        tcp_flags = []
+        tcp_window = []
+        stream = []
+        retransmission = []
+        out_of_order = []
+
+        for sl in lines:
+            l = sl.split('\t')
+            if len(l) < len(TSHARK_FIELDS):
+                continue
+            src_port.append(tshark_value(l[0], -1))
+            dst_port.append(tshark_value(l[1], -1))
+            seq.append(tshark_value(l[2]))
+            ack.append(tshark_value(l[3]))
+            time.append(float(l[4]))
+            frame_len.append(tshark_value(l[5]))
+            tcp_len.append(tshark_value(l[6]))
+            tcp_flags.append(tshark_value(l[7], base=16))
+            tcp_window.append(tshark_value(l[8]))
+            stream.append(tshark_value(l[9], -1))
+            retransmission.append(1 if l[10] else 0)
+            out_of_order.append(1 if l[11] else 0)
+
+        columns.extend({
+            "src_port": src_port,
+            "dst_port": dst_port,
+            "seq": seq,
+            "ack": ack,
+            "time": time,
+            "frame_len": frame_len,
+            "tcp_len": tcp_len,
+            "tcp_flags": tcp_flags,
+            "tcp_window": tcp_window,
+            "stream": stream,
+            "retransmission": retransmission,
+            "out_of_order": out_of_order,
+        })
+
+    packets = columns.finish()
+    # tshark does not tell us which side opened the connection, leave it at 0
+    packets["direction"] = numpy.zeros(len(packets["time"]), dtype=numpy.uint8)
+
+    return packets
+
+
+def default_engine():
+    return os.environ.get("PCAP_ENGINE", DEFAULT_ENGINE)
+
+
+def load_packets(pcapFile, engine=None, use_cache=True):
+    if engine is None:
+        engine = default_engine()
+    if engine not in ENGINES:
+        raise ValueError("unknown pcap engine {}, expected one of {}".format(engine, ENGINES))
+
+    if use_cache:
+        packets = pcap_cache.load(pcapFile, engine)
+        if packets is not None:
+            return packets
+
+    if engine == "native":
+        packets = read_pcap_native(pcapFile)
+    else:
+        packets = read_pcap_tshark(pcapFile)
+
+    if use_cache:
+        try:
+            pcap_cache.store(pcapFile, engine, packets)
+        except OSError as e:
+            print("FAIL at caching packets of", pcapFile, e)
+
+    return packets
+
+
+class PacketTable(object):
+    '''
+    One row per packet of a capture, seen from the replay server:
+        time            float64, frame.time_relative
+        seq, ack        uint64, relative sequence / ack numbers
+        length          uint32, tcp.len
+        sent            uint8, 1 if the server sent the packet, 0 if it arrived on the server
+        retransmission  uint8
+        out_of_order    uint8
+
+    Every column is a NumPy array. The sent_*/arr_* attributes are boolean masks
+    for the subsets get_pcap_stat used to collect into lists:
+        table[table.sent_in].time, table[table.sent_in].seq
+    A slice (table[10:100]) returns views of the columns, a mask returns copies of the selected rows only.
+    '''
+    COLUMNS = ["time", "seq", "ack", "length", "sent", "retransmission", "out_of_order"]
+
+    def __init__(self, time, seq, ack, length, sent, retransmission, out_of_order):
+        self.time = time
+        self.seq = seq
+        self.ack = ack
+        self.length = length
+        self.sent = sent
+        self.retransmission = retransmission
+        self.out_of_order = out_of_order
+
+    @classmethod
+    def from_packets(cls, packets, server_port):
+        return cls(packets["time"], packets["seq"], packets["ack"], packets["tcp_len"],
+                   (packets["src_port"] == server_port).view(numpy.uint8),
+                   packets["retransmission"], packets["out_of_order"])
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, key):
+        return PacketTable(*[getattr(self, column)[key] for column in self.COLUMNS])
+
+    def nbytes(self):
+        return sum(getattr(self, column).nbytes for column in self.COLUMNS)
+
+    # a retransmitted packet is never counted as out of order
+    @property
+    def ret(self):
+        return self.retransmission != 0
+
+    @property
+    def out(self):
+        return (self.out_of_order != 0) & ~self.ret
+
+    @property
+    def in_order(self):
+        return (self.retransmission == 0) & (self.out_of_order == 0)
+
+    @property
+    def sent_all(self):
+        return self.sent != 0
+
+    @property
+    def sent_in(self):
+        return self.sent_all & self.in_order
+
+    @property
+    def sent_ret(self):
+        return self.sent_all & self.ret
+
+    @property
+    def sent_out(self):
+        return self.sent_all & self.out
+
+    @property
+    def arr_all(self):
+        return self.sent == 0
+
+    @property
+    def arr_in(self):
+        return self.arr_all & self.in_order
+
+    @property
+    def arr_ret(self):
+        return self.arr_all & self.ret
+
+    @property
+    def arr_out(self):
+        return self.arr_all & self.out
@@ -1,43 +1,22 @@
 import json
-import glob
 import os
 import sys
 import traceback
 import statistics
-import reverse_geocode
 import datetime
-from shapely.geometry import Point
 from datetime import datetime as dt
-import geopandas as gpd
 import matplotlib.pyplot as plt
 
+import geo_cache
+import manifest
+import record_store
+import test_stat_store
 
-def readStatesPolygon():
-    df = gpd.read_file("cb_2017_us_state_500k.shp")
 
-    statesPolygons = {}
-
-    for index, row in df.iterrows():
-        statesPolygons[row['STUSPS']] = row['geometry']
-
-    return statesPolygons
-
-
-def get_US_states(longitude, latitude):
-    statesPolygons = readStatesPolygon()
-    geoPoint = Point(longitude, latitude)
-
-    for state in statesPolygons:
-        if geoPoint.within(statesPolygons[state]):
-            return state
-
-    return ''
-
-
-def get_file_from_partial_name(file_partial_name):
-    file_name = glob.glob(file_partial_name)
-    if file_name:
-        return file_name[0]
+def json_file(record_manifest, test_id, key):
+    file_name = record_manifest.file(test_id, key)
+    if file_name and file_name.endswith(".json"):
+        return file_name
     else:
         return None
 
@@ -69,17 +48,15 @@ def loadMobileStatsFile(mobileStatsFile):
 
 
 def get_test_stat(test_id, wehe_record_dir):
-    userID = test_id.split("_")[0]
-    historyCount = test_id.split("_")[1]
-    user_dir = wehe_record_dir + "/" + userID + "/"
-    replayInfo_dir = user_dir + "/replayInfo/"
-    mobileStat_dir = user_dir + "/mobileStats/"
+    # from the record store when it has the test (see record_store.py)
+    record = record_store.get_test_record(wehe_record_dir, test_id, "0")
+    if record is not None and record[0]:
+        return record
 
-    regex_replayInfo_file = "{}/replayInfo_{}_{}_0.json".format(replayInfo_dir, userID, historyCount)
-    regex_mobileStat_file = "{}/mobileStats_{}_{}_0.json".format(mobileStat_dir, userID, historyCount)
+    record_manifest = manifest.get_manifest(wehe_record_dir)
 
-    replayInfo_file = get_file_from_partial_name(regex_replayInfo_file)
-    mobileStat_file = get_file_from_partial_name(regex_mobileStat_file)
+    replayInfo_file = json_file(record_manifest, test_id, "replayInfo_0")
+    mobileStat_file = json_file(record_manifest, test_id, "mobileStats_0")
     if not replayInfo_file:
         return None, None
 
@@ -89,48 +66,9 @@ def get_test_stat(test_id, wehe_record_dir):
     return replayInfo, mobileStats
 
 
-def loadMobileStats(mobileStats):
-    # use mobile stats to locate the geoInfo
-    try:
-        lat = mobileStats['locationInfo']['latitude']
-        lon = mobileStats['locationInfo']['longitude']
-        # later version of the replay server stores location info in replayInfo file
-        if 'country' in mobileStats['locationInfo'] and 'countryCode' in mobileStats['locationInfo'] and lat:
-            lat = float("{0:.1f}".format(float(lat)))
-            lon = float("{0:.1f}".format(float(lon)))
-            country = mobileStats['locationInfo']['country']
-            city = mobileStats['locationInfo']['city']
-            countryCode = mobileStats['locationInfo']['countryCode']
-        elif (lat == lon == '0.0') or (lat == lon == 0.0) or (lat == 'nil') or (lat == 'null'):
-            lat = lon = ''
-            country = ''
-            city = ''
-            countryCode = ''
-        elif lat:
-            coordinates = [(float(lat), float(lon))]
-            geoInfo = reverse_geocode.search(coordinates)[0]
-            country = geoInfo['country']
-            city = geoInfo['city']
-            countryCode = geoInfo['country_code'].lower()
-            lat = float("{0:.1f}".format(float(lat)))
-            lon = float("{0:.1f}".format(float(lon)))
-        else:
-            lat = lon = country = countryCode = city = ''
-
-    except Exception as e:
-        traceback.print_exc(file=sys.stdout)
-        country = ''
-        city = ''
-        countryCode = ''
-        lat = lon = ''
-
-    return lat, lon, country, countryCode, city
-
-
-def find_meda_data(one_test_id, wehe_record_dir):
-    replayInfo, mobileStats = get_test_stat(one_test_id, wehe_record_dir)
+def find_meda_data(replayInfo, mobileStats):
     if mobileStats:
-        lat, lon, country, countryCode, city = loadMobileStats(mobileStats)
+        lat, lon, country, countryCode, city = geo_cache.loadMobileStats(mobileStats)
         try:
             localTime = mobileStats['locationInfo']['localTime']
         except:
@@ -144,6 +82,18 @@ def find_meda_data(one_test_id, wehe_record_dir):
         return None
 
 
+def find_tests_meta_data(test_ids, wehe_record_dir):
+    # (ymd, hour, (lat, lon)) of every test, their locations are geocoded at once
+    # bring the record store up to date first, get_test_stat trusts what it has
+    record_store.ingest(wehe_record_dir)
+    test_stats = {}
+    for one_test_id in test_ids:
+        test_stats[one_test_id] = get_test_stat(one_test_id, wehe_record_dir)
+    geo_cache.prefetch(mobileStats for replayInfo, mobileStats in test_stats.values())
+
+    return {one_test_id: find_meda_data(*test_stats[one_test_id]) for one_test_id in test_stats}
+
+
 def get_avg_avg_diff_per_day(classified_tests_meta_data):
     avg_diff_per_day = {}
     for one_test_id in classified_tests_meta_data:
@@ -197,8 +147,8 @@ def main():
             "\r\n Please provide the following input: [classified_tests_file]")
         sys.exit()
 
-    # load tests, i.e., test_stat_per_carrier_replay
-    throttled_tests = json.load(open(tests_file, "r"))
+    # load tests, i.e., test_stat_per_carrier_replay (the json file or the store directory)
+    throttled_tests = test_stat_store.load(tests_file)
 
     throttled_tests_stat = {}
     # tests are separated by classification results
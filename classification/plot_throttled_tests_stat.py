@@ -1,46 +1,24 @@
 import json
-import glob
 import os
 import sys
 import traceback
 import reverse_geocoder
-import reverse_geocode
 import matplotlib
 import datetime
-from shapely.geometry import Point
 from datetime import datetime as dt
 import numpy as np
-import geopandas as gpd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
+import geo_cache
+import manifest
+import record_store
 
-def readStatesPolygon():
-    df = gpd.read_file("cb_2017_us_state_500k.shp")
 
-    statesPolygons = {}
-
-    for index, row in df.iterrows():
-        statesPolygons[row['STUSPS']] = row['geometry']
-
-    return statesPolygons
-
-
-def get_US_states(longitude, latitude):
-    statesPolygons = readStatesPolygon()
-    geoPoint = Point(longitude, latitude)
-
-    for state in statesPolygons:
-        if geoPoint.within(statesPolygons[state]):
-            return state
-
-    return ''
-
-
-def get_file_from_partial_name(file_partial_name):
-    file_name = glob.glob(file_partial_name)
-    if file_name:
-        return file_name[0]
+def json_file(record_manifest, test_id, key):
+    file_name = record_manifest.file(test_id, key)
+    if file_name and file_name.endswith(".json"):
+        return file_name
     else:
         return None
 
@@ -72,17 +50,15 @@ def loadMobileStatsFile(mobileStatsFile):
 
 
 def get_test_stat(test_id, wehe_record_dir):
-    userID = test_id.split("_")[0]
-    historyCount = test_id.split("_")[1]
-    user_dir = wehe_record_dir + "/" + userID + "/"
-    replayInfo_dir = user_dir + "/replayInfo/"
-    mobileStat_dir = user_dir + "/mobileStats/"
+    # from the record store when it has the test (see record_store.py)
+    record = record_store.get_test_record(wehe_record_dir, test_id, "0")
+    if record is not None and record[0]:
+        return record
 
-    regex_replayInfo_file = "{}/replayInfo_{}_{}_0.json".format(replayInfo_dir, userID, historyCount)
-    regex_mobileStat_file = "{}/mobileStats_{}_{}_0.json".format(mobileStat_dir, userID, historyCount)
+    record_manifest = manifest.get_manifest(wehe_record_dir)
 
-    replayInfo_file = get_file_from_partial_name(regex_replayInfo_file)
-    mobileStat_file = get_file_from_partial_name(regex_mobileStat_file)
+    replayInfo_file = json_file(record_manifest, test_id, "replayInfo_0")
+    mobileStat_file = json_file(record_manifest, test_id, "mobileStats_0")
     if not replayInfo_file:
         return None, None
 
@@ -92,48 +68,9 @@ def get_test_stat(test_id, wehe_record_dir):
     return replayInfo, mobileStats
 
 
-def loadMobileStats(mobileStats):
-    # use mobile stats to locate the geoInfo
-    try:
-        lat = mobileStats['locationInfo']['latitude']
-        lon = mobileStats['locationInfo']['longitude']
-        # later version of the replay server stores location info in replayInfo file
-        if 'country' in mobileStats['locationInfo'] and 'countryCode' in mobileStats['locationInfo'] and lat:
-            lat = float("{0:.1f}".format(float(lat)))
-            lon = float("{0:.1f}".format(float(lon)))
-            country = mobileStats['locationInfo']['country']
-            city = mobileStats['locationInfo']['city']
-            countryCode = mobileStats['locationInfo']['countryCode']
-        elif (lat == lon == '0.0') or (lat == lon == 0.0) or (lat == 'nil') or (lat == 'null'):
-            lat = lon = ''
-            country = ''
-            city = ''
-            countryCode = ''
-        elif lat:
-            coordinates = [(float(lat), float(lon))]
-            geoInfo = reverse_geocode.search(coordinates)[0]
-            country = geoInfo['country']
-            city = geoInfo['city']
-            countryCode = geoInfo['country_code'].lower()
-            lat = float("{0:.1f}".format(float(lat)))
-            lon = float("{0:.1f}".format(float(lon)))
-        else:
-            lat = lon = country = countryCode = city = ''
-
-    except Exception as e:
-        traceback.print_exc(file=sys.stdout)
-        country = ''
-        city = ''
-        countryCode = ''
-        lat = lon = ''
-
-    return lat, lon, country, countryCode, city
-
-
-def find_meda_data(one_test_id, wehe_record_dir):
-    replayInfo, mobileStats = get_test_stat(one_test_id, wehe_record_dir)
+def find_meda_data(replayInfo, mobileStats):
     if mobileStats:
-        lat, lon, country, countryCode, city = loadMobileStats(mobileStats)
+        lat, lon, country, countryCode, city = geo_cache.loadMobileStats(mobileStats)
         try:
             localTime = mobileStats['locationInfo']['localTime']
         except:
@@ -205,26 +142,30 @@ def main():
     # load tests
     classified_tests = json.load(open(classified_tests_file, "r"))
 
+    # replayInfo and mobileStats of every test, so that all their locations are geocoded at once
+    record_store.ingest(wehe_record_dir)
+    test_stats = {}
+    for classification in classified_tests:
+        for one_test_id in classified_tests[classification]:
+            test_stats[one_test_id] = get_test_stat(one_test_id, wehe_record_dir)
+    geo_cache.prefetch(mobileStats for replayInfo, mobileStats in test_stats.values())
+
     classified_test_states = {}
     classified_user_id = {}
+    # (classification, (lat, lon)) of the tests with a location, their states are looked up in one search
+    located_tests = []
     # tests are separated by classification results
     for classification in classified_tests:
         classified_tests_meta_data[classification] = []
         for one_test_id in classified_tests[classification]:
             # find metadata for this test
             # (ymd, hour, (lat, lon))
-            meta_data = find_meda_data(one_test_id, wehe_record_dir)
+            meta_data = find_meda_data(*test_stats[one_test_id])
             if meta_data:
                 classified_tests_meta_data[classification].append(meta_data)
                 coordinates = meta_data[2]
                 if coordinates[0] != "":
-                    coordinates = [(float(coordinates[0]), float(coordinates[1]))]
-                    test_state = reverse_geocoder.search(coordinates)[0]["admin1"]
-                    if test_state not in classified_test_states:
-                        classified_test_states[test_state] = {}
-                    if classification not in classified_test_states[test_state]:
-                        classified_test_states[test_state][classification] = 0
-                    classified_test_states[test_state][classification] += 1
+                    located_tests.append((classification, (float(coordinates[0]), float(coordinates[1]))))
                 userID = one_test_id.split("_")[0]
                 if userID not in classified_user_id:
                     classified_user_id[userID] = {}
@@ -232,6 +173,16 @@ def main():
                     classified_user_id[userID][classification] = 0
                 classified_user_id[userID][classification] += 1
 
+    if located_tests:
+        geoInfos = reverse_geocoder.search([coordinates for classification, coordinates in located_tests])
+        for (classification, coordinates), geoInfo in zip(located_tests, geoInfos):
+            test_state = geoInfo["admin1"]
+            if test_state not in classified_test_states:
+                classified_test_states[test_state] = {}
+            if classification not in classified_test_states[test_state]:
+                classified_test_states[test_state][classification] = 0
+            classified_test_states[test_state][classification] += 1
+
     count_userid_multi_classification = 0
     for userID in classified_user_id:
         if len(classified_user_id[userID].keys()) > 1:
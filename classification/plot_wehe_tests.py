@@ -33,12 +33,10 @@ import sys
 import subprocess
 import os
 import matplotlib
-import glob
 import numpy
 import json
 import pickle
 import traceback
-import reverse_geocode
 import statistics
 
 import matplotlib.pyplot as plt
@@ -48,6 +46,16 @@ from scipy.stats import ks_2samp
 from threading import Timer
 from sklearn.metrics import r2_score
 
+import carrier_name
+import geo_cache
+import manifest
+import pcap_reader
+import prefix_index
+import record_store
+import throughput
+import whois_cache
+import whois_resolver
+
 APPNAME_TO_PORT = {
     "Vimeo": "443",
     "Spotify": "80",
@@ -184,198 +192,27 @@ def doXputsCDFplots(gputs_original, client_gputs_original, gputs_inverted,
     plt.close()
 
 
-def doTputsInterval(timeL, packetL, client_sampling_interval):
-    initS = packetL[0]
-
-    sequence = [(int(x) - int(initS)) for x in packetL]
-    timeL = [float(x) for x in timeL]
-
-    duration = timeL[-1]
-    xput_interval = client_sampling_interval
-
-    # print("duration, interval", duration, xput_interval)
-
-    untilT = xput_interval
-    lastT = 0
-    tputs = []
-    ts = []
-    for i in range(len(timeL)):
-        # Calculate bytes sent during this period
-        if timeL[i] >= untilT:
-            tputs.append((sequence[i] - sequence[lastT]) / xput_interval)
-            lastT = i
-            untilT += xput_interval
-            ts.append(timeL[i])
-
-    tputs = [x * 8 / 1000000.0 for x in tputs]
-
-    return tputs, ts
-
-
-def doTputs(timeL, packetL, num_buckets=None):
-    initS = packetL[0]
-
-    sequence = [(int(x) - int(initS)) for x in packetL]
-    timeL = [float(x) for x in timeL]
-
-    if not num_buckets:
-        # If number of bucket is not specified, use 100 buckets
-        num_buckets = 100
-    else:
-        num_buckets = num_buckets
-
-    duration = timeL[-1]
-    xput_interval = float(duration) / num_buckets
-
-    # print("duration, interval", duration, xput_interval)
-
-    untilT = xput_interval
-    lastT = 0
-    tputs = []
-    ts = []
-    for i in range(len(timeL)):
-        # Calculate bytes sent during this period
-        if timeL[i] >= untilT:
-            tputs.append((sequence[i] - sequence[lastT]) / xput_interval)
-            lastT = i
-            untilT += xput_interval
-            ts.append(timeL[i])
-
-    tputs = [x * 8 / 1000000.0 for x in tputs]
-
-    return tputs, ts
-
-
-def get_pcap_stat(pcapFile, server_port=None):
+def get_pcap_stat(pcapFile, server_port=None, engine=None):
     if server_port is None:
         print('Please provide server Port')
         sys.exit()
 
-    src_port = 'tcp.srcport'
+    packets = pcap_reader.load_packets(pcapFile, engine=engine)
 
-    cmd = ['tshark', '-r', pcapFile, '-T', 'fields', '-E', 'separator=/t', '-e', src_port, '-e',
-           'tcp.analysis.out_of_order',
-           '-e', 'tcp.analysis.retransmission',
-           '-e', 'tcp.seq', '-e', 'frame.time_relative', '-e', 'tcp.ack']
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, err = p.communicate()
-
-    # All Packets arrived on the server
-    arr_all_pList = []
-    arr_all_timeList = []
-
-    # Packets arrived on the server in order
-    arr_in_pList = []
-    arr_in_timeList = []
-    # Packets arrived on the server, re transmission
-    arr_ret_pList = []
-    arr_ret_timeList = []
-    # Packets arrived on the server, out-of-order transmission
-    arr_out_pList = []
-    arr_out_timeList = []
-
-    # All Packets sent from the server
-    sent_all_pList = []
-    sent_all_timeList = []
-
-    # Packets sent *from* server, in order
-    sent_in_pList = []
-    sent_in_timeList = []
-    # Packets sent *from* server, re transmission
-    sent_ret_pList = []
-    sent_ret_timeList = []
-    # Packets sent *from* server, out-of-order transmission
-    sent_out_pList = []
-    sent_out_timeList = []
-
-    arr_a_count = 0
-    arr_i_count = 0
-    arr_r_count = 0
-    arr_o_count = 0
-
-    sent_a_count = 0
-    sent_i_count = 0
-    sent_r_count = 0
-    sent_o_count = 0
-
-    for sl in output.splitlines():
-        # print(type(sl))
-        # sl = str(sl)
-        sl = sl.decode("utf-8")
-        l = sl.split('\t')
-        src_port = l[0]
-        # Get the info of this packet
-        try:
-            # Out of order
-            out = l[1]
-            # Retransmission
-            ret = l[2]
-            # Sequence number
-            seq = l[3]
-            # time relative to the beginning of the connection
-            time = l[4]
-            # the ack number of this packet
-            ack = l[5]
-        except:
-            continue
-        # For packets arrived on the server, record their ack numbers
-        # For packets sent from the server, record their sequence numbers
-
-        # For packets sent from the server, put in the sent_* lists
-        if src_port == server_port:
-            sent_all_pList.append(seq)
-            sent_all_timeList.append(time)
-            sent_a_count += 1
-            if ret:
-                sent_ret_pList.append(seq)
-                sent_ret_timeList.append(time)
-                sent_r_count += 1
-            elif out:
-                sent_out_pList.append(seq)
-                sent_out_timeList.append(time)
-                sent_o_count += 1
-            else:
-                sent_in_pList.append(seq)
-                sent_in_timeList.append(time)
-                sent_i_count += 1
-        # For packets arrived on the server, put in the arr_* lists
-        else:
-            arr_all_pList.append(ack)
-            arr_all_timeList.append(time)
-            arr_a_count += 1
-            if ret:
-                arr_ret_pList.append(ack)
-                arr_ret_timeList.append(time)
-                arr_r_count += 1
-            elif out:
-                arr_out_pList.append(ack)
-                arr_out_timeList.append(time)
-                arr_o_count += 1
-            else:
-                arr_in_pList.append(ack)
-                arr_in_timeList.append(time)
-                arr_i_count += 1
+    # One row per packet: time relative to the beginning of the capture, sequence number,
+    # ack number, whether it was sent from the server, retransmission and out of order flags.
+    # For packets sent from the server we use their sequence numbers (table.sent_* masks),
+    # for packets arrived on the server their ack numbers (table.arr_* masks)
+    table = pcap_reader.PacketTable.from_packets(packets, int(server_port))
 
     start_timestamp = 0
-    start_seq = 0
-
-    arr_all_pList = [float(x) - start_seq for x in arr_all_pList]
-    arr_all_timeList = [float(x) - start_seq for x in arr_all_timeList]
-    sent_in_pList = [float(x) - start_seq for x in sent_in_pList]
-    sent_ret_pList = [float(x) - start_seq for x in sent_ret_pList]
-    sent_in_timeList = [float(x) - start_timestamp for x in sent_in_timeList]
-    sent_ret_timeList = [float(x) - start_timestamp for x in sent_ret_timeList]
 
-    return sent_in_pList, sent_in_timeList, sent_ret_pList, sent_ret_timeList, sent_all_pList, sent_all_timeList, arr_all_pList, arr_all_timeList, sent_i_count, sent_r_count, sent_a_count, start_timestamp
+    return table, start_timestamp
 
 
 def timestamp_after_start(timestamps, start_timestamp):
-    cnt = 0
-    for timestamp in timestamps:
-        if float(timestamp) > start_timestamp:
-            break
-        cnt += 1
-    return cnt
+    # timestamps are sorted, index of the first one after start_timestamp
+    return int(numpy.searchsorted(timestamps, start_timestamp, side='right'))
 
 
 # data directory should have subdirectories:
@@ -383,15 +220,13 @@ def timestamp_after_start(timestamps, start_timestamp):
 # 2. tcpdumpsResults
 def load_replay_files(data_directory, clientID, history_count, testID):
     clientXputs_dir = data_directory + "/clientXputs/"
-    tcpdumpsResults_dir = data_directory + "/tcpdumpsResults/"
-    regex_original_pcap = "*_{}_*_{}_{}*".format(clientID, history_count, testID)
 
-    original_pcap_file = glob.glob(tcpdumpsResults_dir + regex_original_pcap)
+    # the first *_clientID_*_historyCount_testID* pcap, from the manifest of the record directory
+    original_pcap_file = manifest.find_file(data_directory, "{}_{}".format(clientID, history_count),
+                                            "pcap_{}".format(testID))
 
     if not original_pcap_file:
         return None, [], []
-    else:
-        original_pcap_file = original_pcap_file[0]
 
     original_clientXputs_json = clientXputs_dir + "Xput_{}_{}_{}.json".format(clientID, history_count, testID)
 
@@ -410,23 +245,6 @@ def load_replay_files(data_directory, clientID, history_count, testID):
     return original_pcap_file, xputO, tsO
 
 
-def bytes_over_time_from_throughput(client_tputs, client_ts, start_timestamp=None):
-    received_bytes = []
-    received_ts = []
-
-    sampling_interval = client_ts[1] - client_ts[0]
-    current_bytes = 0
-
-    for i in range(len(client_tputs)):
-        if client_ts[i] < start_timestamp:
-            continue
-        current_bytes += client_tputs[i] * sampling_interval * 1E6 / 8
-        received_bytes.append(current_bytes)
-        received_ts.append(client_ts[i] - start_timestamp)
-
-    return received_ts, received_bytes
-
-
 # Load mobile Stats from mobileStat file (after separating the metadata connection)
 def loadMobileStatsFile(mobileStatsFile):
     try:
@@ -474,44 +292,6 @@ def get_r_squared_score(seqs, time_stamps, throttling_rate, plot_title='test'):
     plt.close()
 
 
-def loadMobileStats(mobileStats):
-    # use mobile stats to locate the geoInfo
-    try:
-        lat = mobileStats['locationInfo']['latitude']
-        lon = mobileStats['locationInfo']['longitude']
-        # later version of the replay server stores location info in replayInfo file
-        if 'country' in mobileStats['locationInfo'] and 'countryCode' in mobileStats['locationInfo'] and lat:
-            lat = float("{0:.1f}".format(float(lat)))
-            lon = float("{0:.1f}".format(float(lon)))
-            country = mobileStats['locationInfo']['country']
-            city = mobileStats['locationInfo']['city']
-            countryCode = mobileStats['locationInfo']['countryCode']
-        elif (lat == lon == '0.0') or (lat == lon == 0.0) or (lat == 'nil') or (lat == 'null'):
-            lat = lon = ''
-            country = ''
-            city = ''
-            countryCode = ''
-        elif lat:
-            coordinates = [(float(lat), float(lon))]
-            geoInfo = reverse_geocode.search(coordinates)[0]
-            country = geoInfo['country']
-            city = geoInfo['city']
-            countryCode = geoInfo['country_code'].lower()
-            lat = float("{0:.1f}".format(float(lat)))
-            lon = float("{0:.1f}".format(float(lon)))
-        else:
-            lat = lon = country = countryCode = city = ''
-
-    except Exception as e:
-        traceback.print_exc(file=sys.stdout)
-        country = ''
-        city = ''
-        countryCode = ''
-        lat = lon = ''
-
-    return lat, lon, country, countryCode, city
-
-
 def getCarrierNameByIP(clientIP):
     # get WiFi network carrierName
     try:
@@ -519,8 +299,7 @@ def getCarrierNameByIP(clientIP):
         if not org:
             carrierName = ' (WiFi)'
         else:
-            # Remove special characters in carrierName to merge test results together
-            carrierName = ''.join(e for e in org if e.isalnum()) + ' (WiFi)'
+            carrierName = carrier_name.wifiCarrierNameOfOrg(org)
     except Exception as e:
         carrierName = ' (WiFi)'
 
@@ -540,86 +319,35 @@ def timedRun(cmd, timeout_sec):
 
 
 def getRangeAndOrg(ip):
+    # answered from the ranges of earlier whois lookups when possible
+    cached = whois_cache.lookup(ip)
+    if cached is not None:
+        first, last, orgName = cached
+        if not orgName:
+            return None, None
+        return neta.IPRange(first, last), orgName
+
     out = timedRun(['whois', ip], 3)
-    try:
-        out = out.decode("utf-8")
-    except:
-        out = out
-
-    IPRange = None
-    orgName = None
-    netRange = None
-
-    # Get IP Range
-    if 'NetRange:' in out:
-        netRange = out.split('NetRange:')[1].split('\n')[0]
-        netRange = netRange.split()
-        IPRange = neta.IPRange(netRange[0], netRange[2])
-
-    # LACNIC/RIPE format
-    elif 'inetnum:' in out:
-        netRange = out.split('inetnum:')[1].split('\n')[0]
-        if '/' in netRange:
-            netRange = netRange.split()[0]
-            IPRange = neta.IPSet(neta.IPNetwork(netRange))
-        else:
-            netRange = netRange.split()
-            IPRange = neta.IPRange(netRange[0], netRange[2])
-
-    # Get Organization
-    if 'OrgName:' in out:
-        orgName = out.split('OrgName:')[1].split('\n')[0]
-    elif 'Organization:' in out:
-        orgName = out.split('Organization:')[1].split('\n')[0]
-    elif 'owner:' in out:
-        orgName = out.split('owner:')[1].split('\n')[0]
-    elif 'org-name:' in out:
-        orgName = out.split('org-name:')[1].split('\n')[0]
-    elif 'abuse-mailbox:' in out:
-        orgName = out.split('abuse-mailbox:')[1].split('@')[1].split('.')[0]
-    elif 'netname:' in out:
-        orgName = out.split('netname:')[1].split('\n')[0]
-
-    if orgName and netRange:
+    IPRange, orgName, first, last = whois_resolver.parse_whois(out)
+
+    whois_cache.add(ip, first, last, orgName)
+    if orgName:
         return IPRange, orgName
     else:
         return None, None
 
 
-# French server names are manually verified
-def getFrenchCarrierName(wifiCarrierName):
-    carrierName = wifiCarrierName
-    if 'proxad' in wifiCarrierName:
-        carrierName = 'Free (WiFi)'
-    elif 'SFR' in wifiCarrierName:
-        carrierName = 'SFR (WiFi)'
-    elif 'orange' in wifiCarrierName:
-        carrierName = 'Orange (WiFi)'
-    elif 'bouyguestelecom' in wifiCarrierName:
-        carrierName = 'BouyguesTelecom (WiFi)'
-    elif 'gaoland' in wifiCarrierName:
-        carrierName = 'Free (WiFi)'
-    elif 'ORANGEFRANCEHSIAB' in wifiCarrierName:
-        carrierName = 'Orange (WiFi)'
-    elif 'BouyguesTelecomSA' in wifiCarrierName:
-        carrierName = 'BouyguesTelecom (WiFi)'
-    elif 'OrangeSA' in wifiCarrierName:
-        carrierName = 'Orange (WiFi)'
-    elif 'FreeSAS' in wifiCarrierName:
-        carrierName = 'Free (WiFi)'
-    elif 'BOUYGTEL' in wifiCarrierName:
-        carrierName = 'BouyguesTelecom (WiFi)'
-
-    return carrierName
-
-
 def getCarrierName(mobileStats, clientIP):
     networkType = mobileStats['networkType']
-    lat, lon, country, countryCode, city = loadMobileStats(mobileStats)
+    lat, lon, country, countryCode, city = geo_cache.loadMobileStats(mobileStats)
 
     if "updatedCarrierName" in mobileStats:
         carrierName = mobileStats["updatedCarrierName"]
     elif networkType == 'WIFI':
+        # the offline registry index already has the French mapping and the merges below applied
+        indexedCarrierName = prefix_index.lookup(clientIP, country)
+        if indexedCarrierName:
+            return indexedCarrierName
         carrierName = getCarrierNameByIP(clientIP)
     elif "carrierName" in mobileStats:
         carrierName = ''.join(e for e in mobileStats['carrierName'] if e.isalnum())
@@ -627,34 +355,8 @@ def getCarrierName(mobileStats, clientIP):
     else:
         carrierName =  "unknown (cellular)"
 
-    # Special case for French ISPs, manually verified the transforming from whois results to provider names
-    if country == 'France' and networkType == 'WIFI':
-        carrierName = getFrenchCarrierName(carrierName)
-
-    # combine the tests with carrierName variance
-    if ' ' in carrierName:
-        networkPortion = carrierName.split(' ')[1]
-        # combine carriernames
-        if 'VZW' in carrierName:
-            carrierName = 'Verizon ' + networkPortion
-        elif 'VzW' in carrierName:
-            carrierName = 'Verizon ' + networkPortion
-        elif 'Verizon' in carrierName:
-            carrierName = 'Verizon ' + networkPortion
-        elif 'O2UK' in carrierName:
-            carrierName = 'O2 ' + networkPortion
-        elif 'ATT' in carrierName:
-            carrierName = 'ATT ' + networkPortion
-        elif 'TMobile' in carrierName:
-            carrierName = 'TMobile ' + networkPortion
-        elif 'IowaWireless' in carrierName:
-            carrierName = 'iWireless ' + networkPortion
-    elif networkType == 'WIFI':
-        carrierName = carrierName + ' (WiFi)'
-    else:
-        carrierName = carrierName + ' (cellular)'
-
-    return carrierName
+    # the same normalization the offline registry index applies (see carrier_name.py)
+    return carrier_name.normalizeCarrierName(carrierName, networkType, country)
 
 
 def updateReplayName(replayName):
@@ -891,26 +593,30 @@ def plot_test(replayInfo, mobileStats, client_dir, result_directory, classificat
     if not (original_pcap_file and inverted_pcap_file and client_ts_original and client_ts_inverted):
         return False
 
-    sent_in_pList_original, sent_in_timeList_original, sent_ret_pList_original, sent_ret_timeList_original, sent_all_pList_original, sent_all_timeList_original, ack_all_pList_original, ack_all_timeList_original, sent_i_count_original, sent_r_count_original, sent_a_count_original, start_timestamp = get_pcap_stat(
-        original_pcap_file, server_port=server_port)
+    table_original, start_timestamp = get_pcap_stat(original_pcap_file, server_port=server_port)
+    table_inverted, start_timestamp = get_pcap_stat(inverted_pcap_file, server_port=server_port)
 
-    sent_in_pList_inverted, sent_in_timeList_inverted, sent_ret_pList_inverted, sent_ret_timeList_inverted, sent_all_pList_inverted, sent_all_timeList_inverted, ack_all_pList_inverted, ack_all_timeList_inverted, sent_i_count_inverted, sent_r_count_inverted, sent_a_count_inverted, start_timestamp = get_pcap_stat(
-        inverted_pcap_file, server_port=server_port)
+    sent_in_original = table_original[table_original.sent_in]
+    sent_ret_original = table_original[table_original.sent_ret]
+    arr_all_original = table_original[table_original.arr_all]
+    sent_in_inverted = table_inverted[table_inverted.sent_in]
+    sent_ret_inverted = table_inverted[table_inverted.sent_ret]
+    arr_all_inverted = table_inverted[table_inverted.arr_all]
 
-    receive_timeList_original, receive_pList_original = bytes_over_time_from_throughput(client_tputs_original,
-                                                                                        client_ts_original,
-                                                                                        start_timestamp)
+    receive_timeList_original, receive_pList_original = throughput.bytes_over_time_from_throughput(client_tputs_original,
+                                                                                                   client_ts_original,
+                                                                                                   start_timestamp)
 
-    receive_timeList_inverted, receive_pList_inverted = bytes_over_time_from_throughput(client_tputs_inverted,
-                                                                                        client_ts_inverted,
-                                                                                        start_timestamp)
+    receive_timeList_inverted, receive_pList_inverted = throughput.bytes_over_time_from_throughput(client_tputs_inverted,
+                                                                                                   client_ts_inverted,
+                                                                                                   start_timestamp)
 
-    if not (sent_in_pList_original and sent_in_pList_inverted and receive_pList_original and ack_all_pList_original):
+    if not (len(sent_in_original) and len(sent_in_inverted) and receive_pList_original and len(arr_all_original)):
         return False
 
     client_sampling_interval = client_ts_original[1] - client_ts_original[0]
-    server_tputs_original, server_ts_original = doTputsInterval(sent_in_timeList_original, sent_in_pList_original,
-                                                                client_sampling_interval)
+    server_tputs_original, server_ts_original = throughput.doTputsInterval(sent_in_original.time, sent_in_original.seq,
+                                                                           client_sampling_interval)
 
     if (len(client_tputs_original) < 10) or (len(server_tputs_original) < 10):
         return False
@@ -920,18 +626,18 @@ def plot_test(replayInfo, mobileStats, client_dir, result_directory, classificat
     stdev_client_tputs_original = round(statistics.stdev(client_tputs_original), 5)
     stdev_server_tputs_original = round(statistics.stdev(server_tputs_original), 5)
 
-    loss_rate_original = round(sent_r_count_original / sent_a_count_original, 5)
-    loss_rate_inverted = round(sent_r_count_inverted / sent_a_count_inverted, 5)
+    loss_rate_original = round(int(table_original.sent_ret.sum()) / int(table_original.sent_all.sum()), 5)
+    loss_rate_inverted = round(int(table_inverted.sent_ret.sum()) / int(table_inverted.sent_all.sum()), 5)
 
     plot_title = "{}--{}--{}--{}--{}--{}--{}--{}--{}--classified-{}".format(userID, historyCount, replayName, avg_client_tputs_original,
                                                       avg_server_tputs_original, stdev_client_tputs_original,
                                                       stdev_server_tputs_original, loss_rate_original,
                                                       loss_rate_inverted, classification_label)
 
-    plot_seq_throughput_over_time(sent_in_timeList_original, sent_in_pList_original, sent_in_timeList_inverted, sent_in_pList_inverted,
+    plot_seq_throughput_over_time(sent_in_original.time, sent_in_original.seq, sent_in_inverted.time, sent_in_inverted.seq,
                        receive_timeList_original, receive_pList_original, receive_timeList_inverted, receive_pList_inverted,
-                       sent_ret_timeList_original, sent_ret_pList_original, sent_ret_timeList_inverted, sent_ret_pList_inverted,
-                       ack_all_pList_original, ack_all_timeList_original,ack_all_pList_inverted, ack_all_timeList_inverted,
+                       sent_ret_original.time, sent_ret_original.seq, sent_ret_inverted.time, sent_ret_inverted.seq,
+                       arr_all_original.ack, arr_all_original.time, arr_all_inverted.ack, arr_all_inverted.time,
                        server_tputs_original, server_ts_original, client_tputs_original, client_ts_original, result_carrier_directory, plot_title=plot_title)
 
     plot_throughput_distribution(client_tputs_original, server_tputs_original, result_carrier_directory,
@@ -980,24 +686,37 @@ def get_mobilestat(replayInfo, mobileStatsFile):
     return mobileStats
 
 
+def get_test_record(client_dir, replayInfo):
+    # (replayInfo, mobileStats) of a test, from the record store when it has it (see record_store.py)
+    meta_info = replayInfo.split('.')[0].split('_')
+    if len(meta_info) == 4 and meta_info[3] in ['0', '1']:
+        record = record_store.get_record(client_dir, replayInfo)
+        if record is not None:
+            replayInfo, mobileStats = record
+            if not replayInfo:
+                return None, None
+            return replayInfo, mobileStats
+
+    replayInfo, mobileStatsFile = get_test_metadata(client_dir, replayInfo)
+    if not replayInfo:
+        return None, None
+    return replayInfo, get_mobilestat(replayInfo, mobileStatsFile)
+
+
 def plot_tests_in_data_dir(data_directory, result_directory, num_plots):
     test_stat_per_carrier_replay = {}
 
+    record_manifest = manifest.get_manifest(data_directory)
     # for every client that has throttling tests
-    for client in os.listdir(data_directory):
+    for client in record_manifest.userIDs():
         client_dir = data_directory + '/' + client
-        replayinfo_dir = client_dir + '/replayInfo/'
-        if not os.path.isdir(replayinfo_dir):
-            continue
         # For every throttling test in data_directory
-        for replayInfo in os.listdir(replayinfo_dir):
-            replayInfo, mobileStatsFile = get_test_metadata(client_dir, replayInfo)
+        for replayInfo in record_manifest.replay_infos(client):
+            replayInfo, mobileStats = get_test_record(client_dir, replayInfo)
 
             if not replayInfo:
                 continue
 
-            mobileStats = get_mobilestat(replayInfo, mobileStatsFile)
-
             if not mobileStats:
                 continue
 
@@ -1026,11 +745,11 @@ def plot_tests_in_data_dir(data_directory, result_directory, num_plots):
 def plot_one_test(data_directory, plot_directory, plot_clientID, plot_historyCount, classification_label):
 
     client_dir = data_directory + '/' + plot_clientID
-    replayinfo_dir = client_dir + '/replayInfo/'
-    if not os.path.isdir(replayinfo_dir):
+    record_manifest = manifest.get_manifest(data_directory)
+    if plot_clientID not in record_manifest.users:
         return False
     # For every throttling test in data_directory
-    for replayInfo in os.listdir(replayinfo_dir):
+    for replayInfo in record_manifest.replay_infos(plot_clientID):
         replayInfo, mobileStatsFile = get_test_metadata(client_dir, replayInfo)
 
         if not replayInfo:
@@ -1086,6 +805,8 @@ def main():
                         historyCount = testID.split("_")[1]
                         plot_one_test(data_directory, plot_directory, clientID, historyCount, classification_label)
     else:
+        # the replayInfo and mobileStats of all the tests, packed into one database
+        record_store.ingest(data_directory)
         plot_tests_in_data_dir(data_directory, plot_directory, num_plots)
 
 
@@ -0,0 +1,285 @@
+'''
+Offline IP prefix -> WiFi carrierName index, built from bulk registry (RIR) dumps.
+
+Build it once from local dump files (plain or .gz), for example
+    ripe.db.inetnum.gz ripe.db.inet6num.gz ripe.db.organisation.gz (RIPE/APNIC/AFRINIC/LACNIC RPSL objects)
+    arin_db.txt (ARIN NetRange/OrgName records)
+with
+    python prefix_index.py [index_directory] [dump files...]
+
+Every inetnum/inet6num/NetRange block gives an address range and an organization, picked in the
+same order getRangeAndOrg picks it from a whois answer (OrgName, Organization, owner, org-name
+(also through an org: reference to an organisation object), abuse-mailbox domain, netname).
+The organization is normalized by carrier_name.py, the code getCarrierName uses for a WiFi test
+(alphanumeric characters + ' (WiFi)', the Verizon/ATT/TMobile/... merges), once as is
+and once with the getFrenchCarrierName mapping for clients in France.
+
+Nested ranges are flattened into sorted non-overlapping segments owned by the most specific
+range. The index directory holds
+    v4_start.npy                    uint32 segment starts
+    v4_carrier.npy                  int32 index into carriers.json, -1 for gaps
+    v6_start_hi.npy, v6_start_lo.npy uint64 halves of the segment starts
+    v6_carrier.npy
+    carriers.json                   [[carrierName, French carrierName], ...]
+the arrays are memory-mapped at lookup time, a lookup is one searchsorted.
+
+getCarrierName uses the index at PREFIX_INDEX_DIR (default ~/.cache/throttling_prefix_index)
+when it exists, and only falls back to whois for addresses not covered by it.
+'''
+
+import gzip
+import ipaddress
+import json
+import os
+import sys
+
+import numpy
+
+import carrier_name
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.expanduser("~"), ".cache", "throttling_prefix_index")
+
+RANGE_KEYS = ["inetnum", "inet6num", "NetRange", "CIDR"]
+
+
+def index_dir():
+    return os.environ.get("PREFIX_INDEX_DIR", DEFAULT_INDEX_DIR)
+
+
+def normalize_org(org):
+    # getCarrierNameByIP + getCarrierName: (carrierName, carrierName for a client in France)
+    carrierName = carrier_name.wifiCarrierNameOfOrg(org)
+    return (carrier_name.normalizeCarrierName(carrierName, 'WIFI', None),
+            carrier_name.normalizeCarrierName(carrierName, 'WIFI', 'France'))
+
+
+def open_dump(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="latin-1")
+    return open(path, "r", encoding="latin-1")
+
+
+def read_blocks(path):
+    # RPSL and ARIN text dumps: "key: value" lines, objects separated by blank lines
+    block = []
+    with open_dump(path) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip():
+                if block:
+                    yield block
+                block = []
+                continue
+            if line.startswith(('#', '%')):
+                continue
+            if line[0] in ' \t+' and block:
+                # continuation line
+                continue
+            key, sep, value = line.partition(':')
+            if sep:
+                block.append((key.strip(), value.strip()))
+    if block:
+        yield block
+
+
+def parse_range(value):
+    # (version, first, last) of "a - b", "a-b" or a CIDR, None if it can not be parsed
+    try:
+        if '-' in value:
+            first, last = [ipaddress.ip_address(x.strip()) for x in value.split('-', 1)]
+        else:
+            network = ipaddress.ip_network(value.split()[0].split(',')[0], strict=False)
+            first, last = network.network_address, network.broadcast_address
+    except ValueError:
+        return None
+    if first.version != last.version or int(last) < int(first):
+        return None
+    return first.version, int(first), int(last)
+
+
+def block_org(fields, organisations):
+    # the organization getRangeAndOrg would have picked from this block
+    for name in ['OrgName', 'Organization', 'owner', 'org-name']:
+        if name in fields:
+            return fields[name]
+    if 'org' in fields and fields['org'] in organisations:
+        return organisations[fields['org']]
+    if 'abuse-mailbox' in fields and '@' in fields['abuse-mailbox']:
+        return fields['abuse-mailbox'].split('@')[1].split('.')[0]
+    if 'netname' in fields:
+        return fields['netname']
+    if 'NetName' in fields:
+        return fields['NetName']
+    return None
+
+
+def read_ranges(dump_files):
+    # organisation objects first, inetnums refer to them with org:
+    organisations = {}
+    for path in dump_files:
+        for block in read_blocks(path):
+            if block[0][0] == 'organisation':
+                fields = dict(block)
+                if 'org-name' in fields:
+                    organisations[block[0][1]] = fields['org-name']
+
+    ranges = []
+    for path in dump_files:
+        for block in read_blocks(path):
+            fields = {}
+            for key, value in block:
+                # keep the first value of repeated keys, as whois output parsing does
+                fields.setdefault(key, value)
+            range_key = next((key for key in RANGE_KEYS if key in fields), None)
+            if range_key is None:
+                continue
+            parsed = parse_range(fields[range_key])
+            org = block_org(fields, organisations)
+            if parsed and org:
+                ranges.append(parsed + (org,))
+    return ranges
+
+
+def flatten(ranges):
+    # ranges (first, last, owner) -> segment starts and owners (-1 for gaps), the innermost range wins
+    ranges = sorted(ranges, key=lambda r: (r[0], -r[1]))
+    starts = []
+    owners = []
+    stack = []
+    pos = 0
+
+    def emit(start, owner):
+        # segments with the same owner next to each other are merged
+        if owners and owners[-1] == owner:
+            return
+        starts.append(start)
+        owners.append(owner)
+
+    def close_until(limit):
+        # close every open range that ends before limit
+        nonlocal pos
+        while stack and stack[-1][1] < limit:
+            first, last, owner = stack.pop()
+            if last >= pos:
+                emit(pos, owner)
+                pos = last + 1
+
+    for first, last, owner in ranges:
+        close_until(first)
+        if pos < first:
+            emit(pos, stack[-1][2] if stack else -1)
+        stack.append((first, last, owner))
+        pos = max(pos, first)
+
+    close_until(float("inf"))
+    emit(pos, -1)
+
+    return starts, owners
+
+
+def build(index_directory, dump_files):
+    ranges = read_ranges(dump_files)
+
+    carriers = []
+    carrier_ids = {}
+    per_version = {4: [], 6: []}
+    for version, first, last, org in ranges:
+        carrier = normalize_org(org)
+        if carrier not in carrier_ids:
+            carrier_ids[carrier] = len(carriers)
+            carriers.append(carrier)
+        per_version[version].append((first, last, carrier_ids[carrier]))
+
+    os.makedirs(index_directory, exist_ok=True)
+
+    starts, owners = flatten(per_version[4])
+    # the gap after a range ending at the last address starts past the address space
+    if starts and starts[-1] > (1 << 32) - 1:
+        starts.pop()
+        owners.pop()
+    numpy.save(os.path.join(index_directory, "v4_start.npy"), numpy.array(starts, dtype=numpy.uint32))
+    numpy.save(os.path.join(index_directory, "v4_carrier.npy"), numpy.array(owners, dtype=numpy.int32))
+
+    starts, owners = flatten(per_version[6])
+    if starts and starts[-1] > (1 << 128) - 1:
+        starts.pop()
+        owners.pop()
+    numpy.save(os.path.join(index_directory, "v6_start_hi.npy"), numpy.array([s >> 64 for s in starts], dtype=numpy.uint64))
+    numpy.save(os.path.join(index_directory, "v6_start_lo.npy"),
+               numpy.array([s & ((1 << 64) - 1) for s in starts], dtype=numpy.uint64))
+    numpy.save(os.path.join(index_directory, "v6_carrier.npy"), numpy.array(owners, dtype=numpy.int32))
+
+    json.dump(carriers, open(os.path.join(index_directory, "carriers.json"), "w"))
+
+    return len(ranges), len(carriers)
+
+
+class PrefixIndex(object):
+    '''
+    Memory-mapped view of an index directory written by build().
+    '''
+    def __init__(self, index_directory):
+        def load(name):
+            return numpy.load(os.path.join(index_directory, name), mmap_mode='r')
+        self.v4_start = load("v4_start.npy")
+        self.v4_carrier = load("v4_carrier.npy")
+        self.v6_start_hi = load("v6_start_hi.npy")
+        self.v6_start_lo = load("v6_start_lo.npy")
+        self.v6_carrier = load("v6_carrier.npy")
+        self.carriers = json.load(open(os.path.join(index_directory, "carriers.json"), "r"))
+
+    def carrier_id(self, ip):
+        try:
+            address = ipaddress.ip_address(ip.strip())
+        except ValueError:
+            return -1
+        value = int(address)
+        if address.version == 4:
+            i = int(numpy.searchsorted(self.v4_start, numpy.uint32(value), side='right')) - 1
+            return int(self.v4_carrier[i]) if i >= 0 else -1
+        hi = numpy.uint64(value >> 64)
+        lo = numpy.uint64(value & ((1 << 64) - 1))
+        # last segment with (start_hi, start_lo) <= (hi, lo)
+        i = int(numpy.searchsorted(self.v6_start_hi, hi, side='left'))
+        j = int(numpy.searchsorted(self.v6_start_hi, hi, side='right'))
+        i += int(numpy.searchsorted(self.v6_start_lo[i:j], lo, side='right')) - 1
+        return int(self.v6_carrier[i]) if i >= 0 else -1
+
+    def lookup(self, ip, country=None):
+        # carrierName of a WiFi test from ip, None if no registry range covers it
+        carrier = self.carrier_id(ip)
+        if carrier < 0:
+            return None
+        return self.carriers[carrier][1 if country == 'France' else 0]
+
+
+# the index of this process, opened on first use (False when there is none)
+_index = None
+
+
+def lookup(ip, country=None):
+    global _index
+    if _index is None:
+        directory = index_dir()
+        _index = PrefixIndex(directory) if directory and os.path.exists(os.path.join(directory, "carriers.json")) else False
+    if not _index:
+        return None
+    return _index.lookup(ip, country)
+
+
+def main():
+    try:
+        index_directory = sys.argv[1]
+        dump_files = sys.argv[2:]
+        if not dump_files:
+            raise ValueError
+    except:
+        print('\r\n Please provide the following inputs: [index_directory] [dump files...]')
+        sys.exit()
+
+    num_ranges, num_carriers = build(index_directory, dump_files)
+    print("{} ranges, {} carrierNames written to {}".format(num_ranges, num_carriers, index_directory))
+
+
+if __name__ == "__main__":
+    main()
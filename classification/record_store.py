@@ -0,0 +1,250 @@
+'''
+SQLite store of the replayInfo and (decoded) mobileStats of every test of a Wehe record directory.
+
+The metadata of a test is spread over small json files, replayInfo/replayInfo_*.json and
+mobileStats/mobileStats_*.json (a json string of json, decoded twice), opened and parsed again by
+every script for every test. ingest() reads them once into one database, a table row per
+replayInfo file with
+    userDir, replayInfoFile                      the key (user directory, file name)
+    uniqueTestID, historyCount, testID           from the file name, as get_test_metadata reads it
+    userID, clientIP, replayName, localTime, networkType, carrierName, updatedCarrierName,
+    lat, lon                                     typed columns of the fields the scripts use
+    replayInfo, mobileStats                      the replayInfo list and the decoded mobileStats (json)
+so the metadata pass of a script is one open of the database instead of thousands of files.
+ingest() is incremental: only files whose size or mtime changed since the last ingestion are read again.
+
+get_record() returns what get_test_metadata + get_mobilestat return for a test, None when the store
+can not answer it (not ingested, or a file that does not decode) and the scripts read the files as before.
+
+The database is kept in RECORD_STORE_DIR (default ~/.cache/throttling_record_stores), one per
+record directory, empty to disable the store. Run this file to ingest a record directory:
+    python record_store.py [wehe_record_dir]
+'''
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+
+import manifest
+
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "throttling_record_stores")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tests (
+    userDir TEXT NOT NULL,
+    replayInfoFile TEXT NOT NULL,
+    uniqueTestID TEXT NOT NULL,
+    historyCount TEXT NOT NULL,
+    testID TEXT NOT NULL,
+    userID TEXT,
+    clientIP TEXT,
+    replayName TEXT,
+    localTime TEXT,
+    networkType TEXT,
+    carrierName TEXT,
+    updatedCarrierName TEXT,
+    lat REAL,
+    lon REAL,
+    replayInfo TEXT,
+    mobileStats TEXT,
+    signature TEXT NOT NULL,
+    PRIMARY KEY (userDir, replayInfoFile)
+);
+CREATE INDEX IF NOT EXISTS tests_unique_test_id ON tests (uniqueTestID, testID);
+"""
+
+COLUMNS = ["userDir", "replayInfoFile", "uniqueTestID", "historyCount", "testID", "userID", "clientIP", "replayName",
+           "localTime", "networkType", "carrierName", "updatedCarrierName", "lat", "lon", "replayInfo", "mobileStats",
+           "signature"]
+
+
+def store_dir():
+    return os.environ.get("RECORD_STORE_DIR", DEFAULT_STORE_DIR)
+
+
+def store_path(wehe_record_dir):
+    directory = store_dir()
+    if not directory:
+        return None
+    key = hashlib.sha1(os.path.abspath(wehe_record_dir).encode("utf-8")).hexdigest()
+    return os.path.join(directory, key + ".sqlite")
+
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def load_mobile_stats_file(mobileStatsFile):
+    # loadMobileStatsFile without the traceback, False when there is no usable file
+    if not os.path.exists(mobileStatsFile):
+        return False
+    return json.loads(json.load(open(mobileStatsFile, 'r')))
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_record(wehe_record_dir, userDir, replayInfoFile, mobileStatsFile):
+    # the row of one replayInfo file, None if it does not decode (the scripts then read it themselves)
+    meta_info = replayInfoFile.split('.')[0].split('_')
+    replayInfoPath = wehe_record_dir + "/" + userDir + "/replayInfo/" + replayInfoFile
+    signature = json.dumps([file_signature(replayInfoPath), file_signature(mobileStatsFile)])
+
+    try:
+        replayInfo = json.load(open(replayInfoPath, 'r'))
+        if not replayInfo:
+            mobileStats = False
+        elif not replayInfo[14]:
+            mobileStats = load_mobile_stats_file(mobileStatsFile)
+        else:
+            mobileStats = json.loads(replayInfo[14])
+    except Exception:
+        return None
+
+    row = dict.fromkeys(COLUMNS)
+    row.update({"userDir": userDir, "replayInfoFile": replayInfoFile,
+                "uniqueTestID": "{}_{}".format(meta_info[1], meta_info[2]), "historyCount": meta_info[2],
+                "testID": meta_info[3], "replayInfo": json.dumps(replayInfo), "mobileStats": json.dumps(mobileStats),
+                "signature": signature})
+    if replayInfo:
+        row.update({"userID": replayInfo[1], "clientIP": replayInfo[2], "replayName": replayInfo[4]})
+    if mobileStats:
+        try:
+            locationInfo = mobileStats.get('locationInfo', {})
+            row.update({"localTime": locationInfo.get('localTime', replayInfo[0]),
+                        "networkType": mobileStats.get('networkType'),
+                        "carrierName": mobileStats.get('carrierName'),
+                        "updatedCarrierName": mobileStats.get('updatedCarrierName'),
+                        "lat": to_float(locationInfo.get('latitude')), "lon": to_float(locationInfo.get('longitude'))})
+        except AttributeError:
+            pass
+    return row
+
+
+def connect(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def ingest(wehe_record_dir, path=None):
+    # bring the store of wehe_record_dir up to date, returns (number of tests, number read again)
+    if path is None:
+        path = store_path(wehe_record_dir)
+    if not path:
+        return 0, 0
+    record_manifest = manifest.get_manifest(wehe_record_dir)
+    connection = connect(path)
+
+    known = {(userDir, replayInfoFile): signature for userDir, replayInfoFile, signature in
+             connection.execute("SELECT userDir, replayInfoFile, signature FROM tests")}
+
+    rows = []
+    current = set()
+    for userDir in record_manifest.userIDs():
+        for replayInfoFile in record_manifest.replay_infos(userDir):
+            meta_info = replayInfoFile.split('.')[0].split('_')
+            # the file get_test_metadata + loadMobileStatsFile read
+            mobileStatsFile = "{}/{}/mobileStats/mobileStats_{}_{}_{}.json".format(
+                wehe_record_dir, userDir, meta_info[1], meta_info[2], meta_info[3])
+            current.add((userDir, replayInfoFile))
+            signature = json.dumps([file_signature(wehe_record_dir + "/" + userDir + "/replayInfo/" + replayInfoFile),
+                                    file_signature(mobileStatsFile)])
+            if known.get((userDir, replayInfoFile)) == signature:
+                continue
+            row = read_record(wehe_record_dir, userDir, replayInfoFile, mobileStatsFile)
+            if row is None:
+                # left to the scripts, they report it
+                connection.execute("DELETE FROM tests WHERE userDir = ? AND replayInfoFile = ?",
+                                   (userDir, replayInfoFile))
+                continue
+            rows.append([row[column] for column in COLUMNS])
+
+    with connection:
+        connection.executemany("INSERT OR REPLACE INTO tests ({}) VALUES ({})".format(
+            ", ".join(COLUMNS), ", ".join("?" * len(COLUMNS))), rows)
+        connection.executemany("DELETE FROM tests WHERE userDir = ? AND replayInfoFile = ?",
+                               [key for key in known if key not in current])
+    connection.close()
+
+    return len(current), len(rows)
+
+
+class RecordStore(object):
+    '''
+    Read-only view of an ingested store.
+    '''
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.records = None
+
+    def load(self):
+        # every test of the store in memory, one query for the whole metadata pass
+        self.records = {}
+        for userDir, replayInfoFile, replayInfo, mobileStats in self.connection.execute(
+                "SELECT userDir, replayInfoFile, replayInfo, mobileStats FROM tests"):
+            self.records[(userDir, replayInfoFile)] = (replayInfo, mobileStats)
+
+    def get(self, userDir, replayInfoFile):
+        if self.records is None:
+            self.load()
+        record = self.records.get((userDir, replayInfoFile))
+        if record is None:
+            return None
+        return json.loads(record[0]), json.loads(record[1])
+
+
+# the stores of this process (sqlite connections are not shared with forked workers), opened on first use
+_stores = {}
+
+
+def get_store(wehe_record_dir):
+    path = store_path(wehe_record_dir)
+    key = (os.path.abspath(wehe_record_dir), os.getpid())
+    if key not in _stores:
+        _stores[key] = RecordStore(path) if path and os.path.exists(path) else None
+    return _stores[key]
+
+
+def get_record(client_dir, replayInfoFile):
+    # (replayInfo, mobileStats) of a test as get_test_metadata + get_mobilestat give them, None if not stored
+    wehe_record_dir, userDir = os.path.split(os.path.normpath(client_dir))
+    store = get_store(wehe_record_dir)
+    if store is None:
+        return None
+    return store.get(userDir, replayInfoFile)
+
+
+def get_test_record(wehe_record_dir, uniqueTestID, testID):
+    # the same for wehe_record_dir/userID/replayInfo/replayInfo_userID_historyCount_testID.json
+    userID, historyCount = uniqueTestID.split("_")[:2]
+    store = get_store(wehe_record_dir)
+    if store is None:
+        return None
+    return store.get(userID, "replayInfo_{}_{}_{}.json".format(userID, historyCount, testID))
+
+
+def main():
+    try:
+        wehe_record_dir = sys.argv[1]
+    except:
+        print('\r\n Please provide the following inputs: [wehe_record_dir]')
+        sys.exit()
+
+    num_tests, num_read = ingest(wehe_record_dir)
+    print("{} tests in {}, {} read from the record directory".format(num_tests, store_path(wehe_record_dir), num_read))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+'''
+In-process replacement for tshark's tcp.analysis.retransmission and tcp.analysis.out_of_order flags.
+
+analyze_sequence_numbers(packets) takes the columns returned by pcap_reader and
+flags every TCP segment following the rules of tshark's tcp_analyze_sequence_number():
+
+    a segment with data (or SYN/FIN) that does not advance the highest sequence number
+    seen in its direction (nextseq) is
+        a keep-alive            if it has 0/1 byte and starts at nextseq - 1   -> no flag
+        a fast retransmission   if the other side sent >= 2 dup acks for seq
+                                in the last 20ms                              -> retransmission
+        out of order            if it came within one handshake RTT (3ms when unknown)
+                                of the segment that set nextseq               -> out_of_order
+        a spurious retransmission if the data was already acked               -> no flag
+        a retransmission        otherwise                                     -> retransmission
+
+All the per-connection state tshark keeps (nextseq and its time, the last ack/window,
+the dup ack counter of the other direction) is rebuilt with running maxima and
+searchsorted over NumPy arrays, packets are sorted by (stream, direction) once.
+
+Run this file to compare it with tshark on a set of captures:
+    python tcp_analysis.py [pcap_dir_or_file] <server_port>
+'''
+
+import os
+import sys
+import json
+
+import numpy
+
+import pcap_reader
+
+# tshark's thresholds
+FAST_RETRANSMISSION_WINDOW = 0.02
+DEFAULT_OUT_OF_ORDER_THRESHOLD = 0.003
+
+
+def unwrap_seq(values, group_start, group_first):
+    # undo 32-bit wrap-arounds within every group (values are in group order)
+    diffs = numpy.diff(values, prepend=values[:1])
+    diffs = ((diffs + (1 << 31)) % (1 << 32)) - (1 << 31)
+    diffs[group_start] = 0
+    steps = numpy.cumsum(diffs)
+    return values[group_first] + steps - steps[group_first]
+
+
+def running_max(values, group_rank):
+    # inclusive running maximum that restarts at every group (values are in group order)
+    if not len(values):
+        return values
+    low = values.min()
+    span = int(values.max() - low) + 1
+    if span * (int(group_rank[-1]) + 1) < (1 << 62):
+        shifted = (values - low) + group_rank * span
+        return numpy.maximum.accumulate(shifted) - group_rank * span + low
+    # too many groups to pack into an int64, do one group at a time
+    result = numpy.empty_like(values)
+    bounds = numpy.flatnonzero(numpy.diff(group_rank, prepend=-1, append=-1))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        result[start:end] = numpy.maximum.accumulate(values[start:end])
+    return result
+
+
+def shift_in_group(values, group_start, fill):
+    # value of the previous packet of the same group, fill for the first one
+    previous = numpy.roll(values, 1)
+    previous[group_start] = fill
+    return previous
+
+
+def first_rtt_per_stream(packets, num_streams):
+    # tshark uses the time between the (most recent) SYN and the first ACK that follows it
+    # as the out of order threshold of the connection
+    stream = packets["stream"]
+    flags = packets["tcp_flags"].astype(numpy.int64)
+    time = packets["time"]
+    index = numpy.arange(len(stream))
+    is_tcp = stream >= 0
+
+    syn = is_tcp & ((flags & pcap_reader.TH_SYN) != 0) & ((flags & pcap_reader.TH_ACK) == 0)
+    pure_ack = is_tcp & ((flags & pcap_reader.TH_ACK) != 0) & ((flags & pcap_reader.TH_SYN) == 0)
+
+    first_syn = pcap_reader.first_index_per_group(numpy.where(is_tcp, stream, 0), syn)
+    first_syn = numpy.pad(first_syn, (0, num_streams - len(first_syn)), constant_values=-1)
+    after_syn = pure_ack & (first_syn[numpy.maximum(stream, 0)] >= 0) & (index > first_syn[numpy.maximum(stream, 0)])
+    handshake_ack = pcap_reader.first_index_per_group(numpy.where(is_tcp, stream, 0), after_syn)
+    handshake_ack = numpy.pad(handshake_ack, (0, num_streams - len(handshake_ack)), constant_values=-1)
+
+    # most recent SYN before the handshake ACK (SYNs can be retransmitted)
+    syn_index = numpy.flatnonzero(syn)
+    order = numpy.lexsort((syn_index, stream[syn_index]))
+    syn_index = syn_index[order]
+    syn_key = stream[syn_index].astype(numpy.int64) * (len(stream) + 1) + syn_index
+    query = numpy.arange(num_streams, dtype=numpy.int64) * (len(stream) + 1) + handshake_ack
+    at = numpy.searchsorted(syn_key, query) - 1
+    valid = (handshake_ack >= 0) & (at >= 0)
+    at = numpy.maximum(at, 0)
+    valid &= (stream[syn_index[at]] == numpy.arange(num_streams)) if len(syn_index) else False
+
+    rtt = numpy.zeros(num_streams)
+    if len(syn_index):
+        rtt = numpy.where(valid, time[numpy.maximum(handshake_ack, 0)] - time[syn_index[at]], 0)
+
+    return numpy.where(rtt > 0, rtt, DEFAULT_OUT_OF_ORDER_THRESHOLD)
+
+
+def analyze_sequence_numbers(packets):
+    n = len(packets["time"])
+    retransmission = numpy.zeros(n, dtype=numpy.uint8)
+    out_of_order = numpy.zeros(n, dtype=numpy.uint8)
+
+    tcp_index = numpy.flatnonzero(packets["stream"] >= 0)
+    if not len(tcp_index):
+        return {"retransmission": retransmission, "out_of_order": out_of_order}
+
+    num_streams = int(packets["stream"].max()) + 1
+    ooo_threshold = first_rtt_per_stream(packets, num_streams)
+
+    # put the TCP packets in (stream, direction) order, capture order within a group
+    group_all = packets["stream"][tcp_index].astype(numpy.int64) * 2 + packets["direction"][tcp_index]
+    order = numpy.argsort(group_all, kind='stable')
+    index = tcp_index[order]
+    group = group_all[order]
+    m = len(index)
+    position = numpy.arange(m)
+
+    group_start = numpy.ones(m, dtype=bool)
+    group_start[1:] = group[1:] != group[:-1]
+    group_rank = numpy.cumsum(group_start) - 1
+    group_first = numpy.maximum.accumulate(numpy.where(group_start, position, 0))
+
+    time = packets["time"][index]
+    flags = packets["tcp_flags"][index].astype(numpy.int64)
+    window = packets["tcp_window"][index].astype(numpy.int64)
+    seglen = packets["tcp_len"][index].astype(numpy.int64)
+    has_ack = (flags & pcap_reader.TH_ACK) != 0
+    syn_fin = (flags & (pcap_reader.TH_SYN | pcap_reader.TH_FIN)) != 0
+    syn_fin_rst = (flags & (pcap_reader.TH_SYN | pcap_reader.TH_FIN | pcap_reader.TH_RST)) != 0
+
+    seq = unwrap_seq(packets["seq"][index].astype(numpy.int64), group_start, group_first)
+    # carry the last ack over packets without the ACK flag before unwrapping
+    ack = packets["ack"][index].astype(numpy.int64)
+    last_ack_at = numpy.maximum.accumulate(numpy.where(has_ack | group_start, position, 0))
+    ack = unwrap_seq(ack[last_ack_at], group_start, group_first)
+
+    # nextseq: highest seq + len (+1 for SYN/FIN) sent before this packet, and when it was set
+    segment_end = seq + seglen + syn_fin
+    highest_end = running_max(segment_end, group_rank)
+    nextseq = shift_in_group(highest_end, group_start, 0)
+    has_nextseq = ~group_start
+    raised = group_start | (segment_end > nextseq)
+    last_raise = numpy.maximum.accumulate(numpy.where(raised, position, 0))
+    nextseq_time = shift_in_group(time[last_raise], group_start, 0)
+
+    # duplicate acks: no data, same window/ack as the previous packet, seq == nextseq
+    previous_ack = shift_in_group(ack, group_start, 0)
+    previous_has_ack = shift_in_group(has_ack, group_start, False)
+    previous_window = shift_in_group(window, group_start, 0)
+    dup_ack = (has_nextseq & (seglen == 0) & (window != 0) & (window == previous_window) & (seq == nextseq) &
+               previous_has_ack & (ack == previous_ack) & ~syn_fin_rst)
+    # length of the run of dup acks ending at every packet
+    run_start = numpy.maximum.accumulate(numpy.where(~dup_ack, position, 0))
+    dup_ack_count = position - run_start
+
+    # state of the other direction as of the packet right before this one in the capture
+    sort_key = group * (n + 1) + index
+    reverse_key = (group ^ 1) * (n + 1) + index
+    reverse_at = numpy.searchsorted(sort_key, reverse_key) - 1
+    has_reverse = reverse_at >= 0
+    reverse_at = numpy.maximum(reverse_at, 0)
+    has_reverse &= group[reverse_at] == (group ^ 1)
+    reverse_has_ack = has_reverse & has_ack[reverse_at]
+    reverse_last_ack = ack[reverse_at]
+    reverse_last_ack_time = time[reverse_at]
+    reverse_dup_acks = numpy.where(has_reverse, dup_ack_count[reverse_at], 0)
+
+    # acks of the other direction are relative to our base too, but may have been unwrapped
+    # from a different starting point, bring them within 2^31 of our sequence numbers
+    reverse_last_ack = seq + (((reverse_last_ack - seq + (1 << 31)) % (1 << 32)) - (1 << 31))
+
+    carries_data = (seglen > 0) | syn_fin
+    keep_alive = has_nextseq & ((seglen == 0) | (seglen == 1)) & (seq == nextseq - 1) & ~syn_fin_rst
+    candidate = carries_data & ~keep_alive
+    seq_not_advanced = has_nextseq & (seq < nextseq)
+
+    fast = (candidate & seq_not_advanced & (reverse_dup_acks >= 2) & reverse_has_ack & (reverse_last_ack == seq) &
+            (time - reverse_last_ack_time < FAST_RETRANSMISSION_WINDOW))
+    stream_threshold = ooo_threshold[packets["stream"][index]]
+    ooo = (candidate & ~fast & seq_not_advanced & (time - nextseq_time < stream_threshold) &
+           (nextseq != seq + seglen))
+    spurious = (candidate & ~fast & ~ooo & (seglen > 0) & reverse_has_ack & (reverse_last_ack != 0) &
+                (seq + seglen <= reverse_last_ack))
+    # tshark marks fast retransmissions with the retransmission flag too
+    retrans = fast | (candidate & ~ooo & ~spurious & seq_not_advanced)
+
+    retransmission[index] = retrans
+    out_of_order[index] = ooo
+
+    return {"retransmission": retransmission, "out_of_order": out_of_order}
+
+
+def guess_server_port(packets):
+    # the port that sent the most TCP payload
+    tcp = packets["src_port"] >= 0
+    if not tcp.any():
+        return None
+    ports, inverse = numpy.unique(packets["src_port"][tcp], return_inverse=True)
+    sent = numpy.bincount(inverse, weights=packets["tcp_len"][tcp])
+    return int(ports[numpy.argmax(sent)])
+
+
+def loss_rate(packets, server_port):
+    # the same loss rate get_pcap_stat computes: retransmitted / all packets sent from the server
+    sent = packets["src_port"] == server_port
+    if not sent.any():
+        return 0
+    return round(int(packets["retransmission"][sent].sum()) / int(sent.sum()), 5)
+
+
+def compare_with_tshark(pcapFile, server_port=None):
+    native = pcap_reader.load_packets(pcapFile, engine="native")
+    tshark = pcap_reader.load_packets(pcapFile, engine="tshark")
+
+    if len(native["time"]) != len(tshark["time"]):
+        return {"pcap": pcapFile, "error": "packet count differs: native {}, tshark {}".format(
+            len(native["time"]), len(tshark["time"]))}
+
+    if server_port is None:
+        server_port = guess_server_port(tshark)
+
+    report = {"pcap": pcapFile, "packets": len(native["time"]), "server_port": server_port}
+    for flag in ["retransmission", "out_of_order"]:
+        n_flag = native[flag] != 0
+        t_flag = tshark[flag] != 0
+        report[flag] = {
+            "both": int((n_flag & t_flag).sum()),
+            "native_only": int((n_flag & ~t_flag).sum()),
+            "tshark_only": int((~n_flag & t_flag).sum()),
+            "agreement": round(float((n_flag == t_flag).mean()) if len(n_flag) else 1.0, 6),
+        }
+    report["loss_rate_native"] = loss_rate(native, server_port)
+    report["loss_rate_tshark"] = loss_rate(tshark, server_port)
+
+    return report
+
+
+def agreement_report(pcap_files, server_port=None):
+    reports = []
+    for pcapFile in pcap_files:
+        try:
+            reports.append(compare_with_tshark(pcapFile, server_port))
+        except Exception as e:
+            reports.append({"pcap": pcapFile, "error": str(e)})
+
+    compared = [r for r in reports if "error" not in r]
+    print("{:60} {:>9} {:>18} {:>18} {:>10} {:>10}".format("pcap", "packets", "retrans n/t/both",
+                                                             "ooo n/t/both", "loss nat", "loss tsh"))
+    for r in reports:
+        name = os.path.basename(r["pcap"])[-60:]
+        if "error" in r:
+            print("{:60} {}".format(name, r["error"]))
+            continue
+        print("{:60} {:>9} {:>18} {:>18} {:>10} {:>10}".format(
+            name, r["packets"],
+            "{}/{}/{}".format(r["retransmission"]["native_only"], r["retransmission"]["tshark_only"], r["retransmission"]["both"]),
+            "{}/{}/{}".format(r["out_of_order"]["native_only"], r["out_of_order"]["tshark_only"], r["out_of_order"]["both"]),
+            r["loss_rate_native"], r["loss_rate_tshark"]))
+
+    if compared:
+        exact_retrans = sum(1 for r in compared if not (r["retransmission"]["native_only"] or r["retransmission"]["tshark_only"]))
+        exact_loss = sum(1 for r in compared if r["loss_rate_native"] == r["loss_rate_tshark"])
+        max_loss_diff = max(abs(r["loss_rate_native"] - r["loss_rate_tshark"]) for r in compared)
+        print("pcaps compared: {}, identical retransmission flags: {}, identical loss rate: {}, max loss rate difference: {}".format(
+            len(compared), exact_retrans, exact_loss, max_loss_diff))
+
+    return reports
+
+
+def main():
+    try:
+        pcap_path = sys.argv[1]
+    except:
+        print('\r\n Please provide the following inputs: [pcap_dir_or_file] <server_port>')
+        sys.exit()
+
+    server_port = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    if os.path.isdir(pcap_path):
+        pcap_files = [os.path.join(pcap_path, f) for f in sorted(os.listdir(pcap_path))
+                      if ".pcap" in f or f.endswith(".pcapng")]
+    else:
+        pcap_files = [pcap_path]
+
+    reports = agreement_report(pcap_files, server_port)
+    json.dump(reports, open("tcp_analysis_agreement.json", "w"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+'''
+CompiledSVC.predict_proba against the sklearn SVC it was exported from.
+
+    python -m pytest -q test_compiled_model.py
+'''
+
+import numpy as np
+import pytest
+from sklearn.datasets import make_blobs
+from sklearn.svm import SVC
+
+import compiled_model
+
+
+@pytest.mark.parametrize("n_classes", [2, 3, 4])
+def test_predict_proba_matches_sklearn(tmp_path, n_classes):
+    # 4 features, like the ones test_stat_store.stat_features gives the classifier
+    X, y = make_blobs(n_samples=60 * n_classes, centers=n_classes, n_features=4, cluster_std=3.0, random_state=n_classes)
+    y = y + 1
+    model = SVC(probability=True, gamma="auto", random_state=0).fit(X, y)
+
+    path = str(tmp_path / "trained_model.npz")
+    compiled_model.export(model, path)
+    compiled = compiled_model.CompiledSVC(path)
+
+    X_test = np.random.RandomState(0).uniform(X.min(axis=0), X.max(axis=0), size=(200, X.shape[1]))
+    np.testing.assert_array_equal(compiled.classes_, model.classes_)
+    np.testing.assert_allclose(compiled.predict_proba(X_test), model.predict_proba(X_test), rtol=0, atol=1e-9)
+    # predict is the most probable class (sklearn's predict votes, it can disagree near the boundaries)
+    np.testing.assert_array_equal(compiled.predict(X_test), model.classes_[model.predict_proba(X_test).argmax(axis=1)])
@@ -0,0 +1,194 @@
+'''
+Columnar store of test_stat_per_carrier_replay, partitioned by ISP_replay.
+
+test_stat_per_carrier_replay.json is one nested dict
+    test_stat_per_carrier_replay[ISP_replay][uniqueTestID] = [avg_client, avg_server, std_client, std_server,
+                                                             loss_original, loss_inverted, ymd, hour, (lat, lon)]
+that every consumer loads whole. The store is a directory with one .npz file per ISP_replay,
+one row per test and one array per column:
+    uniqueTestID, avg_client, avg_server, std_client, std_server, loss_original, loss_inverted,
+    ymd, hour, lat, lon                (lat/lon NaN when the test has no location)
+and index.json with the ISP_replays (in their original order), their ISP, replay name, file and number of rows.
+A consumer opens only the partitions it needs, and an .npz only reads the columns that are accessed.
+
+load() opens either form: a store directory gives a TestStatStore, which can be used like the
+nested dict (keys, in, [ISP_replay]), a json file gives the dict. Run this file to convert a json file:
+    python test_stat_store.py [test_stat_per_carrier_replay.json] [store_directory]
+'''
+
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+
+import numpy
+
+STAT_COLUMNS = ["avg_client", "avg_server", "std_client", "std_server", "loss_original", "loss_inverted"]
+COLUMNS = ["uniqueTestID"] + STAT_COLUMNS + ["ymd", "hour", "lat", "lon"]
+
+INDEX_FILE = "index.json"
+
+
+def partition_file(ISP_replay):
+    # readable and unique file name of a partition
+    safe = re.sub(r'[^A-Za-z0-9.-]+', '_', ISP_replay).strip('_')
+    return "{}_{}.npz".format(safe, hashlib.sha1(ISP_replay.encode("utf-8")).hexdigest()[:8])
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return numpy.nan
+
+
+def to_columns(tests):
+    # {uniqueTestID: test_stat} -> {column: array}
+    columns = {column: [] for column in COLUMNS}
+    for uniqueTestID, test_stat in tests.items():
+        columns["uniqueTestID"].append(uniqueTestID)
+        for i, column in enumerate(STAT_COLUMNS):
+            columns[column].append(float(test_stat[i]))
+        meta = list(test_stat[6:9]) + [""] * (9 - len(test_stat))
+        columns["ymd"].append(str(meta[0]))
+        columns["hour"].append(str(meta[1]))
+        location = meta[2] if meta[2] else ["", ""]
+        columns["lat"].append(to_float(location[0]))
+        columns["lon"].append(to_float(location[1]))
+
+    arrays = {}
+    for column in COLUMNS:
+        if column in ["uniqueTestID", "ymd", "hour"]:
+            # at least one character wide, numpy.array([]) of str is float
+            arrays[column] = numpy.array(columns[column], dtype=str) if columns[column] else numpy.zeros(0, dtype="U1")
+        else:
+            arrays[column] = numpy.array(columns[column], dtype=numpy.float64)
+    return arrays
+
+
+def write(store_directory, test_stat_per_carrier_replay):
+    os.makedirs(store_directory, exist_ok=True)
+
+    partitions = []
+    for ISP_replay, tests in test_stat_per_carrier_replay.items():
+        file_name = partition_file(ISP_replay)
+        fd, tmp_path = tempfile.mkstemp(dir=store_directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            numpy.savez(f, **to_columns(tests))
+        os.replace(tmp_path, os.path.join(store_directory, file_name))
+        ISP, _, replayName = ISP_replay.partition(")_")
+        partitions.append({"ISP_replay": ISP_replay, "ISP": ISP + ")" if replayName else ISP, "replay": replayName,
+                           "file": file_name, "rows": len(tests)})
+
+    # the index last, a reader never sees a partition that is not written yet
+    fd, tmp_path = tempfile.mkstemp(dir=store_directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump({"columns": COLUMNS, "partitions": partitions}, f)
+    os.replace(tmp_path, os.path.join(store_directory, INDEX_FILE))
+
+    # partitions of an earlier write that are gone now
+    files = set(partition["file"] for partition in partitions)
+    for entry in os.scandir(store_directory):
+        if entry.name.endswith(".npz") and entry.name not in files:
+            os.remove(entry.path)
+
+
+class TestStatStore(object):
+    '''
+    Read access to a store directory, partition by partition.
+    '''
+    def __init__(self, store_directory):
+        self.store_directory = store_directory
+        index = json.load(open(os.path.join(store_directory, INDEX_FILE), "r"))
+        self.partitions = [partition["ISP_replay"] for partition in index["partitions"]]
+        self.info = {partition["ISP_replay"]: partition for partition in index["partitions"]}
+
+    def __iter__(self):
+        return iter(self.partitions)
+
+    def __len__(self):
+        return len(self.partitions)
+
+    def __contains__(self, ISP_replay):
+        return ISP_replay in self.info
+
+    def keys(self):
+        return list(self.partitions)
+
+    def columns(self, ISP_replay, columns=None):
+        # {column: array} of one partition, only the requested columns are read
+        if columns is None:
+            columns = COLUMNS
+        with numpy.load(os.path.join(self.store_directory, self.info[ISP_replay]["file"])) as npz:
+            return {column: npz[column] for column in columns}
+
+    def __getitem__(self, ISP_replay):
+        # the partition as test_stat_per_carrier_replay[ISP_replay]
+        columns = self.columns(ISP_replay)
+        stats = numpy.column_stack([columns[column] for column in STAT_COLUMNS]).tolist()
+        tests = {}
+        for i, uniqueTestID in enumerate(columns["uniqueTestID"].tolist()):
+            lat = columns["lat"][i]
+            lon = columns["lon"][i]
+            # a list, as the (lat, lon) tuple comes back from the json file
+            location = ["", ""] if numpy.isnan(lat) else [float(lat), float(lon)]
+            tests[uniqueTestID] = stats[i] + [str(columns["ymd"][i]), str(columns["hour"][i]), location]
+        return tests
+
+    def items(self):
+        for ISP_replay in self.partitions:
+            yield ISP_replay, self[ISP_replay]
+
+
+def load_stats(test_stat, ISP_replay):
+    # (uniqueTestIDs, n x 6 array of the stats) of one ISP_replay of a store or of the nested dict
+    if isinstance(test_stat, TestStatStore):
+        columns = test_stat.columns(ISP_replay, ["uniqueTestID"] + STAT_COLUMNS)
+        stats = numpy.column_stack([columns[column] for column in STAT_COLUMNS])
+        return columns["uniqueTestID"].tolist(), stats
+    tests = test_stat[ISP_replay]
+    stats = numpy.array([stat[:6] for stat in tests.values()], dtype=numpy.float64).reshape(-1, 6)
+    return list(tests.keys()), stats
+
+
+def stat_features(stats):
+    # the 4 classification features of n x 6 stats, a zero avg_client/avg_server gives inf/NaN features
+    # (see finite_rows), the rows of such tests can not be classified
+    avg_client, avg_server, std_client, std_server, loss_original, loss_inverted = numpy.asarray(stats).T
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        return numpy.column_stack([(avg_server - avg_client) / avg_client,
+                                   (std_server / avg_server) - (std_client / avg_client),
+                                   loss_original - loss_inverted, std_client / avg_client])
+
+
+def finite_rows(features):
+    # the rows whose features are all finite
+    return numpy.isfinite(features).all(axis=1)
+
+
+def load(path):
+    # a store directory or a test_stat_per_carrier_replay json file
+    if os.path.isdir(path):
+        return TestStatStore(path)
+    return json.load(open(path, "r"))
+
+
+def main():
+    try:
+        json_file = sys.argv[1]
+        store_directory = sys.argv[2]
+    except:
+        print('\r\n Please provide the following inputs: [test_stat_per_carrier_replay.json] [store_directory]')
+        sys.exit()
+
+    test_stat_per_carrier_replay = json.load(open(json_file, "r"))
+    write(store_directory, test_stat_per_carrier_replay)
+    print("{} ISP_replays, {} tests written to {}".format(
+        len(test_stat_per_carrier_replay), sum(len(tests) for tests in test_stat_per_carrier_replay.values()),
+        store_directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
 import sys
 import os
 import subprocess
-import random
 import pickle
 import datetime
+import hashlib
+import json
+import multiprocessing
+import tempfile
+import time
 
 import numpy as np
 
@@ -18,16 +22,56 @@ from sklearn.metrics import precision_score
 from sklearn.metrics import recall_score
 
 from sklearn.linear_model import LogisticRegression
-
+from sklearn.linear_model import SGDClassifier
+
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.kernel_approximation import Nystroem
+from sklearn.kernel_approximation import RBFSampler
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
 from sklearn.svm import SVC
 
-train_stat_to_test = {}
+import compiled_model
+import test_stat_store
+
+DEFAULT_C = 1.0
+DEFAULT_GAMMA = 'auto'
+PROBABILITY_THRESHOLD = 0.6
+# seed of the Platt scaling cross-validation inside SVC(probability=True)
+RANDOM_SEED = 0
+NUM_FOLDS = 5
+
+# the grid of --search, every threshold is scored on the same fits
+SEARCH_C = [0.1, 1.0, 10.0, 100.0]
+SEARCH_GAMMA = ['auto', 0.01, 0.1, 1.0, 10.0]
+SEARCH_THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.9]
+
+# size of the kernel approximations
+NYSTROEM_COMPONENTS = 300
+RFF_COMPONENTS = 500
+
+MODEL_DIR = "./models/"
+# the fold accuracy and unknown % of the model the classification uses (trained_model.sav/.npz)
+MODEL_INFO_FILE = "trained_model.json"
+# --incremental: the online model and what it learned from, the labeled tests replayed with every update,
+# and the versions of the models trained, a version is only used after --promote
+ONLINE_MODEL_FILE = MODEL_DIR + "online_model.sav"
+RESERVOIR_FILE = MODEL_DIR + "reservoir.npz"
+RESERVOIR_SIZE = 2000
+MODEL_VERSIONS_FILE = MODEL_DIR + "model_versions.json"
+# passes over the tests of one update, and the L2 penalty of the SGD (1e-3 and up leaves most tests below
+# PROBABILITY_THRESHOLD, lower ones are more often wrong)
+ONLINE_EPOCHS = 5
+ONLINE_ALPHA = 1e-4
 
 
 def read_tests(plots_directory):
+    # features, labels and uniqueTestIDs of the labeled plots in plots_directory
     skip_plot_type = "throughput_distribution"
     X = []
     y = []
+    test_ids = []
 
     for plot in os.listdir(plots_directory):
         if "png" not in plot:
@@ -57,11 +101,40 @@ def read_tests(plots_directory):
         X.append([(avg_server-avg_client)/avg_client, (std_server/avg_server) - (std_client/avg_client), loss_original - loss_inverted, std_client/avg_client])
         # X.append([(avg_server - avg_client)/avg_client, (std_server/avg_server) - (std_client/avg_client), loss_original - loss_inverted])
         y.append(labeled_type)
+        test_ids.append("{}_{}".format(client_id, history_count))
+
+    return X, y, test_ids
 
-        train_stat_to_test[((avg_server-avg_client)/avg_client, (std_server/avg_server) - (std_client/avg_client), loss_original - loss_inverted, std_client/avg_client)] = "{}_{}".format(client_id, history_count)
-        # train_stat_to_test[((avg_server - avg_client)/avg_client, (std_server/avg_server) - (std_client/avg_client), loss_original - loss_inverted)] = "{}_{}".format(client_id, history_count)
 
-    return X, y
+def read_labeled_tests(label_file, test_stat_path):
+    # the same from a label file {uniqueTestID: label} and the stats of get_stat_from_throttled_tests.py
+    # (test_stat_per_carrier_replay.json or its store), no plots needed
+    labels = json.load(open(label_file, "r"))
+    test_stat = test_stat_store.load(test_stat_path)
+
+    X = []
+    y = []
+    test_ids = []
+    num_found = 0
+    for ISP_replay in test_stat:
+        unique_test_ids, stats = test_stat_store.load_stats(test_stat, ISP_replay)
+        rows = [index for index, uniqueTestID in enumerate(unique_test_ids) if uniqueTestID in labels]
+        if not rows:
+            continue
+        num_found += len(rows)
+        features = test_stat_store.stat_features(stats[rows])
+        # a test with a zero average throughput has non-finite features, it can not be trained on
+        valid = test_stat_store.finite_rows(features)
+        rows = [index for index, is_valid in zip(rows, valid) if is_valid]
+        X += features[valid].tolist()
+        y += [int(labels[unique_test_ids[index]]) for index in rows]
+        test_ids += [unique_test_ids[index] for index in rows]
+
+    if num_found < len(labels):
+        print("{} labeled tests are not in {}".format(len(labels) - num_found, test_stat_path))
+    if len(test_ids) < num_found:
+        print("{} labeled tests with a zero average throughput are left out".format(num_found - len(test_ids)))
+    return X, y, test_ids
 
 
 def get_accuracy(svm, test_set, test_labels):
@@ -79,6 +152,447 @@ def get_accuracy(svm, test_set, test_labels):
     return num_correct, num_false
 
 
+def gamma_value(gamma, num_features):
+    # SVC's gamma='auto' is 1 / number of features
+    if gamma == 'auto':
+        return 1.0 / num_features
+    return gamma
+
+
+def svc_model(C, gamma, seed):
+    # the classifier so far, exact RBF kernel, Platt scaling by an internal 5-fold cross-validation
+    return SVC(C=C, gamma=gamma, probability=True, random_state=seed)
+
+
+def nystroem_model(C, gamma, seed):
+    # RBF kernel of the standardized features approximated on NYSTROEM_COMPONENTS training tests, a logistic
+    # regression on it, its probabilities calibrated with a sigmoid on 3 folds (as the SVC's Platt scaling)
+    return CalibratedClassifierCV(make_pipeline(StandardScaler(),
+                                                Nystroem(gamma=gamma, n_components=NYSTROEM_COMPONENTS,
+                                                         random_state=seed),
+                                                LogisticRegression(C=C, max_iter=1000)), method="sigmoid", cv=3)
+
+
+def rff_model(C, gamma, seed):
+    # random Fourier features of the RBF kernel of the standardized features, a logistic regression on them,
+    # calibrated the same way
+    return CalibratedClassifierCV(make_pipeline(StandardScaler(),
+                                                RBFSampler(gamma=gamma, n_components=RFF_COMPONENTS,
+                                                           random_state=seed),
+                                                LogisticRegression(C=C, max_iter=1000)), method="sigmoid", cv=3)
+
+
+def hgb_model(C, gamma, seed):
+    # histogram gradient boosting, its probabilities calibrated with a sigmoid on 3 folds (C and gamma unused)
+    return CalibratedClassifierCV(HistGradientBoostingClassifier(random_state=seed), method="sigmoid", cv=3)
+
+
+# --backend, every one has predict_proba with the classes in sorted order
+BACKENDS = {"svc": svc_model, "nystroem": nystroem_model, "rff": rff_model, "hgb": hgb_model}
+
+
+def make_model(backend, C, gamma, num_features, seed):
+    if backend == "svc":
+        return svc_model(C, gamma, seed)
+    return BACKENDS[backend](C, gamma_value(gamma, num_features), seed)
+
+
+def benchmark_fold(task):
+    # fit one fold of one configuration, returns predict_proba of the test part and the seconds to fit and predict
+    X_train, y_train, X_test, backend, C, gamma, seed = task
+    model = make_model(backend, C, gamma, X_train.shape[1], seed)
+    start = time.time()
+    model.fit(X_train, y_train)
+    fit_time = time.time() - start
+    start = time.time()
+    y_pred = model.predict_proba(X_test)
+    return y_pred, fit_time, time.time() - start
+
+
+def evaluate_fold(task):
+    return benchmark_fold(task)[0]
+
+
+# the squared distances and labels of --precomputed, set in every worker,
+# and (gamma, Gram matrix) of the gamma the worker is on, one n x n matrix at a time
+_distances = None
+_labels = None
+_gram = (None, None)
+
+
+def squared_distances(X):
+    # |xi - xj|^2 of every pair of tests, computed once for all folds and gammas
+    square = (X ** 2).sum(axis=1)
+    distances = square[:, None] + square[None, :] - 2 * X.dot(X.T)
+    np.maximum(distances, 0, out=distances)
+    np.fill_diagonal(distances, 0)
+    return distances
+
+
+def set_precomputed(distances, labels):
+    global _distances, _labels, _gram
+    _distances = distances
+    _labels = labels
+    _gram = (None, None)
+
+
+def evaluate_fold_precomputed(task):
+    # evaluate_fold on the RBF Gram matrix exp(-gamma * distances), the fold sliced out by index
+    global _gram
+    train_index, test_index, C, gamma, seed = task
+    if _gram[0] != gamma:
+        # the matrix of the previous gamma is dropped first, the tasks come sorted by gamma
+        _gram = (None, None)
+        _gram = (gamma, np.exp(-gamma * _distances))
+    gram = _gram[1]
+    model = SVC(C=C, kernel='precomputed', probability=True, random_state=seed)
+    model.fit(gram[np.ix_(train_index, train_index)], _labels[train_index])
+    return model.predict_proba(gram[np.ix_(test_index, train_index)])
+
+
+def run_tasks(function, tasks, workers, initializer=None, initargs=()):
+    # in order, by a pool of processes with more than one worker
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer, initargs) as pool:
+            return pool.map(function, tasks)
+    if initializer:
+        initializer(*initargs)
+    return [function(task) for task in tasks]
+
+
+def evaluate_configs(X, y, folds, configs, workers, seed, precomputed=False, backend="svc"):
+    # predict_proba of every fold of every (C, gamma), configuration by configuration
+    if precomputed and backend == "svc":
+        # one distance matrix instead of a kernel computation in every fit
+        tasks = [(train_index, test_index, C, gamma_value(gamma, X.shape[1]), seed)
+                 for C, gamma in configs for train_index, test_index in folds]
+        # grouped by gamma, so a worker computes the Gram matrix of a gamma once and keeps only that one
+        order = sorted(range(len(tasks)), key=lambda n: tasks[n][3])
+        sorted_results = run_tasks(evaluate_fold_precomputed, [tasks[n] for n in order], workers, set_precomputed,
+                                   (squared_distances(X), y))
+        results = [None] * len(tasks)
+        for n, result in zip(order, sorted_results):
+            results[n] = result
+        return results
+    tasks = [(X[train_index], y[train_index], X[test_index], backend, C, gamma, seed)
+             for C, gamma in configs for train_index, test_index in folds]
+    return run_tasks(evaluate_fold, tasks, workers)
+
+
+def count_unknown_wrong(y_pred, y_test, probability_threshold):
+    # indices of the tests below the threshold and of the ones predicted wrong
+    max_proba = y_pred.max(axis=1)
+    predicted = y_pred.argmax(axis=1) + 1
+    unknown = np.flatnonzero(max_proba < probability_threshold)
+    wrong = np.flatnonzero((max_proba >= probability_threshold) & (predicted != y_test))
+    return unknown, wrong
+
+
+def search(X, y, folds, workers, seed, precomputed=False, backend="svc"):
+    # every (C, gamma) of the grid on every fold, scored at every threshold
+    configs = [(C, gamma) for C in SEARCH_C for gamma in SEARCH_GAMMA]
+    results = evaluate_configs(X, y, folds, configs, workers, seed, precomputed, backend)
+
+    search_results = []
+    for n, (C, gamma) in enumerate(configs):
+        fold_results = results[n * len(folds):(n + 1) * len(folds)]
+        for probability_threshold in SEARCH_THRESHOLDS:
+            score_all = []
+            wrong_percent = []
+            unknown_percent = []
+            for (train_index, test_index), y_pred in zip(folds, fold_results):
+                unknown, wrong = count_unknown_wrong(y_pred, y[test_index], probability_threshold)
+                score_all.append(1 - (len(unknown) + len(wrong)) / len(y_pred))
+                wrong_percent.append(len(wrong) / len(y_pred))
+                unknown_percent.append(len(unknown) / len(y_pred))
+            search_results.append({"C": C, "gamma": gamma, "threshold": probability_threshold,
+                                   "accuracy": mean(score_all), "unknown": mean(unknown_percent),
+                                   "wrong": mean(wrong_percent)})
+
+    search_results.sort(key=lambda result: -result["accuracy"])
+    print("{:>8} {:>8} {:>10} {:>9} {:>10} {:>8}".format("C", "gamma", "threshold", "accuracy", "unknown %", "wrong %"))
+    for result in search_results:
+        print("{:>8} {:>8} {:>10} {:>9.4f} {:>10.4f} {:>8.4f}".format(
+            result["C"], result["gamma"], result["threshold"], result["accuracy"], result["unknown"],
+            result["wrong"]))
+    return search_results
+
+
+def benchmark(X, y, folds, workers, seed, probability_threshold):
+    # every backend on the same folds with the default C and gamma
+    backends = sorted(BACKENDS)
+    tasks = [(X[train_index], y[train_index], X[test_index], backend, DEFAULT_C, DEFAULT_GAMMA, seed)
+             for backend in backends for train_index, test_index in folds]
+    results = run_tasks(benchmark_fold, tasks, workers)
+
+    benchmark_results = []
+    for n, backend in enumerate(backends):
+        fold_results = results[n * len(folds):(n + 1) * len(folds)]
+        num_tests = 0
+        count_unknown = 0
+        count_wrong = 0
+        for (train_index, test_index), (y_pred, fit_time, predict_time) in zip(folds, fold_results):
+            unknown, wrong = count_unknown_wrong(y_pred, y[test_index], probability_threshold)
+            num_tests += len(y_pred)
+            count_unknown += len(unknown)
+            count_wrong += len(wrong)
+        benchmark_results.append({"backend": backend,
+                                  "fit_seconds": mean(result[1] for result in fold_results),
+                                  "predict_us_per_test": 1E6 * sum(result[2] for result in fold_results) / num_tests,
+                                  "accuracy": 1 - (count_unknown + count_wrong) / num_tests,
+                                  "unknown": count_unknown / num_tests, "wrong": count_wrong / num_tests})
+
+    print("{:>10} {:>12} {:>15} {:>9} {:>10} {:>8}".format("backend", "fit s/fold", "predict us/test", "accuracy",
+                                                           "unknown %", "wrong %"))
+    for result in benchmark_results:
+        print("{:>10} {:>12.3f} {:>15.1f} {:>9.4f} {:>10.4f} {:>8.4f}".format(
+            result["backend"], result["fit_seconds"], result["predict_us_per_test"], result["accuracy"],
+            result["unknown"], result["wrong"]))
+    return benchmark_results
+
+
+def write_model(trained_model, backend, name):
+    # name.sav, and name.npz for an SVC (see compiled_model.py)
+    pickle.dump(trained_model, open(name + ".sav", 'wb'))
+    if backend == "svc":
+        compiled_model.export(trained_model, name + ".npz")
+    elif os.path.exists(name + ".npz"):
+        # only SVCs are exported, the classification would take the old one before name.sav
+        os.remove(name + ".npz")
+
+
+def pair_hash(test_id, label):
+    return int(hashlib.sha1("{}:{}\n".format(test_id, int(label)).encode("utf-8")).hexdigest(), 16)
+
+
+def update_fingerprint(fingerprint, added, removed=()):
+    # fingerprint of the (uniqueTestID, label) pairs a model learned from: the sum of their sha1 modulo 2^160,
+    # independent of the order and updated with the pairs added (and the old pairs of relabeled tests) only
+    value = int(fingerprint, 16)
+    for test_id, label in added:
+        value += pair_hash(test_id, label)
+    for test_id, label in removed:
+        value -= pair_hash(test_id, label)
+    return "{:040x}".format(value % (1 << 160))
+
+
+def online_model(seed, num_features=4):
+    # the features standardized with running statistics, random Fourier features of the RBF kernel (they do not
+    # depend on the data) and a logistic regression trained by SGD, updated with partial_fit on the new labels only
+    sampler = RBFSampler(gamma=gamma_value(DEFAULT_GAMMA, num_features), n_components=RFF_COMPONENTS,
+                         random_state=seed).fit(np.zeros((1, num_features)))
+    return make_pipeline(StandardScaler(), sampler,
+                         SGDClassifier(loss="log_loss", alpha=ONLINE_ALPHA, random_state=seed))
+
+
+def update_online_model(model, X_new, X_update, y_update, classes):
+    # the scaler learns the new tests only (the replayed ones are already in its statistics),
+    # the classifier ONLINE_EPOCHS passes over all of X_update
+    if len(X_new):
+        model[0].partial_fit(X_new)
+    features = model[:-1].transform(X_update)
+    for epoch in range(ONLINE_EPOCHS):
+        model[-1].partial_fit(features, y_update, classes=classes)
+
+
+def online_fold_scores(X, y, classes, seed):
+    # (accuracy, unknown %) of the online model over NUM_FOLDS folds of these tests as the full training
+    # scores a model, a new online model for every fold, None when there are fewer tests than folds
+    if len(y) < NUM_FOLDS:
+        return None, None
+    score_all = []
+    unknown_percent = []
+    for train_index, test_index in KFold(n_splits=NUM_FOLDS, shuffle=False).split(X):
+        model = online_model(seed, X.shape[1])
+        update_online_model(model, X[train_index], X[train_index], y[train_index], classes)
+        y_pred = model.predict_proba(X[test_index])
+        unknown, wrong = count_unknown_wrong(y_pred, y[test_index], PROBABILITY_THRESHOLD)
+        score_all.append(1 - (len(unknown) + len(wrong)) / len(y_pred))
+        unknown_percent.append(len(unknown) / len(y_pred))
+    return mean(score_all), mean(unknown_percent)
+
+
+def load_online_state(path, seed):
+    # (model, fingerprint) of the last incremental run, a new model when there is none
+    if not os.path.exists(path):
+        return online_model(seed), "0" * 40
+    state = pickle.load(open(path, "rb"))
+    return state["model"], state["fingerprint"]
+
+
+def save_online_state(path, model, fingerprint):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump({"model": model, "fingerprint": fingerprint}, f)
+    os.replace(tmp_path, path)
+
+
+def load_reservoir(path):
+    # (X, y, uniqueTestIDs) replayed with every update, {uniqueTestID: label} of every test learned so far
+    if not os.path.exists(path):
+        return np.zeros((0, 4)), np.zeros(0, dtype=int), [], {}
+    with np.load(path) as npz:
+        return npz["X"], npz["y"], npz["test_ids"].tolist(), dict(zip(npz["seen"].tolist(),
+                                                                      npz["seen_labels"].tolist()))
+
+
+def save_reservoir(path, X, y, test_ids, seen):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.savez(f, X=X, y=y, test_ids=np.array(test_ids, dtype=str).reshape(-1),
+                 seen=np.array(list(seen.keys()), dtype=str).reshape(-1),
+                 seen_labels=np.array(list(seen.values()), dtype=int))
+    os.replace(tmp_path, path)
+
+
+def update_reservoir(X, y, test_ids, X_new, y_new, new_ids, num_seen, seed, size=RESERVOIR_SIZE):
+    # reservoir sampling (algorithm R): every test seen so far is kept with the same probability size / seen
+    X = list(X)
+    y = list(y)
+    test_ids = list(test_ids)
+    rng = np.random.RandomState(seed + num_seen)
+    for features, label, test_id in zip(X_new, y_new, new_ids):
+        num_seen += 1
+        if len(test_ids) < size:
+            X.append(features)
+            y.append(label)
+            test_ids.append(test_id)
+            continue
+        slot = rng.randint(0, num_seen)
+        if slot < size:
+            X[slot] = features
+            y[slot] = label
+            test_ids[slot] = test_id
+    return np.array(X).reshape(-1, 4), np.array(y, dtype=int), test_ids
+
+
+def incremental_train(X, y, test_ids, seed):
+    # update the online model with the tests labeled (or relabeled) since the last run, a new model version.
+    # Every update is ONLINE_EPOCHS partial_fit passes over the new tests and the reservoir of earlier ones,
+    # its cost does not grow with the number of tests learned so far. The version is scored on the reservoir
+    # and written to MODEL_DIR only, --promote makes it the model the classification uses
+    if not os.path.exists(MODEL_DIR):
+        os.mkdir(MODEL_DIR)
+    model, fingerprint = load_online_state(ONLINE_MODEL_FILE, seed)
+    reservoir_X, reservoir_y, reservoir_ids, seen = load_reservoir(RESERVOIR_FILE)
+
+    # the implementation types are the labels of the label file, the online model keeps those it started with
+    label_types = sorted(set(int(label) for label in y))
+    if hasattr(model[-1], "classes_"):
+        implementation_types = [int(label) for label in model[-1].classes_]
+    else:
+        implementation_types = label_types
+    unknown_types = sorted(set(label_types) - set(implementation_types))
+    if unknown_types:
+        print("labels {} are not implementation types {} of the online model, remove {} and {} to train a new one".format(
+            unknown_types, implementation_types, ONLINE_MODEL_FILE, RESERVOIR_FILE))
+        sys.exit()
+
+    new_rows = [index for index, test_id in enumerate(test_ids) if test_id not in seen]
+    relabeled_rows = [index for index, test_id in enumerate(test_ids)
+                      if test_id in seen and seen[test_id] != int(y[index])]
+    if not new_rows and not relabeled_rows:
+        print("no new labeled tests, {} seen, model is up to date".format(len(seen)))
+        return
+
+    # the reservoir keeps the corrected labels of relabeled tests
+    labels = dict(zip(test_ids, y))
+    for slot, test_id in enumerate(reservoir_ids):
+        if test_id in labels:
+            reservoir_y[slot] = labels[test_id]
+
+    update_rows = new_rows + relabeled_rows
+    X_update = np.concatenate([X[update_rows], reservoir_X])
+    y_update = np.concatenate([y[update_rows], reservoir_y])
+
+    start = time.time()
+    update_online_model(model, X[new_rows], X_update, y_update, implementation_types)
+    print("{} new, {} relabeled, updated on {} tests in {:.2f}s".format(
+        len(new_rows), len(relabeled_rows), len(y_update), time.time() - start))
+
+    fingerprint = update_fingerprint(fingerprint, [(test_ids[index], y[index]) for index in update_rows],
+                                     [(test_ids[index], seen[test_ids[index]]) for index in relabeled_rows])
+    reservoir_X, reservoir_y, reservoir_ids = update_reservoir(
+        reservoir_X, reservoir_y, reservoir_ids, X[new_rows], y[new_rows], [test_ids[index] for index in new_rows],
+        len(seen), seed)
+    for index in update_rows:
+        seen[test_ids[index]] = int(y[index])
+
+    # the reservoir is a uniform sample of every test learned so far, with their current labels
+    accuracy, unknown_percent = online_fold_scores(reservoir_X, reservoir_y, implementation_types, seed)
+
+    versions = load_versions()
+    version = versions[-1]["version"] + 1 if versions else 1
+    name = "{}trained_model_v{}".format(MODEL_DIR, version)
+    # a pipeline, classified from the .sav
+    write_model(model, "online", name)
+    save_online_state(ONLINE_MODEL_FILE, model, fingerprint)
+    save_reservoir(RESERVOIR_FILE, reservoir_X, reservoir_y, reservoir_ids, seen)
+
+    versions.append({"version": version, "date": datetime.datetime.today().strftime("%d-%B-%Y %H:%M:%S"),
+                     "backend": "online", "seed": seed, "model": name + ".sav", "fingerprint": fingerprint,
+                     "implementation_types": implementation_types, "num_updated": len(update_rows),
+                     "num_seen": len(seen), "accuracy": accuracy, "unknown": unknown_percent})
+    json.dump(versions, open(MODEL_VERSIONS_FILE, "w"), indent=1)
+    print("model version", version, fingerprint)
+    if accuracy is not None:
+        print("fold accuracy {:.4f}, unknown % {:.4f}, --promote {} to classify with it".format(
+            accuracy, unknown_percent, version))
+
+
+def load_versions():
+    if not os.path.exists(MODEL_VERSIONS_FILE):
+        return []
+    return json.load(open(MODEL_VERSIONS_FILE, "r"))
+
+
+def write_model_info(info):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(MODEL_INFO_FILE)), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(info, f, indent=1)
+    os.replace(tmp_path, MODEL_INFO_FILE)
+
+
+def promote(version):
+    # make a model version of --incremental the model the classification uses, if its fold accuracy
+    # and unknown % are not worse than those of the current model
+    entries = [entry for entry in load_versions() if entry["version"] == version]
+    if not entries:
+        print("no model version {} in {}".format(version, MODEL_VERSIONS_FILE))
+        return False
+    entry = entries[0]
+    if entry.get("accuracy") is None:
+        print("model version {} has no fold accuracy, it is not promoted".format(version))
+        return False
+
+    if os.path.exists(MODEL_INFO_FILE):
+        current = json.load(open(MODEL_INFO_FILE, "r"))
+        if entry["accuracy"] < current["accuracy"] or entry["unknown"] > current["unknown"]:
+            print("model version {} (accuracy {:.4f}, unknown % {:.4f}) is worse than {} (accuracy {:.4f}, "
+                  "unknown % {:.4f}), it is not promoted".format(version, entry["accuracy"], entry["unknown"],
+                                                                  current["model"], current["accuracy"],
+                                                                  current["unknown"]))
+            return False
+    elif os.path.exists("trained_model.sav") or os.path.exists("trained_model.npz"):
+        print("no {} for the current trained_model, train it again to compare model version {} with it".format(
+            MODEL_INFO_FILE, version))
+        return False
+
+    # trained_model.sav is replaced in one step, a classification_service watching it never reads half a file
+    fd, tmp_path = tempfile.mkstemp(dir=".", suffix=".tmp")
+    with os.fdopen(fd, "wb") as f, open(entry["model"], "rb") as model_file:
+        f.write(model_file.read())
+    os.replace(tmp_path, "trained_model.sav")
+    if os.path.exists("trained_model.npz"):
+        # only SVCs are exported, the classification would take the old one before trained_model.sav
+        os.remove("trained_model.npz")
+        print("removed trained_model.npz, classify with trained_model.sav")
+    write_model_info({"model": entry["model"], "backend": entry["backend"], "date": entry["date"],
+                      "accuracy": entry["accuracy"], "unknown": entry["unknown"]})
+    print("model version {} is trained_model.sav".format(version))
+    return True
+
+
 def main():
 
     # Use plots in plots_directory to form a list of data
@@ -86,80 +600,138 @@ def main():
     # 1. the avg for both client and server side throughput
     # 2. the stdev for both client and server side throughput
     # 3. loss rate for original replay and bit-inverted replay
+    # or, with --labels, the labels of a label file and these stats from the test stat store
+    args = sys.argv[1:]
+    workers = 1
+    seed = RANDOM_SEED
+    grid_search = '--search' in args
+    if grid_search:
+        args.remove('--search')
+    precomputed = '--precomputed' in args
+    if precomputed:
+        args.remove('--precomputed')
+    run_benchmark = '--benchmark' in args
+    if run_benchmark:
+        args.remove('--benchmark')
+    incremental = '--incremental' in args
+    if incremental:
+        args.remove('--incremental')
+    promote_version = None
+    backend = "svc"
+    label_file = None
+    test_stat_path = None
+    labels_output = None
     try:
-        plots_directory = sys.argv[1]
+        if '--labels' in args:
+            i = args.index('--labels')
+            label_file = args[i + 1]
+            test_stat_path = args[i + 2]
+            del args[i:i + 3]
+        if '--write-labels' in args:
+            i = args.index('--write-labels')
+            labels_output = args[i + 1]
+            del args[i:i + 2]
+        if '--workers' in args:
+            i = args.index('--workers')
+            workers = int(args[i + 1])
+            del args[i:i + 2]
+        if '--backend' in args:
+            i = args.index('--backend')
+            backend = args[i + 1]
+            del args[i:i + 2]
+            if backend not in BACKENDS:
+                raise ValueError
+        if '--seed' in args:
+            i = args.index('--seed')
+            seed = int(args[i + 1])
+            del args[i:i + 2]
+        if '--promote' in args:
+            i = args.index('--promote')
+            promote_version = int(args[i + 1])
+            del args[i:i + 2]
+        if not label_file and promote_version is None:
+            plots_directory = args[0]
     except:
         print(
-            '\r\n Please provide the following input: [plots_directory] <num_folders>')
+            '\r\n Please provide the following input: [plots_directory] or <--labels labels.json test_stat_per_carrier_replay(_store)> <--write-labels labels.json> <--workers N> <--search> <--precomputed> <--backend svc|nystroem|rff|hgb> <--benchmark> <--incremental> <--promote VERSION> <--seed S>')
         sys.exit()
 
-    X, y = read_tests(plots_directory)
+    if promote_version is not None:
+        promote(promote_version)
+        return
+
+    if label_file:
+        X, y, test_ids = read_labeled_tests(label_file, test_stat_path)
+    else:
+        X, y, test_ids = read_tests(plots_directory)
+
+    if labels_output:
+        # the labels of the plots, to train from the stats from now on
+        json.dump(dict(zip(test_ids, y)), open(labels_output, "w"))
+
+    if incremental:
+        # always the online model, --backend is for full trainings
+        incremental_train(np.array(X).reshape(-1, 4), np.array(y, dtype=int), test_ids, seed)
+        return
 
     print("num tests", len(X))
 
-    trained_model = SVC(gamma='auto', probability=True)
-    probability_threshold = 0.6
+    trained_model = make_model(backend, DEFAULT_C, DEFAULT_GAMMA, len(X[0]) if X else 4, seed)
+    probability_threshold = PROBABILITY_THRESHOLD
 
     score_all = []
-    random_state = random.randint(0, 100)
     wrong_percent = []
     unknown_percent = []
 
-    kf = KFold(n_splits=5, random_state=random_state, shuffle=False)
+    # the folds are not shuffled (a random_state without shuffle is an error in current sklearn)
+    kf = KFold(n_splits=NUM_FOLDS, shuffle=False)
     X = np.array(X)
     y = np.array(y)
-    iter_count = 0
+    folds = list(kf.split(X))
+
+    # evaluation only, the model is not written
+    if grid_search:
+        json.dump(search(X, y, folds, workers, seed, precomputed, backend), open("classifier_search.json", "w"))
+        return
+    if run_benchmark:
+        json.dump(benchmark(X, y, folds, workers, seed, probability_threshold),
+                  open("classifier_benchmark.json", "w"))
+        return
 
-    for train_index, test_index in kf.split(X):
+    # the folds are fitted in parallel with --workers, on precomputed kernels with --precomputed
+    results = evaluate_configs(X, y, folds, [(DEFAULT_C, DEFAULT_GAMMA)], workers, seed, precomputed, backend)
+
+    for iter_count, ((train_index, test_index), y_pred) in enumerate(zip(folds, results)):
         print("iteration", iter_count)
-        X_train, X_test = X[train_index], X[test_index]
-        y_train, y_test = y[train_index], y[test_index]
-        count_unknown = 0
-        count_wrong = 0
-        count_correct = 0
-        trained_model.fit(X_train, y_train)
-        X_test = list(X_test)
-        y_pred = trained_model.predict_proba(X_test)
-        for index in range(len(y_pred)):
-            X_test_data = list(X_test[index])
+        y_test = y[test_index]
+        unknown, wrong = count_unknown_wrong(y_pred, y_test, probability_threshold)
+        for index in sorted(set(unknown) | set(wrong)):
             y_pred_proba = list(y_pred[index])
-            if max(y_pred_proba) < probability_threshold:
-                count_unknown += 1
-                print("unknown, id {}, pred {}, label {}, prob {}, threshold {}".format(
-                    train_stat_to_test[(X_test_data[0], X_test_data[1], X_test_data[2], X_test_data[3])],
-                    # train_stat_to_test[(X_test_data[0], X_test_data[1], X_test_data[2])],
-                    y_pred_proba.index(max(y_pred_proba)) + 1, y_test[index], max(y_pred_proba), probability_threshold))
-            elif (y_pred_proba.index(max(y_pred_proba)) + 1) != y_test[index]:
-                count_wrong += 1
-                print("wrong, id {}, pred {}, label {}, prob {}, threshold {}".format(
-                    train_stat_to_test[(X_test_data[0], X_test_data[1], X_test_data[2], X_test_data[3])],
-                    # train_stat_to_test[(X_test_data[0], X_test_data[1], X_test_data[2])],
-                    y_pred_proba.index(max(y_pred_proba)) + 1, y_test[index], max(y_pred_proba), probability_threshold))
-            else:
-                count_correct += 1
-
-        score_all.append(1 - (count_unknown + count_wrong)/len(y_pred))
-        wrong_percent.append(count_wrong/len(y_pred))
-        unknown_percent.append(count_unknown / len(y_pred))
-        iter_count += 1
+            print("{}, id {}, pred {}, label {}, prob {}, threshold {}".format(
+                "unknown" if index in unknown else "wrong", test_ids[test_index[index]],
+                y_pred_proba.index(max(y_pred_proba)) + 1, y_test[index], max(y_pred_proba), probability_threshold))
+
+        score_all.append(1 - (len(unknown) + len(wrong))/len(y_pred))
+        wrong_percent.append(len(wrong)/len(y_pred))
+        unknown_percent.append(len(unknown) / len(y_pred))
 
     print("average score, unknown %, all scores", mean(score_all), score_all)
     print("average wrong percent", mean(wrong_percent), wrong_percent)
     print("average unknown percent", mean(unknown_percent), unknown_percent)
 
+    # the SVC is always an RBF SVC, a precomputed kernel model needs the training tests to predict
     trained_model.fit(X, y)
     today_date = datetime.datetime.today()
     today_date = today_date.strftime("%d-%B-%Y")
 
-    model_dir = "./models/"
-
-    if not os.path.exists(model_dir):
-        os.mkdir(model_dir)
+    if not os.path.exists(MODEL_DIR):
+        os.mkdir(MODEL_DIR)
 
-    filename = "trained_model.sav"
-    timestamped_filename = "{}trained_model_{}.sav".format(model_dir, today_date)
-    pickle.dump(trained_model, open(filename, 'wb'))
-    pickle.dump(trained_model, open(timestamped_filename, 'wb'))
+    write_model(trained_model, backend, "trained_model")
+    write_model(trained_model, backend, "{}trained_model_{}".format(MODEL_DIR, today_date))
+    # what --promote compares a model version with
+    write_model_info({"model": "{}trained_model_{}.sav".format(MODEL_DIR, today_date), "backend": backend,
+                      "date": today_date, "accuracy": mean(score_all), "unknown": mean(unknown_percent)})
 
 
 if __name__ == "__main__":
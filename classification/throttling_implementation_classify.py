@@ -2,16 +2,15 @@ import sys
 import os
 import subprocess
 import random
-import pickle
 import json
-import matplotlib.pyplot as plt
 
 import numpy as np
 
 from statistics import mean
 from statistics import median
 
-from sklearn.svm import SVC
+import compiled_model
+import test_stat_store
 
 
 def get_implmentation_type(p_val, loss_diff):
@@ -133,6 +132,9 @@ def get_accuracy(svm, test_set, test_labels):
 
 
 def simple_histogram_plot(data_1, plot_title=""):
+    # imported here, classifying does not need matplotlib
+    import matplotlib.pyplot as plt
+
     # data_1_90 = data_1[: int(90 * len(data_1) / 100)]
     # interval = max(data_1_90) / float(100)
     interval = 0.01
@@ -159,6 +161,8 @@ def simple_histogram_plot(data_1, plot_title=""):
 
 
 def simple_histograms_plot(data_1, data_2, plot_title=""):
+    import matplotlib.pyplot as plt
+
     data_1_90 = data_1[: int(90 * len(data_1) / 100)]
     data_2_90 = data_2[: int(90 * len(data_2) / 100)]
     interval = max(data_1_90 + data_2_90) / float(100)
@@ -184,20 +188,41 @@ def simple_histograms_plot(data_1, data_2, plot_title=""):
     plt.close()
 
 
-def calculate_label_percentage(classification_label_percentage, count_tests, count_tests_ISP, count_tests_ISP_replay):
-    for label in classification_label_percentage:
-        classification_label_percentage[label][1] = classification_label_percentage[label][0]/count_tests
-        for ISP in classification_label_percentage[label][2]:
-            classification_label_percentage[label][2][ISP][1] = classification_label_percentage[label][2][ISP][0]/count_tests_ISP[ISP]
-            for ISP_replay in classification_label_percentage[label][2][ISP][2]:
-                classification_label_percentage[label][2][ISP][2][ISP_replay][1] = classification_label_percentage[label][2][ISP][2][ISP_replay][0]/count_tests_ISP_replay[ISP_replay]
+def group_by(keys):
+    # the distinct keys in the order of their first occurrence (the order a dict is filled in),
+    # the group of every key and the size of every group
+    uniques, first, inverse, counts = np.unique(np.asarray(keys), return_index=True, return_inverse=True,
+                                                return_counts=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=int)
+    rank[order] = np.arange(len(order))
+    return uniques[order].tolist(), rank[inverse.reshape(-1)], counts[order].tolist()
+
+
+def count_by(groups, labels):
+    # [(group, label, number of tests)] in the order of the first test of every (group, label)
+    # labels start at INVALID_LABEL (-1)
+    num_labels = int(labels.max()) + 2 if len(labels) else 1
+    keys, _, counts = group_by(groups * num_labels + labels + 1)
+    return [(key // num_labels, key % num_labels - 1, count) for key, count in zip(keys, counts)]
+
+
+# a test whose stats give non-finite features (a zero average throughput) can not be classified
+INVALID_LABEL = -1
 
-    return classification_label_percentage
+
+def label_name(label):
+    if label == INVALID_LABEL:
+        return "invalid"
+    if label == 0:
+        return "unknown"
+    return int(label)
 
 
 def main():
 
     # Use test_stat generated by get_stat_from_wehe_tests.py
+    # (test_stat_per_carrier_replay.json or the test_stat_per_carrier_replay_store directory)
     try:
         test_stat = sys.argv[1]
     except:
@@ -206,142 +231,116 @@ def main():
         sys.exit()
 
     predict_probability_threshold = 0.6
-    filename = "trained_model.sav"
-    trained_model = pickle.load(open(filename, "rb"))
+    # the exported model if there is one, it does not need sklearn
+    filename = "trained_model.npz"
+    if not os.path.exists(filename):
+        filename = "trained_model.sav"
+    trained_model = compiled_model.load_model(filename)
 
     wehe_agg_results = json.load(open("weheStat.json", "r"))
     all_throttling_cases = wehe_agg_results["allThrottlingCases"]
 
-    test_stat = json.load(open(test_stat, "r"))
-
-    classification_results_ISP = {}
-    classification_results_ISP_replay = {}
+    # only the ISP_replays in all_throttling_cases are read from a store
+    test_stat = test_stat_store.load(test_stat)
 
     unknown_test_ids = {}
+    invalid_test_ids = {}
     review_tests = {}
-    classification_label_percentage = {}
-
-    count_tests = 0
-    count_tests_ISP = {}
-    count_tests_ISP_replay = {}
 
     tests_for_plotting = {}
 
+    # the stats of every test to classify, one row per test in the order of test_stat
+    ISP_replays = []
+    unique_test_ids = []
+    row_ISP_replay = []
+    stats = []
     for ISP_replay in test_stat:
         ISP_replay_replaced = ISP_replay.replace(")_", ")-")
         if ISP_replay_replaced not in all_throttling_cases.keys():
             continue
-        test_stat_ISP_replay = []
-        unique_test_ids = []
-
-        ISP = ISP_replay.split(")_")[0]
-        replayName = ISP_replay.split(")_")[1]
-
-        for uniqTestID in test_stat[ISP_replay]:
-            # [avg_client_tputs_original, avg_server_tputs_original, stdev_client_tputs_original,
-            #  stdev_server_tputs_original, loss_rate_original, loss_rate_inverted]
-            current_test_stat = test_stat[ISP_replay][uniqTestID]
-            avg_client = current_test_stat[0]
-            avg_server = current_test_stat[1]
-            std_client = current_test_stat[2]
-            std_server = current_test_stat[3]
-            loss_original = current_test_stat[4]
-            loss_inverted = current_test_stat[5]
-            # 4 features
-
-            test_stat_ISP_replay.append([(avg_server - avg_client)/avg_client,
-                                         (std_server / avg_server) - (std_client / avg_client),
-                                         loss_original - loss_inverted, std_client / avg_client])
-            # 3 features
-            # test_stat_ISP_replay.append([(avg_server - avg_client)/avg_client, (std_server/avg_server) - (std_client/avg_client),
-            #                              loss_original - loss_inverted])
-            unique_test_ids.append(uniqTestID)
-
-        classification_results = trained_model.predict_proba(test_stat_ISP_replay)
-
-        if ISP_replay not in classification_results_ISP_replay:
-            classification_results_ISP_replay[ISP_replay] = {}
-        if ISP not in classification_results_ISP:
-            classification_results_ISP[ISP] = {}
-
-        # for index in range(len(classification_results)):
-        #     classification_label = classification_results[index]
-        #
-        #     if classification_label not in classification_results_ISP_replay[ISP_replay]:
-        #         classification_results_ISP_replay[ISP_replay][classification_label] = 0
-        #     if classification_label not in classification_results_ISP[ISP]:
-        #         classification_results_ISP[ISP][classification_label] = 0
-        #     classification_results_ISP_replay[ISP_replay][classification_label] += 1
-        #     classification_results_ISP[ISP][classification_label] += 1
-
-        # prediction with probability
-        for index in range(len(classification_results)):
-            classification_result = list(classification_results[index])
-            uniqTestID = unique_test_ids[index]
-            if max(classification_result) < predict_probability_threshold:
-                # record the uniqueID of each unknown test, plot them out for further analysis
-                classification_label = "unknown"
-                if ISP not in unknown_test_ids:
-                    unknown_test_ids[ISP] = {}
-
-                if replayName not in unknown_test_ids[ISP]:
-                    unknown_test_ids[ISP][replayName] = []
-                unknown_test_ids[ISP][replayName].append(uniqTestID)
-            else:
-                classification_label = classification_result.index(max(classification_result)) + 1
-
-            if classification_label not in classification_results_ISP_replay[ISP_replay]:
-                classification_results_ISP_replay[ISP_replay][classification_label] = 0
-            if classification_label not in classification_results_ISP[ISP]:
-                classification_results_ISP[ISP][classification_label] = 0
-            classification_results_ISP_replay[ISP_replay][classification_label] += 1
-            classification_results_ISP[ISP][classification_label] += 1
-
-            # if ("ATT (cellular" in ISP) or ("Verizon (cellular" in ISP) or ("TMobile (cellular" in ISP):
-            #     if ISP not in tests_for_plotting:
-            #         tests_for_plotting[ISP] = {}
-            #     if replayName not in tests_for_plotting[ISP]:
-            #         tests_for_plotting[ISP][replayName] = {}
-            #     if classification_label not in tests_for_plotting[ISP][replayName]:
-            #         tests_for_plotting[ISP][replayName][classification_label] = []
-            #     if len(tests_for_plotting[ISP][replayName][classification_label]) > 200:
-            #         continue
-            #     tests_for_plotting[ISP][replayName][classification_label].append(uniqTestID)
-            if "Verizon (cellular" in ISP:
-                userID = uniqTestID.split("_")[0]
-
-                if userID not in tests_for_plotting:
-                    tests_for_plotting[userID] = []
-                tests_for_plotting[userID].append(classification_label)
-
-            # count the number of cases of each classification
-            # what is the percentage of tests of ISP and ISP-replay that is of this classification
-            if classification_label not in classification_label_percentage:
-                # [x, y, {}], x is the number of cases, y is the percentage, {} is for individual ISP stat
-                classification_label_percentage[classification_label] = [0, 0, {}]
-            if ISP not in classification_label_percentage[classification_label][2]:
-                classification_label_percentage[classification_label][2][ISP] = [0, 0, {}]
-            if ISP_replay not in classification_label_percentage[classification_label][2][ISP][2]:
-                classification_label_percentage[classification_label][2][ISP][2][ISP_replay] = [0, 0]
-
-            classification_label_percentage[classification_label][2][ISP][2][ISP_replay][0] += 1
-            classification_label_percentage[classification_label][2][ISP][0] += 1
-            classification_label_percentage[classification_label][0] += 1
-
-            count_tests += 1
-            if ISP not in count_tests_ISP:
-                count_tests_ISP[ISP] = 0
-            count_tests_ISP[ISP] += 1
-            if ISP_replay not in count_tests_ISP_replay:
-                count_tests_ISP_replay[ISP_replay] = 0
-            count_tests_ISP_replay[ISP_replay] +=1
-
-    # print(classification_label_percentage)
-    classification_label_percentage = calculate_label_percentage(classification_label_percentage, count_tests, count_tests_ISP, count_tests_ISP_replay)
+        # [avg_client_tputs_original, avg_server_tputs_original, stdev_client_tputs_original,
+        #  stdev_server_tputs_original, loss_rate_original, loss_rate_inverted] of every test
+        test_ids, test_stats = test_stat_store.load_stats(test_stat, ISP_replay)
+        row_ISP_replay += [len(ISP_replays)] * len(test_ids)
+        ISP_replays.append(ISP_replay)
+        unique_test_ids += test_ids
+        stats.append(test_stats)
+
+    stats = np.concatenate(stats) if stats else np.zeros((0, 6))
+    row_ISP_replay = np.array(row_ISP_replay, dtype=int)
+
+    # 4 features, the ones the model is trained on
+    test_stat_features = test_stat_store.stat_features(stats)
+
+    # prediction with probability, all tests in one batch
+    # label 0 is unknown, otherwise the class with the highest probability (1, 2, ...),
+    # the tests with non-finite features are not classified, they are INVALID_LABEL
+    valid = test_stat_store.finite_rows(test_stat_features)
+    labels = np.full(len(test_stat_features), INVALID_LABEL, dtype=int)
+    if valid.any():
+        classification_results = trained_model.predict_proba(test_stat_features[valid])
+        labels[valid] = np.where(classification_results.max(axis=1) < predict_probability_threshold, 0,
+                                 classification_results.argmax(axis=1) + 1)
+    if not valid.all():
+        print("{} tests with a zero average throughput can not be classified, see invalid_test_ids.json".format(
+            int((~valid).sum())))
+
+    ISP_of_ISP_replay = [ISP_replay.split(")_")[0] for ISP_replay in ISP_replays]
+    replayName_of_ISP_replay = [ISP_replay.split(")_")[1] for ISP_replay in ISP_replays]
+    ISPs, ISP_replay_ISP, _ = group_by(ISP_of_ISP_replay)
+    row_ISP = ISP_replay_ISP[row_ISP_replay]
+
+    count_tests = len(labels)
+    count_tests_ISP = np.bincount(row_ISP, minlength=len(ISPs)).tolist()
+    count_tests_ISP_replay = np.bincount(row_ISP_replay, minlength=len(ISP_replays)).tolist()
+
+    label_counts = count_by(np.zeros(len(labels), dtype=int), labels)
+    label_counts_ISP = count_by(row_ISP, labels)
+    label_counts_ISP_replay = count_by(row_ISP_replay, labels)
+
+    classification_results_ISP = {ISP: {} for ISP in ISPs}
+    classification_results_ISP_replay = {ISP_replay: {} for ISP_replay in ISP_replays}
+    for ISP_index, label, count in label_counts_ISP:
+        classification_results_ISP[ISPs[ISP_index]][label_name(label)] = count
+    for ISP_replay_index, label, count in label_counts_ISP_replay:
+        classification_results_ISP_replay[ISP_replays[ISP_replay_index]][label_name(label)] = count
+
+    # count the number of cases of each classification
+    # what is the percentage of tests of ISP and ISP-replay that is of this classification
+    # [x, y, {}], x is the number of cases, y is the percentage, {} is for individual ISP stat
+    classification_label_percentage = {}
+    for _, label, count in label_counts:
+        classification_label_percentage[label_name(label)] = [count, count / count_tests, {}]
+    for ISP_index, label, count in label_counts_ISP:
+        classification_label_percentage[label_name(label)][2][ISPs[ISP_index]] = [
+            count, count / count_tests_ISP[ISP_index], {}]
+    for ISP_replay_index, label, count in label_counts_ISP_replay:
+        ISP = ISP_of_ISP_replay[ISP_replay_index]
+        classification_label_percentage[label_name(label)][2][ISP][2][ISP_replays[ISP_replay_index]] = [
+            count, count / count_tests_ISP_replay[ISP_replay_index]]
+
+    # record the uniqueID of each unknown test, plot them out for further analysis
+    for index in np.flatnonzero(labels == 0).tolist():
+        ISP_replay_index = row_ISP_replay[index]
+        ISP = ISP_of_ISP_replay[ISP_replay_index]
+        replayName = replayName_of_ISP_replay[ISP_replay_index]
+        unknown_test_ids.setdefault(ISP, {}).setdefault(replayName, []).append(unique_test_ids[index])
+    for index in np.flatnonzero(labels == INVALID_LABEL).tolist():
+        ISP_replay_index = row_ISP_replay[index]
+        ISP = ISP_of_ISP_replay[ISP_replay_index]
+        replayName = replayName_of_ISP_replay[ISP_replay_index]
+        invalid_test_ids.setdefault(ISP, {}).setdefault(replayName, []).append(unique_test_ids[index])
+
+    verizon_ISP_replays = [ISP_replay_index for ISP_replay_index, ISP in enumerate(ISP_of_ISP_replay)
+                           if "Verizon (cellular" in ISP]
+    for index in np.flatnonzero(np.isin(row_ISP_replay, verizon_ISP_replays)).tolist():
+        userID = unique_test_ids[index].split("_")[0]
+        tests_for_plotting.setdefault(userID, []).append(label_name(labels[index]))
 
     # simple_histogram_plot(zero_loss_difference_rates, plot_title="{}_".format("loss_difference_zero_percentage"))
     json.dump(classification_label_percentage, open("classification_label_percentage.json", "w"))
     json.dump(unknown_test_ids, open("unknown_test_ids.json", "w"))
+    json.dump(invalid_test_ids, open("invalid_test_ids.json", "w"))
     json.dump(classification_results_ISP, open("classification_results_ISP.json", "w"))
     json.dump(classification_results_ISP_replay, open("classification_results_ISP_replay.json", "w"))
     json.dump(tests_for_plotting, open("verizon_classification_label_per_user.json", "w"))
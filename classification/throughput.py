@@ -0,0 +1,197 @@
+'''
+Throughput samples from (timestamp, sequence number / bytes) series, shared by the classification and streaming scripts.
+
+All of them cut the series the same way:
+    untilT starts at one interval, the first packet at or after untilT closes a bucket,
+    the throughput of the bucket is the progress since the packet that closed the previous one,
+    and untilT moves forward by one interval (only one bucket is closed per packet)
+
+With sorted timestamps the packet closing bucket k is
+    i_k = max(s_k, i_(k-1) + 1),    s_k = first packet with time >= untilT_k
+which is k + running max of (s_j - j), so all the buckets are found with one searchsorted
+and one maximum.accumulate instead of a Python loop over every packet.
+The results are identical to the loops, run this file to compare both and time them:
+    python throughput.py <num_packets>
+'''
+
+import sys
+import time
+
+import numpy
+
+
+def bucket_ends_loop(timeL, xput_interval):
+    # the reference loop, also used when the timestamps are not sorted
+    untilT = xput_interval
+    ends = []
+    for i in range(len(timeL)):
+        if timeL[i] >= untilT:
+            ends.append(i)
+            untilT += xput_interval
+    return numpy.array(ends, dtype=numpy.int64)
+
+
+def bucket_ends(timeL, xput_interval):
+    # indexes of the packets closing every bucket
+    timeL = numpy.asarray(timeL, dtype=numpy.float64)
+    n = len(timeL)
+    if not n:
+        return numpy.zeros(0, dtype=numpy.int64)
+    if xput_interval <= 0 or numpy.any(timeL[1:] < timeL[:-1]):
+        return bucket_ends_loop(timeL.tolist(), xput_interval)
+
+    # untilT can not go past the last timestamp by more than one interval
+    num_buckets = min(n, int(timeL[-1] / xput_interval) + 3)
+    # cumsum adds the intervals one after the other, exactly as untilT += xput_interval does
+    untilT = numpy.cumsum(numpy.full(num_buckets, xput_interval))
+    first_after = numpy.searchsorted(timeL, untilT, side='left')
+    k = numpy.arange(num_buckets)
+    ends = k + numpy.maximum.accumulate(first_after - k)
+
+    return ends[ends < n]
+
+
+def progress_per_bucket(progress, ends, xput_interval):
+    starts = numpy.zeros(len(ends), dtype=numpy.int64)
+    starts[1:] = ends[:-1]
+    return (progress[ends] - progress[starts]) / xput_interval
+
+
+def doTputsInterval(timeL, packetL, client_sampling_interval):
+    initS = packetL[0]
+
+    sequence = numpy.asarray(packetL, dtype=numpy.int64) - int(initS)
+    timeL = numpy.asarray(timeL, dtype=numpy.float64)
+
+    xput_interval = client_sampling_interval
+
+    ends = bucket_ends(timeL, xput_interval)
+    tputs = progress_per_bucket(sequence, ends, xput_interval) * 8 / 1000000.0
+
+    return tputs.tolist(), timeL[ends].tolist()
+
+
+def doTputs(timeL, packetL, num_buckets=None):
+    if not num_buckets:
+        # If number of bucket is not specified, use 100 buckets
+        num_buckets = 100
+
+    duration = float(timeL[-1])
+    xput_interval = duration / num_buckets
+
+    return doTputsInterval(timeL, packetL, xput_interval)
+
+
+def get_goodput_from_bytes(bytes, timestamps, client_sampling_interval):
+    bytes = numpy.asarray(bytes)
+    timeL = numpy.asarray(timestamps, dtype=numpy.float64)
+
+    xput_interval = client_sampling_interval
+
+    ends = bucket_ends(timeL, xput_interval)
+    gputs = progress_per_bucket(bytes, ends, xput_interval) * 8
+
+    return gputs.tolist(), timeL[ends].tolist()
+
+
+def bytes_over_time_from_throughput(client_tputs, client_ts, start_timestamp=None):
+    sampling_interval = client_ts[1] - client_ts[0]
+
+    client_tputs = numpy.asarray(client_tputs, dtype=numpy.float64)
+    client_ts = numpy.asarray(client_ts, dtype=numpy.float64)
+
+    after_start = ~(client_ts < start_timestamp)
+    # cumsum adds the samples in order, the same float operations as the running total
+    received_bytes = numpy.cumsum(client_tputs[after_start] * sampling_interval * 1E6 / 8)
+    received_ts = client_ts[after_start] - start_timestamp
+
+    return received_ts.tolist(), received_bytes.tolist()
+
+
+def doTputsInterval_loop(timeL, packetL, client_sampling_interval):
+    # the per-packet loop the scripts used before, kept for the benchmark
+    initS = packetL[0]
+
+    sequence = [(int(x) - int(initS)) for x in packetL]
+    timeL = [float(x) for x in timeL]
+
+    xput_interval = client_sampling_interval
+
+    untilT = xput_interval
+    lastT = 0
+    tputs = []
+    ts = []
+    for i in range(len(timeL)):
+        # Calculate bytes sent during this period
+        if timeL[i] >= untilT:
+            tputs.append((sequence[i] - sequence[lastT]) / xput_interval)
+            lastT = i
+            untilT += xput_interval
+            ts.append(timeL[i])
+
+    tputs = [x * 8 / 1000000.0 for x in tputs]
+
+    return tputs, ts
+
+
+def bytes_over_time_from_throughput_loop(client_tputs, client_ts, start_timestamp=None):
+    received_bytes = []
+    received_ts = []
+
+    sampling_interval = client_ts[1] - client_ts[0]
+    current_bytes = 0
+
+    for i in range(len(client_tputs)):
+        if client_ts[i] < start_timestamp:
+            continue
+        current_bytes += client_tputs[i] * sampling_interval * 1E6 / 8
+        received_bytes.append(current_bytes)
+        received_ts.append(client_ts[i] - start_timestamp)
+
+    return received_ts, received_bytes
+
+
+def best_time(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def main():
+    try:
+        num_packets = int(sys.argv[1])
+    except:
+        num_packets = 1000000
+
+    # a replay at ~10Mbps with 1460 byte packets, a stall in the middle and a few sub-interval bursts
+    rng = numpy.random.RandomState(0)
+    gaps = rng.exponential(0.0012, num_packets)
+    gaps[num_packets // 2] = 5
+    timeL = numpy.cumsum(gaps).tolist()
+    packetL = (1 + 1460 * numpy.arange(num_packets)).tolist()
+    client_ts = numpy.arange(0.1, timeL[-1], 0.1).tolist()
+    client_tputs = rng.uniform(0, 20, len(client_ts)).tolist()
+
+    print("{:35} {:>12} {:>12} {:>9} {:>10}".format("function", "loop (s)", "numpy (s)", "speedup", "identical"))
+    for name, loop, vectorized, args in [
+        ("doTputsInterval 0.1s", doTputsInterval_loop, doTputsInterval, (timeL, packetL, 0.1)),
+        ("doTputsInterval 0.01s", doTputsInterval_loop, doTputsInterval, (timeL, packetL, 0.01)),
+        # what get_pcap_stat hands over: PacketTable columns
+        ("doTputsInterval 0.1s, arrays", doTputsInterval_loop, doTputsInterval,
+         (numpy.array(timeL), numpy.array(packetL, dtype=numpy.uint64), 0.1)),
+        ("bytes_over_time_from_throughput", bytes_over_time_from_throughput_loop, bytes_over_time_from_throughput,
+         (client_tputs, client_ts, 1.0)),
+    ]:
+        loop_time, loop_result = best_time(loop, *args)
+        numpy_time, numpy_result = best_time(vectorized, *args)
+        print("{:35} {:>12.4f} {:>12.4f} {:>9.1f} {:>10}".format(name, loop_time, numpy_time, loop_time / numpy_time,
+                                                                str(loop_result == numpy_result)))
+
+
+if __name__ == "__main__":
+    main()
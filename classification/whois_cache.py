@@ -0,0 +1,225 @@
+'''
+Persistent cache of whois answers for getRangeAndOrg.
+
+Every whois answer covers a whole address range (NetRange / inetnum), so the cache stores
+    [version, first, last, org, fetched]
+per range, and any later IP inside a cached range is answered without running whois.
+Ranges can be nested (an ISP block inside a RIR allocation), the most specific one wins:
+the ranges are flattened into sorted non-overlapping segments that point at the smallest
+range covering them, a lookup is one bisect.
+
+An IP inside a cached range gets that range's org even if whois would have answered with a
+smaller sub-allocation for it, the same org as the other clients of the range.
+
+Failed lookups are cached for the single IP with a shorter TTL so a client that whois
+times out on does not cost 3s on every one of its tests.
+
+New answers are kept in memory and written in batches, every FLUSH_EVERY answers or FLUSH_INTERVAL
+seconds and when the process exits (a --workers process too). A write merges them into the file
+under an flock on WHOIS_CACHE_FILE.lock, so processes writing at the same time do not lose each other's ranges.
+
+Environment variables:
+    WHOIS_CACHE_FILE      json file of the cache (default ~/.cache/throttling_whois_cache.json), empty to keep it in memory only
+    WHOIS_CACHE_TTL       seconds a range is trusted (default 30 days)
+    WHOIS_CACHE_FAIL_TTL  seconds a failed lookup is trusted (default 1 day)
+'''
+
+import atexit
+import bisect
+import fcntl
+import ipaddress
+import json
+import multiprocessing.util
+import os
+import tempfile
+import time
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "throttling_whois_cache.json")
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_FAIL_TTL = 24 * 3600
+# new answers are written to the file in batches of FLUSH_EVERY, or after FLUSH_INTERVAL seconds
+FLUSH_EVERY = 64
+FLUSH_INTERVAL = 60
+
+
+def cache_file():
+    return os.environ.get("WHOIS_CACHE_FILE", DEFAULT_CACHE_FILE)
+
+
+def ttl():
+    return int(os.environ.get("WHOIS_CACHE_TTL", DEFAULT_TTL))
+
+
+def fail_ttl():
+    return int(os.environ.get("WHOIS_CACHE_FAIL_TTL", DEFAULT_FAIL_TTL))
+
+
+def ip_to_int(ip):
+    address = ipaddress.ip_address(ip.strip())
+    return address.version, int(address)
+
+
+class RangeIndex(object):
+    '''
+    Address ranges with their org, looked up by address.
+    '''
+    def __init__(self, entries=()):
+        # (version, first, last) -> [version, first, last, org, fetched]
+        self.entries = {}
+        self.segments = None
+        for entry in entries:
+            self.add(*entry)
+
+    def add(self, version, first, last, org, fetched=None):
+        if fetched is None:
+            fetched = time.time()
+        key = (version, first, last)
+        old = self.entries.get(key)
+        # keep the newest answer for a range
+        if old is None or old[4] <= fetched:
+            self.entries[key] = [version, first, last, org, fetched]
+            self.segments = None
+
+    def expire(self, now=None):
+        if now is None:
+            now = time.time()
+        expired = [key for key, entry in self.entries.items()
+                   if now - entry[4] > (ttl() if entry[3] else fail_ttl())]
+        for key in expired:
+            del self.entries[key]
+        if expired:
+            self.segments = None
+        return len(expired)
+
+    def build(self):
+        # per IP version: sorted segment starts and the entry covering each segment (None for gaps)
+        self.segments = {}
+        for version in set(key[0] for key in self.entries):
+            ranges = [entry for key, entry in self.entries.items() if key[0] == version]
+            bounds = sorted(set([entry[1] for entry in ranges] + [entry[2] + 1 for entry in ranges]))
+            owner = [None] * len(bounds)
+            # paint failed lookups first and then the largest ranges first,
+            # so the most specific answered range ends up on top
+            for entry in sorted(ranges, key=lambda e: (e[3] is not None, e[1] - e[2])):
+                lo = bisect.bisect_left(bounds, entry[1])
+                hi = bisect.bisect_left(bounds, entry[2] + 1)
+                for i in range(lo, hi):
+                    owner[i] = entry
+            self.segments[version] = (bounds, owner)
+
+    def lookup(self, ip, now=None):
+        # (first, last, org) of the most specific live range containing ip, None if not cached
+        if now is None:
+            now = time.time()
+        try:
+            version, value = ip_to_int(ip)
+        except ValueError:
+            return None
+        if self.segments is None:
+            self.build()
+        if version not in self.segments:
+            return None
+        bounds, owner = self.segments[version]
+        i = bisect.bisect_right(bounds, value) - 1
+        if i < 0 or owner[i] is None:
+            return None
+        entry = owner[i]
+        if now - entry[4] > (ttl() if entry[3] else fail_ttl()):
+            return None
+        return entry[1], entry[2], entry[3]
+
+    def to_list(self):
+        return sorted(self.entries.values(), key=lambda e: (e[0], e[1], e[2]))
+
+
+# the cache of this process, loaded on first use
+_index = None
+# answers added since the last flush, the time of that flush and the process that registered the exit flush
+_pending = []
+_last_flush = time.time()
+_exit_flush_pid = None
+
+
+def load(path=None):
+    if path is None:
+        path = cache_file()
+    index = RangeIndex()
+    if path and os.path.exists(path):
+        try:
+            index = RangeIndex(json.load(open(path, 'r')))
+        except ValueError:
+            print("FAIL at loading whois cache", path)
+    index.expire()
+    return index
+
+
+def save(entries, path=None):
+    # merge entries into the cache file, returns the merged index
+    if path is None:
+        path = cache_file()
+    if not path:
+        return
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    # other processes (--workers) write the same file, the read-merge-write is done under a lock
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        merged = load(path)
+        for entry in entries:
+            merged.add(*entry)
+        merged.expire()
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(merged.to_list(), f)
+        os.replace(tmp_path, path)
+
+    return merged
+
+
+def get_index():
+    global _index
+    if _index is None:
+        _index = load()
+    return _index
+
+
+def lookup(ip):
+    return get_index().lookup(ip)
+
+
+def add(ip, first, last, org, save=True):
+    # first/last are None when whois gave no usable answer, remember the failure for this IP only,
+    # the answer is written with the next batch, save=False leaves the write to flush()
+    global _exit_flush_pid
+    if first is None:
+        version, first = ip_to_int(ip)
+        last = first
+    else:
+        version = ip_to_int(ip)[0]
+    get_index().add(version, first, last, org)
+    _pending.append(get_index().entries[(version, first, last)])
+
+    if _exit_flush_pid != os.getpid():
+        # a forked worker does not run atexit, multiprocessing runs its finalizers when it exits
+        atexit.register(flush)
+        multiprocessing.util.Finalize(None, flush, exitpriority=10)
+        _exit_flush_pid = os.getpid()
+    if save and (len(_pending) >= FLUSH_EVERY or time.time() - _last_flush >= FLUSH_INTERVAL):
+        flush()
+
+
+def flush():
+    global _index, _last_flush
+    _last_flush = time.time()
+    if not cache_file():
+        del _pending[:]
+        return
+    if not _pending:
+        return
+    try:
+        _index = save(list(_pending))
+        del _pending[:]
+    except OSError as e:
+        print("FAIL at saving whois cache", e)
@@ -0,0 +1,180 @@
+'''
+Resolve many client IPs with whois at once, before the tests are analyzed.
+
+getRangeAndOrg runs one whois at a time with a 3s timeout, on a cold cache that is most of
+the run time of a WiFi-heavy dataset. resolve_ips() takes every distinct IP up front and runs
+whois as asyncio subprocesses, at most `concurrency` at a time, with a per-call timeout and
+retries. The answers go to whois_cache, where getRangeAndOrg (and so getCarrierName) finds them.
+
+IPs already answered by whois_cache are skipped. The first round resolves one IP per /24
+(IPv4) or /48 (IPv6), the ranges it returns usually answer the other IPs of the prefix,
+only the ones still missing are resolved in a second round.
+
+Run this file to resolve a list of IPs (one per line), e.g. against a fake whois executable:
+    python whois_resolver.py [ip_file] <--concurrency N> <--timeout S> <--retries N> <--whois path>
+'''
+
+import asyncio
+import ipaddress
+import os
+import signal
+import sys
+
+import netaddr as neta
+
+import whois_cache
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_TIMEOUT = 3
+DEFAULT_RETRIES = 1
+
+
+def parse_whois(out):
+    # (IPRange, orgName, first, last) from a whois answer, the fields getRangeAndOrg reads,
+    # (None, None, None, None) when there is no range or no organization in it
+    try:
+        out = out.decode("utf-8")
+    except:
+        out = out
+
+    IPRange = None
+    orgName = None
+    netRange = None
+
+    # Get IP Range
+    if 'NetRange:' in out:
+        netRange = out.split('NetRange:')[1].split('\n')[0]
+        netRange = netRange.split()
+        IPRange = neta.IPRange(netRange[0], netRange[2])
+        first, last = IPRange.first, IPRange.last
+
+    # LACNIC/RIPE format
+    elif 'inetnum:' in out:
+        netRange = out.split('inetnum:')[1].split('\n')[0]
+        if '/' in netRange:
+            netRange = netRange.split()[0]
+            network = neta.IPNetwork(netRange)
+            IPRange = neta.IPSet(network)
+            first, last = network.first, network.last
+        else:
+            netRange = netRange.split()
+            IPRange = neta.IPRange(netRange[0], netRange[2])
+            first, last = IPRange.first, IPRange.last
+
+    # Get Organization
+    if 'OrgName:' in out:
+        orgName = out.split('OrgName:')[1].split('\n')[0]
+    elif 'Organization:' in out:
+        orgName = out.split('Organization:')[1].split('\n')[0]
+    elif 'owner:' in out:
+        orgName = out.split('owner:')[1].split('\n')[0]
+    elif 'org-name:' in out:
+        orgName = out.split('org-name:')[1].split('\n')[0]
+    elif 'abuse-mailbox:' in out:
+        orgName = out.split('abuse-mailbox:')[1].split('@')[1].split('.')[0]
+    elif 'netname:' in out:
+        orgName = out.split('netname:')[1].split('\n')[0]
+
+    if orgName and netRange:
+        return IPRange, orgName, first, last
+    else:
+        return None, None, None, None
+
+
+async def run_whois(ip, semaphore, whois_cmd, timeout, retries):
+    # whois output of ip, b'' if every attempt timed out or failed
+    for attempt in range(retries + 1):
+        async with semaphore:
+            try:
+                # own process group, so a timeout also kills whatever whois started
+                proc = await asyncio.create_subprocess_exec(whois_cmd, ip, stdout=asyncio.subprocess.PIPE,
+                                                            stderr=asyncio.subprocess.DEVNULL, start_new_session=True)
+            except OSError as e:
+                print("FAIL at running whois", whois_cmd, e)
+                return b''
+            try:
+                out, err = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+                await proc.wait()
+                continue
+        if out:
+            return out
+    return b''
+
+
+async def resolve_round(ips, concurrency, whois_cmd, timeout, retries):
+    semaphore = asyncio.Semaphore(concurrency)
+    outputs = await asyncio.gather(*[run_whois(ip, semaphore, whois_cmd, timeout, retries) for ip in ips])
+    return dict(zip(ips, outputs))
+
+
+def prefix_of(ip):
+    address = ipaddress.ip_address(ip)
+    return ipaddress.ip_network("{}/{}".format(ip, 24 if address.version == 4 else 48), strict=False)
+
+
+def resolve_ips(ips, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                whois_cmd='whois'):
+    # resolve every IP whois_cache can not answer yet, returns the number of whois runs
+    missing = []
+    for ip in sorted(set(ip.strip() for ip in ips if ip and ip.strip())):
+        try:
+            ipaddress.ip_address(ip)
+        except ValueError:
+            continue
+        if whois_cache.lookup(ip) is None:
+            missing.append(ip)
+
+    # one IP per prefix first, its range often covers the rest of the prefix
+    first_round = {}
+    for ip in missing:
+        first_round.setdefault(prefix_of(ip), ip)
+
+    runs = 0
+    for round_ips in [list(first_round.values()), None]:
+        if round_ips is None:
+            round_ips = [ip for ip in missing if whois_cache.lookup(ip) is None]
+        if not round_ips:
+            continue
+        outputs = asyncio.run(resolve_round(round_ips, concurrency, whois_cmd, timeout, retries))
+        runs += len(round_ips)
+        for ip in round_ips:
+            try:
+                IPRange, orgName, first, last = parse_whois(outputs[ip])
+            except Exception:
+                IPRange, orgName, first, last = None, None, None, None
+            whois_cache.add(ip, first, last, orgName, save=False)
+        whois_cache.flush()
+
+    return runs
+
+
+def main():
+    args = sys.argv[1:]
+    options = {"--concurrency": DEFAULT_CONCURRENCY, "--timeout": DEFAULT_TIMEOUT, "--retries": DEFAULT_RETRIES,
+               "--whois": "whois"}
+    for option in list(options):
+        if option in args:
+            i = args.index(option)
+            options[option] = type(options[option])(args[i + 1])
+            del args[i:i + 2]
+
+    try:
+        ip_file = args[0]
+    except:
+        print('\r\n Please provide the following inputs: [ip_file] <--concurrency N> <--timeout S> <--retries N> <--whois path>')
+        sys.exit()
+
+    ips = open(ip_file, 'r').read().split()
+    runs = resolve_ips(ips, options["--concurrency"], options["--timeout"], options["--retries"], options["--whois"])
+    print("{} IPs, {} whois runs".format(len(set(ips)), runs))
+    for ip in sorted(set(ips)):
+        print(ip, whois_cache.lookup(ip))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
 import os
-import subprocess
 import sys
 import json
 import statistics
 
+# the pcap parsing and throughput binning are shared with the classification scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "classification"))
+import pcap_reader
+import throughput
+
 QUALITY_TO_BITRATE = {
     "144p": 94963,
     "240p": 217649,
@@ -73,18 +77,13 @@ def get_video_stat(video_stat):
     return seconds_buffered, video_qualities, estimated_bandwidths, playing_bitrates, num_quality_change, instability_bitrate, joining_time, buffering_time, playing_time, buffering_events
 
 
-def get_pcap_seq_all_conns(pcapFile, server_port=None):
+def get_pcap_seq_all_conns(pcapFile, server_port=None, engine=None):
     if server_port is None:
         print('Please provide server Port')
         sys.exit()
 
-    src_port = 'tcp.srcport'
-
-    cmd = ['tshark', '-r', pcapFile, '-T', 'fields', '-E', 'separator=/t', '-e', src_port,
-           '-e', 'frame.time_relative', '-e', 'tcp.seq', '-e', 'frame.len', '-e', 'tcp.analysis.retransmission',
-           '-e', 'tcp.analysis.out_of_order']
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, err = p.communicate()
+    packets = pcap_reader.load_packets(pcapFile, engine=engine)
+    server_port = int(server_port)
 
     curr_bytes = 0
 
@@ -93,21 +92,10 @@ def get_pcap_seq_all_conns(pcapFile, server_port=None):
     timestamps_in = []
     seq_re = []
     timestamps_re = []
-    for sl in output.splitlines():
-        sl = sl.decode("utf-8")
-        l = sl.split('\t')
-        src_port = l[0]
-        try:
-            # Out of order
-            time = l[1]
-            seq = int(l[2])
-            frame_len = int(l[3])
-            ret = l[4]
-            # time relative to the beginning of the connection
-            out = l[5]
-        except:
-            continue
-
+    # time relative to the beginning of the capture, sequence number, frame length, retransmission
+    for src_port, time, seq, frame_len, ret in zip(packets["src_port"].tolist(), packets["time"].tolist(),
+                                                   packets["seq"].tolist(), packets["frame_len"].tolist(),
+                                                   packets["retransmission"].tolist()):
         if src_port == server_port:
             if ret:
                 seq_re.append(seq)
@@ -121,31 +109,9 @@ def get_pcap_seq_all_conns(pcapFile, server_port=None):
     return seq_re, timestamps_re, seq_in, timestamps_in, bytes_in
 
 
-def get_goodput_from_bytes(bytes, timestamps, client_sampling_interval):
-    timeL = [float(x) for x in timestamps]
-
-    xput_interval = client_sampling_interval
-
-    untilT = xput_interval
-    lastT = 0
-    gputs = []
-    ts = []
-    for i in range(len(timeL)):
-        # Calculate bytes sent during this period
-        if timeL[i] >= untilT:
-            gputs.append((bytes[i] - bytes[lastT]) / xput_interval)
-            lastT = i
-            untilT += xput_interval
-            ts.append(timeL[i])
-
-    gputs = [x * 8 for x in gputs]
-
-    return gputs, ts
-
-
 def get_transport_stat(pcap_file):
     seq_re, timestamps_re, seq_in, timestamps_in, bytes_in = get_pcap_seq_all_conns(pcap_file, server_port="80")
-    gputs, ts = get_goodput_from_bytes(bytes_in, timestamps_in, 0.5)
+    gputs, ts = throughput.get_goodput_from_bytes(bytes_in, timestamps_in, 0.5)
 
     return len(seq_re), len(seq_in), gputs
 
@@ -34,12 +34,18 @@ import subprocess
 import os
 import glob
 import json
+import numpy
 import pickle
 import statistics
 
 import matplotlib.pyplot as plt
 from sklearn.metrics import r2_score
 
+# the pcap parsing and throughput binning are shared with the classification scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "classification"))
+import pcap_reader
+import throughput
+
 APPNAME_TO_PORT = {
     "Vimeo": "443",
     "Spotify": "80",
@@ -176,300 +182,43 @@ def doXputsCDFplots(gputs_original, client_gputs_original, gputs_inverted,
     plt.close()
 
 
-def doTputsInterval(timeL, packetL, client_sampling_interval):
-    initS = packetL[0]
-
-    sequence = [(int(x) - int(initS)) for x in packetL]
-    timeL = [float(x) for x in timeL]
-
-    duration = timeL[-1]
-    xput_interval = client_sampling_interval
-
-    # print("duration, interval", duration, xput_interval)
-
-    untilT = xput_interval
-    lastT = 0
-    tputs = []
-    ts = []
-    for i in range(len(timeL)):
-        # Calculate bytes sent during this period
-        if timeL[i] >= untilT:
-            tputs.append((sequence[i] - sequence[lastT]) / xput_interval)
-            lastT = i
-            untilT += xput_interval
-            ts.append(timeL[i])
-
-    tputs = [x * 8 / 1000000.0 for x in tputs]
-
-    return tputs, ts
-
-
-def doTputs(timeL, packetL, num_buckets=None):
-    initS = packetL[0]
-
-    sequence = [(int(x) - int(initS)) for x in packetL]
-    timeL = [float(x) for x in timeL]
-
-    if not num_buckets:
-        # If number of bucket is not specified, use 100 buckets
-        num_buckets = 100
-    else:
-        num_buckets = num_buckets
-
-    duration = timeL[-1]
-    xput_interval = float(duration) / num_buckets
-
-    # print("duration, interval", duration, xput_interval)
-
-    untilT = xput_interval
-    lastT = 0
-    tputs = []
-    ts = []
-    for i in range(len(timeL)):
-        # Calculate bytes sent during this period
-        if timeL[i] >= untilT:
-            tputs.append((sequence[i] - sequence[lastT]) / xput_interval)
-            lastT = i
-            untilT += xput_interval
-            ts.append(timeL[i])
-
-    tputs = [x * 8 / 1000000.0 for x in tputs]
-
-    return tputs, ts
-
-
-def get_client_pcap_stat(pcapFile, server_port=None):
+def get_client_pcap_stat(pcapFile, server_port=None, engine=None):
     if server_port is None:
         print('Please provide server Port')
         sys.exit()
 
-    src_port = 'tcp.srcport'
-
-    cmd = ['tshark', '-r', pcapFile, '-T', 'fields', '-E', 'separator=/t', '-e', src_port, '-e',
-           'tcp.analysis.out_of_order',
-           '-e', 'tcp.analysis.retransmission',
-           '-e', 'tcp.seq', '-e', 'frame.time_relative', '-e', 'tcp.ack']
+    packets = pcap_reader.load_packets(pcapFile, engine=engine)
 
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, err = p.communicate()
-
-    # All Packets arrived on the client
-    arr_all_pList = []
-    arr_all_timeList = []
-
-    # Packets arrived on the client in order
-    arr_in_pList = []
-    arr_in_timeList = []
-    # Packets arrived on the client, re transmission
-    arr_ret_pList = []
-    arr_ret_timeList = []
-    # Packets arrived on the client, out-of-order transmission
-    arr_out_pList = []
-    arr_out_timeList = []
-
-    # All Packets sent from the client
-    sent_all_pList = []
-    sent_all_timeList = []
-
-    # Packets sent *from* client, in order
-    sent_in_pList = []
-    sent_in_timeList = []
-    # Packets sent *from* client, re transmission
-    sent_ret_pList = []
-    sent_ret_timeList = []
-    # Packets sent *from* client, out-of-order transmission
-    sent_out_pList = []
-    sent_out_timeList = []
-
-    for sl in output.splitlines():
-        sl = sl.decode("utf-8")
-        l = sl.split('\t')
-        src_port = l[0]
-        # Get the info of this packet
-        try:
-            # Out of order
-            out = l[1]
-            # Retransmission
-            ret = l[2]
-            # Sequence number
-            seq = l[3]
-            # time relative to the beginning of the connection
-            time = l[4]
-            # the ack number of this packet
-            ack = l[5]
-        except:
-            continue
-
-        # For packets sent from the server, put in the arr_* lists
-        if src_port == server_port:
-            arr_all_pList.append(seq)
-            arr_all_timeList.append(time)
-            if ret:
-                arr_ret_pList.append(seq)
-                arr_ret_timeList.append(time)
-            elif out:
-                arr_out_pList.append(seq)
-                arr_out_timeList.append(time)
-            else:
-                arr_in_pList.append(seq)
-                arr_in_timeList.append(time)
-        # For packets sent from on the client, put in the send_* lists
-        else:
-            sent_all_pList.append(ack)
-            sent_all_timeList.append(time)
-            if ret:
-                sent_ret_pList.append(ack)
-                sent_ret_timeList.append(time)
-            elif out:
-                sent_out_pList.append(ack)
-                sent_out_timeList.append(time)
-            else:
-                sent_in_pList.append(ack)
-                sent_in_timeList.append(time)
+    # In the client capture the packets sent from the server (table.sent_* masks, sequence numbers)
+    # are the ones arriving on the client, the rest (table.arr_* masks, ack numbers) are sent from the client
+    table = pcap_reader.PacketTable.from_packets(packets, int(server_port))
 
     start_timestamp = 0
-    start_seq = 0
-
-    arr_all_pList = [float(x) - start_seq for x in arr_all_pList]
-    arr_all_timeList = [float(x) - start_seq for x in arr_all_timeList]
-    arr_in_pList = [float(x) - start_seq for x in arr_in_pList]
-    arr_ret_pList = [float(x) - start_seq for x in arr_ret_pList]
-    arr_in_timeList = [float(x) - start_timestamp for x in arr_in_timeList]
-    arr_ret_timeList = [float(x) - start_timestamp for x in arr_ret_timeList]
 
-    return arr_all_pList, arr_all_timeList, arr_in_pList, arr_in_timeList, arr_ret_pList, arr_ret_timeList, start_timestamp
+    return table, start_timestamp
 
 
-def get_pcap_stat(pcapFile, server_port=None):
+def get_pcap_stat(pcapFile, server_port=None, engine=None):
     if server_port is None:
         print('Please provide server Port')
         sys.exit()
 
-    src_port = 'tcp.srcport'
+    packets = pcap_reader.load_packets(pcapFile, engine=engine)
 
-    cmd = ['tshark', '-r', pcapFile, '-T', 'fields', '-E', 'separator=/t', '-e', src_port, '-e',
-           'tcp.analysis.out_of_order',
-           '-e', 'tcp.analysis.retransmission',
-           '-e', 'tcp.seq', '-e', 'frame.time_relative', '-e', 'tcp.ack']
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, err = p.communicate()
-
-    # All Packets arrived on the server
-    arr_all_pList = []
-    arr_all_timeList = []
-
-    # Packets arrived on the server in order
-    arr_in_pList = []
-    arr_in_timeList = []
-    # Packets arrived on the server, re transmission
-    arr_ret_pList = []
-    arr_ret_timeList = []
-    # Packets arrived on the server, out-of-order transmission
-    arr_out_pList = []
-    arr_out_timeList = []
-
-    # All Packets sent from the server
-    sent_all_pList = []
-    sent_all_timeList = []
-
-    # Packets sent *from* server, in order
-    sent_in_pList = []
-    sent_in_timeList = []
-    # Packets sent *from* server, re transmission
-    sent_ret_pList = []
-    sent_ret_timeList = []
-    # Packets sent *from* server, out-of-order transmission
-    sent_out_pList = []
-    sent_out_timeList = []
-
-    arr_a_count = 0
-    arr_i_count = 0
-    arr_r_count = 0
-    arr_o_count = 0
-
-    sent_a_count = 0
-    sent_i_count = 0
-    sent_r_count = 0
-    sent_o_count = 0
-
-    for sl in output.splitlines():
-        # print(type(sl))
-        # sl = str(sl)
-        sl = sl.decode("utf-8")
-        l = sl.split('\t')
-        src_port = l[0]
-        # Get the info of this packet
-        try:
-            # Out of order
-            out = l[1]
-            # Retransmission
-            ret = l[2]
-            # Sequence number
-            seq = l[3]
-            # time relative to the beginning of the connection
-            time = l[4]
-            # the ack number of this packet
-            ack = l[5]
-        except:
-            continue
-        # For packets arrived on the server, record their ack numbers
-        # For packets sent from the server, record their sequence numbers
-
-        # For packets sent from the server, put in the sent_* lists
-        if src_port == server_port:
-            sent_all_pList.append(seq)
-            sent_all_timeList.append(time)
-            sent_a_count += 1
-            if ret:
-                sent_ret_pList.append(seq)
-                sent_ret_timeList.append(time)
-                sent_r_count += 1
-            elif out:
-                sent_out_pList.append(seq)
-                sent_out_timeList.append(time)
-                sent_o_count += 1
-            else:
-                sent_in_pList.append(seq)
-                sent_in_timeList.append(time)
-                sent_i_count += 1
-        # For packets arrived on the server, put in the arr_* lists
-        else:
-            arr_all_pList.append(ack)
-            arr_all_timeList.append(time)
-            arr_a_count += 1
-            if ret:
-                arr_ret_pList.append(ack)
-                arr_ret_timeList.append(time)
-                arr_r_count += 1
-            elif out:
-                arr_out_pList.append(ack)
-                arr_out_timeList.append(time)
-                arr_o_count += 1
-            else:
-                arr_in_pList.append(ack)
-                arr_in_timeList.append(time)
-                arr_i_count += 1
+    # One row per packet: time relative to the beginning of the capture, sequence number,
+    # ack number, whether it was sent from the server, retransmission and out of order flags.
+    # For packets sent from the server we use their sequence numbers (table.sent_* masks),
+    # for packets arrived on the server their ack numbers (table.arr_* masks)
+    table = pcap_reader.PacketTable.from_packets(packets, int(server_port))
 
     start_timestamp = 0
-    start_seq = 0
-
-    arr_all_pList = [float(x) - start_seq for x in arr_all_pList]
-    arr_all_timeList = [float(x) - start_seq for x in arr_all_timeList]
-    sent_in_pList = [float(x) - start_seq for x in sent_in_pList]
-    sent_ret_pList = [float(x) - start_seq for x in sent_ret_pList]
-    sent_in_timeList = [float(x) - start_timestamp for x in sent_in_timeList]
-    sent_ret_timeList = [float(x) - start_timestamp for x in sent_ret_timeList]
 
-    return sent_in_pList, sent_in_timeList, sent_ret_pList, sent_ret_timeList, sent_all_pList, sent_all_timeList, arr_all_pList, arr_all_timeList, sent_i_count, sent_r_count, sent_a_count, start_timestamp
+    return table, start_timestamp
 
 
 def timestamp_after_start(timestamps, start_timestamp):
-    cnt = 0
-    for timestamp in timestamps:
-        if float(timestamp) > start_timestamp:
-            break
-        cnt += 1
-    return cnt
+    # timestamps are sorted, index of the first one after start_timestamp
+    return int(numpy.searchsorted(timestamps, start_timestamp, side='right'))
 
 
 # data directory should have subdirectories:
@@ -509,23 +258,6 @@ def load_replay_files(data_directory, history_count, testID):
     return server_pcap_file, client_pcap_file, xputO, tsO
 
 
-def bytes_over_time_from_throughput(client_tputs, client_ts, start_timestamp=None):
-    received_bytes = []
-    received_ts = []
-
-    sampling_interval = client_ts[1] - client_ts[0]
-    current_bytes = 0
-
-    for i in range(len(client_tputs)):
-        if client_ts[i] < start_timestamp:
-            continue
-        current_bytes += client_tputs[i] * sampling_interval * 1E6 / 8
-        received_bytes.append(current_bytes)
-        received_ts.append(client_ts[i] - start_timestamp)
-
-    return received_ts, received_bytes
-
-
 def get_r_squared_score(seqs, time_stamps, throttling_rate, plot_title='test'):
     seqs = [int(x) for x in seqs]
     time_stamps = [float(x) for x in time_stamps]
@@ -728,25 +460,28 @@ def plot_test(data_directory, plot_historyCount, result_directory, server_port):
             original_server_pcap_file and original_client_pcap_file and client_ts_original):
         return False
 
-    sent_in_pList_original, sent_in_timeList_original, sent_ret_pList_original, sent_ret_timeList_original, sent_all_pList_original, sent_all_timeList_original, ack_all_pList_original, ack_all_timeList_original, sent_i_count_original, sent_r_count_original, sent_a_count_original, start_timestamp = get_pcap_stat(
-        original_server_pcap_file, server_port=server_port)
+    table_original, start_timestamp = get_pcap_stat(original_server_pcap_file, server_port=server_port)
+    client_table_original, start_timestamp = get_client_pcap_stat(original_client_pcap_file, server_port=server_port)
 
-    arr_client_all_pList, arr_client_all_timeList, arr_client_in_pList, arr_client_in_timeList, arr_client_ret_pList, arr_client_ret_timeList, start_timestamp = get_client_pcap_stat(
-        original_client_pcap_file, server_port=server_port)
+    sent_in_original = table_original[table_original.sent_in]
+    sent_ret_original = table_original[table_original.sent_ret]
+    arr_all_original = table_original[table_original.arr_all]
+    arr_client_in = client_table_original[client_table_original.sent_in]
+    arr_client_ret = client_table_original[client_table_original.sent_ret]
 
-    receive_timeList_original, receive_pList_original = bytes_over_time_from_throughput(client_tputs_original,
-                                                                                        client_ts_original,
-                                                                                        start_timestamp)
+    receive_timeList_original, receive_pList_original = throughput.bytes_over_time_from_throughput(client_tputs_original,
+                                                                                                   client_ts_original,
+                                                                                                   start_timestamp)
 
-    if not (sent_in_pList_original and arr_client_in_pList and receive_pList_original and ack_all_pList_original):
+    if not (len(sent_in_original) and len(arr_client_in) and receive_pList_original and len(arr_all_original)):
         return False
 
     client_sampling_interval = client_ts_original[1] - client_ts_original[0]
-    server_tputs_original, server_ts_original = doTputsInterval(sent_in_timeList_original, sent_in_pList_original,
-                                                                client_sampling_interval)
+    server_tputs_original, server_ts_original = throughput.doTputsInterval(sent_in_original.time, sent_in_original.seq,
+                                                                           client_sampling_interval)
 
-    client_tputs_original, client_ts_original = doTputsInterval(arr_client_in_timeList, arr_client_in_pList,
-                                                                client_sampling_interval)
+    client_tputs_original, client_ts_original = throughput.doTputsInterval(arr_client_in.time, arr_client_in.seq,
+                                                                           client_sampling_interval)
 
     if (len(client_tputs_original) < 10) or (len(server_tputs_original) < 10):
         return False
@@ -756,8 +491,8 @@ def plot_test(data_directory, plot_historyCount, result_directory, server_port):
     stdev_client_tputs_original = round(statistics.stdev(client_tputs_original), 5)
     stdev_server_tputs_original = round(statistics.stdev(server_tputs_original), 5)
 
-    loss_rate_original = round(sent_r_count_original / sent_a_count_original, 5)
-    loss_rate_client_original = round(len(arr_client_ret_pList) / len(arr_client_all_pList), 5)
+    loss_rate_original = round(int(table_original.sent_ret.sum()) / int(table_original.sent_all.sum()), 5)
+    loss_rate_client_original = round(int(client_table_original.sent_ret.sum()) / int(client_table_original.sent_all.sum()), 5)
 
     plot_title = "{}--{}--{}--{}--{}--{}--{}".format(plot_historyCount,
                                                      avg_client_tputs_original,
@@ -765,10 +500,10 @@ def plot_test(data_directory, plot_historyCount, result_directory, server_port):
                                                      stdev_server_tputs_original, loss_rate_original,
                                                      loss_rate_client_original)
 
-    plot_seq_throughput_over_time(sent_in_timeList_original, sent_in_pList_original, arr_client_in_timeList,
-                                  arr_client_in_pList,
-                                  sent_ret_timeList_original, sent_ret_pList_original, arr_client_ret_timeList,
-                                  arr_client_ret_pList,
+    plot_seq_throughput_over_time(sent_in_original.time, sent_in_original.seq, arr_client_in.time,
+                                  arr_client_in.seq,
+                                  sent_ret_original.time, sent_ret_original.seq, arr_client_ret.time,
+                                  arr_client_ret.seq,
                                   server_tputs_original, server_ts_original, client_tputs_original, client_ts_original,
                                   result_directory, plot_title=plot_title)
 
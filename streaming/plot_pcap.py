@@ -9,6 +9,10 @@ import statistics
 import matplotlib.pyplot as plt
 from sklearn.metrics import r2_score
 
+# the pcap parsing is shared with the classification scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "classification"))
+import pcap_reader
+
 try:
     import seaborn as sns
     sns.set()
@@ -125,68 +129,6 @@ def doXputsCDFplots(gputs_original, client_gputs_original, gputs_inverted,
     plt.close()
 
 
-def doTputsInterval(timeL, packetL, client_sampling_interval):
-    initS = packetL[0]
-
-    sequence = [(int(x) - int(initS)) for x in packetL]
-    timeL = [float(x) for x in timeL]
-
-    duration = timeL[-1]
-    xput_interval = client_sampling_interval
-
-    # print("duration, interval", duration, xput_interval)
-
-    untilT = xput_interval
-    lastT = 0
-    tputs = []
-    ts = []
-    for i in range(len(timeL)):
-        # Calculate bytes sent during this period
-        if timeL[i] >= untilT:
-            tputs.append((sequence[i] - sequence[lastT]) / xput_interval)
-            lastT = i
-            untilT += xput_interval
-            ts.append(timeL[i])
-
-    tputs = [x * 8 / 1000000.0 for x in tputs]
-
-    return tputs, ts
-
-
-def doTputs(timeL, packetL, num_buckets=None):
-    initS = packetL[0]
-
-    sequence = [(int(x) - int(initS)) for x in packetL]
-    timeL = [float(x) for x in timeL]
-
-    if not num_buckets:
-        # If number of bucket is not specified, use 100 buckets
-        num_buckets = 100
-    else:
-        num_buckets = num_buckets
-
-    duration = timeL[-1]
-    xput_interval = float(duration) / num_buckets
-
-    # print("duration, interval", duration, xput_interval)
-
-    untilT = xput_interval
-    lastT = 0
-    tputs = []
-    ts = []
-    for i in range(len(timeL)):
-        # Calculate bytes sent during this period
-        if timeL[i] >= untilT:
-            tputs.append((sequence[i] - sequence[lastT]) / xput_interval)
-            lastT = i
-            untilT += xput_interval
-            ts.append(timeL[i])
-
-    tputs = [x * 8 / 1000000.0 for x in tputs]
-
-    return tputs, ts
-
-
 def get_client_pcap_stat(pcapFile, server_port=None):
     if server_port is None:
         print('Please provide server Port')
@@ -199,9 +141,6 @@ def get_client_pcap_stat(pcapFile, server_port=None):
            '-e', 'tcp.analysis.retransmission',
            '-e', 'tcp.seq', '-e', 'frame.time_relative', '-e', 'tcp.ack']
 
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, err = p.communicate()
-
     # All Packets arrived on the client
     arr_all_pList = []
     arr_all_timeList = []
@@ -230,8 +169,7 @@ def get_client_pcap_stat(pcapFile, server_port=None):
     sent_out_pList = []
     sent_out_timeList = []
 
-    for sl in output.splitlines():
-        sl = sl.decode("utf-8")
+    for sl in pcap_reader.tshark_lines(cmd):
         l = sl.split('\t')
         src_port = l[0]
         # Get the info of this packet
@@ -300,8 +238,6 @@ def get_pcap_stat(pcapFile, server_port=None):
            'tcp.analysis.out_of_order',
            '-e', 'tcp.analysis.retransmission',
            '-e', 'tcp.seq', '-e', 'frame.time_relative', '-e', 'tcp.ack']
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, err = p.communicate()
 
     # All Packets arrived on the server
     arr_all_pList = []
@@ -341,10 +277,9 @@ def get_pcap_stat(pcapFile, server_port=None):
     sent_r_count = 0
     sent_o_count = 0
 
-    for sl in output.splitlines():
+    for sl in pcap_reader.tshark_lines(cmd):
         # print(type(sl))
         # sl = str(sl)
-        sl = sl.decode("utf-8")
         l = sl.split('\t')
         src_port = l[0]
         # Get the info of this packet
@@ -458,23 +393,6 @@ def load_replay_files(data_directory, history_count, testID):
     return server_pcap_file, client_pcap_file, xputO, tsO
 
 
-def bytes_over_time_from_throughput(client_tputs, client_ts, start_timestamp=None):
-    received_bytes = []
-    received_ts = []
-
-    sampling_interval = client_ts[1] - client_ts[0]
-    current_bytes = 0
-
-    for i in range(len(client_tputs)):
-        if client_ts[i] < start_timestamp:
-            continue
-        current_bytes += client_tputs[i] * sampling_interval * 1E6 / 8
-        received_bytes.append(current_bytes)
-        received_ts.append(client_ts[i] - start_timestamp)
-
-    return received_ts, received_bytes
-
-
 def get_r_squared_score(seqs, time_stamps, throttling_rate, plot_title='test'):
     seqs = [int(x) for x in seqs]
     time_stamps = [float(x) for x in time_stamps]
@@ -1,5 +1,4 @@
 import sys
-import subprocess
 import os
 import glob
 import json
@@ -10,6 +9,10 @@ import matplotlib
 import matplotlib.pyplot as plt
 from sklearn.metrics import r2_score
 
+# the pcap parsing is shared with the classification scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "classification"))
+import pcap_reader
+
 # try:
 #     import seaborn as sns
 #     sns.set()
@@ -111,8 +114,6 @@ def get_pcap_stat(pcapFile, server_port=None):
            'tcp.analysis.out_of_order',
            '-e', 'tcp.analysis.retransmission',
            '-e', 'tcp.seq', '-e', 'frame.time_relative', '-e', 'tcp.ack']
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, err = p.communicate()
 
     # All Packets arrived on the server
     arr_all_pList = []
@@ -152,10 +153,9 @@ def get_pcap_stat(pcapFile, server_port=None):
     sent_r_count = 0
     sent_o_count = 0
 
-    for sl in output.splitlines():
+    for sl in pcap_reader.tshark_lines(cmd):
         # print(type(sl))
         # sl = str(sl)
-        sl = sl.decode("utf-8")
         l = sl.split('\t')
         src_port = l[0]
         # Get the info of this packet
@@ -1,5 +1,4 @@
 import sys
-import subprocess
 import os
 import glob
 import json
@@ -10,6 +9,10 @@ import matplotlib
 import matplotlib.pyplot as plt
 from sklearn.metrics import r2_score
 
+# the pcap parsing is shared with the classification scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "classification"))
+import pcap_reader
+
 # try:
 #     import seaborn as sns
 #     sns.set()
@@ -110,8 +113,6 @@ def get_pcap_bytes(pcapFile, server_port=None):
     cmd = ['tshark', '-r', pcapFile, '-T', 'fields', '-E', 'separator=/t', '-e', src_port,
            '-e', 'frame.time_relative', '-e', 'frame.len', '-e', 'tcp.analysis.retransmission',
            '-e', 'tcp.analysis.out_of_order']
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, err = p.communicate()
 
     curr_bytes = 0
 
@@ -119,8 +120,7 @@ def get_pcap_bytes(pcapFile, server_port=None):
     timestamps_in = []
     received_bytes_re = []
     timestamps_re = []
-    for sl in output.splitlines():
-        sl = sl.decode("utf-8")
+    for sl in pcap_reader.tshark_lines(cmd):
         l = sl.split('\t')
         src_port = l[0]
         try:
@@ -1,5 +1,4 @@
 import sys
-import subprocess
 import os
 import glob
 import json
@@ -11,6 +10,11 @@ import matplotlib
 import matplotlib.pyplot as plt
 from sklearn.metrics import r2_score
 
+# the pcap parsing and throughput binning are shared with the classification scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "classification"))
+import pcap_reader
+import throughput
+
 # try:
 #     import seaborn as sns
 #     sns.set()
@@ -124,8 +128,6 @@ def get_pcap_seq_all_conns(pcapFile, server_port=None):
     cmd = ['tshark', '-r', pcapFile, '-T', 'fields', '-E', 'separator=/t', '-e', src_port,
            '-e', 'frame.time_relative', '-e', 'tcp.seq', '-e', 'frame.len', '-e', 'tcp.analysis.retransmission',
            '-e', 'tcp.analysis.out_of_order']
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, err = p.communicate()
 
     curr_bytes = 0
 
@@ -134,8 +136,7 @@ def get_pcap_seq_all_conns(pcapFile, server_port=None):
     timestamps_in = []
     seq_re = []
     timestamps_re = []
-    for sl in output.splitlines():
-        sl = sl.decode("utf-8")
+    for sl in pcap_reader.tshark_lines(cmd):
         l = sl.split('\t')
         src_port = l[0]
         try:
@@ -342,28 +343,6 @@ def plot_bandwidth_throughput(estimated_bandwidths, average_throughputs, gputs_0
     # ax1.xticks([], [])
 
 
-def get_goodput_from_bytes(bytes, timestamps, client_sampling_interval):
-    timeL = [float(x) for x in timestamps]
-
-    xput_interval = client_sampling_interval
-
-    untilT = xput_interval
-    lastT = 0
-    gputs = []
-    ts = []
-    for i in range(len(timeL)):
-        # Calculate bytes sent during this period
-        if timeL[i] >= untilT:
-            gputs.append((bytes[i] - bytes[lastT]) / xput_interval)
-            lastT = i
-            untilT += xput_interval
-            ts.append(timeL[i])
-
-    gputs = [x * 8 for x in gputs]
-
-    return gputs, ts
-
-
 def do_all_plots(pcap0, pcap1, label0, label1, video_stat):
     seconds_buffered, video_qualities, estimated_bandwidths, average_throughputs = parse_video_stat(video_stat)
 
@@ -382,8 +361,8 @@ def do_all_plots(pcap0, pcap1, label0, label1, video_stat):
                            seq_re_1, timestamps_re_1, seq_in_1, timestamps_in_1, label0, label1,
                            plot_until_time)
 
-    gputs_0, ts_0 = get_goodput_from_bytes(bytes_in_0, timestamps_in_0, 0.5)
-    gputs_1, ts_1 = get_goodput_from_bytes(bytes_in_1, timestamps_in_1, 0.5)
+    gputs_0, ts_0 = throughput.get_goodput_from_bytes(bytes_in_0, timestamps_in_0, 0.5)
+    gputs_1, ts_1 = throughput.get_goodput_from_bytes(bytes_in_1, timestamps_in_1, 0.5)
 
     plot_bandwidth_throughput(estimated_bandwidths, average_throughputs, gputs_0, ts_0, label0, gputs_1, ts_1, label1,
                               plot_until_time, video_qualities)